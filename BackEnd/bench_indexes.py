@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Index benchmark: seeds a scratch database on a local mongod with a library
+sized well past anything real (100k songs, 1M plays), builds the indexes from
+database.ensure_indexes and checks that every hot query is planned as an
+index scan rather than a collection scan.
+
+    python bench_indexes.py [--songs N] [--plays N] [--keep]
+
+Uses BENCH_MONGO_URL (default mongodb://localhost:27017) and drops the
+BENCH_DB database ("lazyio_bench") when done unless --keep is given.
+"""
+
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+from datetime import datetime, timedelta
+
+BENCH_MONGO_URL = os.getenv("BENCH_MONGO_URL", "mongodb://localhost:27017")
+BENCH_DB = os.getenv("BENCH_DB", "lazyio_bench")
+# database.py refuses to import without it; nothing here touches music_app
+os.environ.setdefault("DATABASE_URL", BENCH_MONGO_URL)
+
+import motor.motor_asyncio
+
+from database import ensure_indexes, _ensure_play_events, _play_rollup_updates, RECENT_PLAYS_DOC
+
+BATCH = 10000
+# _id lookups plan as IDHACK/EXPRESS_IXSCAN, time-series bucket bounds as CLUSTERED_IXSCAN
+INDEX_STAGES = {"IXSCAN", "IDHACK", "EXPRESS_IXSCAN", "CLUSTERED_IXSCAN"}
+
+
+async def _seed(db, songs: int, plays: int):
+    print(f"Seeding {songs} songs and {plays} plays into {BENCH_DB}...")
+    started = time.monotonic()
+    song_ids = []
+    for offset in range(0, songs, BATCH):
+        docs = [
+            {
+                "title": f"Song {n}",
+                "artist": f"Artist {n % 5000}",
+                "album": f"Album {n % 20000}",
+                "file_name": f"song_{n}.mp3",
+                "file_size": 4 * 1024 * 1024,
+                "duration": 180 + n % 120,
+            }
+            for n in range(offset, min(offset + BATCH, songs))
+        ]
+        result = await db.songs.insert_many(docs, ordered=False)
+        song_ids.extend(str(i) for i in result.inserted_ids)
+
+    # Plays go where the app writes them: raw events plus the rollups built
+    # from the same batch (play_events has to be created as time-series first)
+    await _ensure_play_events(db)
+    now = datetime.utcnow()
+    for offset in range(0, plays, BATCH):
+        batch = sorted(
+            ((random.choice(song_ids), now - timedelta(seconds=random.randint(0, 90 * 86400)))
+             for _ in range(min(BATCH, plays - offset))),
+            key=lambda play: play[1]
+        )
+        await db.play_events.insert_many(
+            [{"song_id": song_id, "played_at": played_at} for song_id, played_at in batch], ordered=False
+        )
+        await db.play_rollups.bulk_write(_play_rollup_updates(batch), ordered=False)
+
+    liked = random.sample(song_ids, min(len(song_ids), 2000))
+    await db.likes.insert_many(
+        [{"song_id": s, "liked": i % 4 != 0, "updated_at": now} for i, s in enumerate(liked)]
+    )
+    await db.youtube_tasks.insert_many(
+        [{"task_id": f"task-{n}", "status": "completed", "created_at": now - timedelta(minutes=n)} for n in range(5000)]
+    )
+    await db.peer_cache.insert_many(
+        [{"peer_id": -1000000000000 - n, "access_hash": n, "type": "channel"} for n in range(1000)]
+    )
+    print(f"Seeded in {time.monotonic() - started:.1f}s")
+    return song_ids
+
+
+def _plan_stages(explain) -> list:
+    """Every stage name inside every winningPlan of an explain() result."""
+    stages = []
+
+    def walk(node, in_plan):
+        if isinstance(node, dict):
+            if in_plan and "stage" in node:
+                stages.append(node["stage"])
+            for key, value in node.items():
+                walk(value, in_plan or key == "winningPlan")
+        elif isinstance(node, list):
+            for item in node:
+                walk(item, in_plan)
+
+    walk(explain, False)
+    return stages
+
+
+async def _check(name: str, explain, run) -> bool:
+    plan = await explain()
+    stages = _plan_stages(plan)
+    started = time.monotonic()
+    await run()
+    elapsed = (time.monotonic() - started) * 1000
+    ok = bool(INDEX_STAGES.intersection(stages)) and "COLLSCAN" not in stages
+    print(f"{'PASS' if ok else 'FAIL'}  {name:<32} {elapsed:8.1f} ms  {' > '.join(dict.fromkeys(stages))}")
+    return ok
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--songs", type=int, default=100000)
+    parser.add_argument("--plays", type=int, default=1000000)
+    parser.add_argument("--keep", action="store_true", help="don't drop the bench database afterwards")
+    args = parser.parse_args()
+
+    client = motor.motor_asyncio.AsyncIOMotorClient(BENCH_MONGO_URL)
+    await client.drop_database(BENCH_DB)
+    db = client[BENCH_DB]
+
+    try:
+        song_ids = await _seed(db, args.songs, args.plays)
+        started = time.monotonic()
+        await ensure_indexes(db)
+        print(f"Indexes built in {time.monotonic() - started:.1f}s\n")
+
+        probe = args.songs // 2
+        duplicate_check = {"$or": [{"file_name": f"song_{probe}.mp3"}, {"title": f"Song {probe}", "artist": f"Artist {probe % 5000}"}]}
+        since = datetime.utcnow() - timedelta(days=7)
+        # get_daily_play_counts
+        daily_pipeline = [
+            {"$match": {"day": {"$gte": since.strftime("%Y-%m-%d")}}},
+            {"$group": {"_id": "$day", "plays": {"$sum": "$count"}}},
+            {"$sort": {"_id": 1}},
+        ]
+
+        def find(collection, query, sort=None, limit=0):
+            def cursor():
+                c = collection.find(query)
+                if sort:
+                    c = c.sort(*sort)
+                return c.limit(limit)
+            return (lambda: cursor().explain(), lambda: cursor().to_list(None))
+
+        checks = [
+            ("songs: add_song duplicate check", *find(db.songs, duplicate_check, limit=1)),
+            ("play_events: last week", *find(db.play_events, {"played_at": {"$gte": since}})),
+            ("play_rollups: recent plays", *find(db.play_rollups, {"_id": RECENT_PLAYS_DOC}, limit=1)),
+            ("play_rollups: daily counts", lambda: db.command("aggregate", "play_rollups", pipeline=daily_pipeline, explain=True),
+             lambda: db.play_rollups.aggregate(daily_pipeline).to_list(None)),
+            ("likes: by song", *find(db.likes, {"song_id": random.choice(song_ids)}, limit=1)),
+            ("likes: liked", *find(db.likes, {"liked": True})),
+            ("youtube_tasks: by task_id", *find(db.youtube_tasks, {"task_id": "task-2500"}, limit=1)),
+            ("youtube_tasks: newest page", *find(db.youtube_tasks, {}, sort=("created_at", -1), limit=20)),
+            ("peer_cache: by peer_id", *find(db.peer_cache, {"peer_id": -1000000000500}, limit=1)),
+        ]
+        results = [await _check(name, explain, run) for name, explain, run in checks]
+    finally:
+        if not args.keep:
+            await client.drop_database(BENCH_DB)
+
+    failed = results.count(False)
+    print(f"\n{len(results) - failed}/{len(results)} queries use an index")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
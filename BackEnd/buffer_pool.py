@@ -0,0 +1,106 @@
+"""
+Buffer Pool Module
+Preallocated block-sized slabs for reading cached blocks, so serving from
+disk doesn't allocate a fresh 512 KiB bytes object per block per client.
+
+Readers fill a slab with readinto() and hand out a memoryview of it. The
+view goes all the way to the ASGI send without a copy. A slab goes back
+into circulation only once no view of it is alive any more (the transport
+may still hold one while it drains). A bytearray refuses to resize while
+any memoryview of it exists, so a trial append tells whether it's free.
+Lent slabs are checked on every read, not only once the pool runs dry, so
+slabs come back as soon as their views die. Anything that keeps a block
+around for long (read-ahead) should hold a copy instead, see hold().
+"""
+
+import os
+import threading
+from collections import deque
+from typing import Callable, List, Optional
+
+SLAB_SIZE = 512 * 1024  # one chunk_cache block (CHUNK_SIZE)
+BUFFER_POOL_SLABS = int(os.getenv("BUFFER_POOL_MB", "16")) * 1024 * 1024 // SLAB_SIZE
+
+
+
+def _exported(slab: bytearray) -> bool:
+    """True while any memoryview of the slab is alive."""
+    try:
+        slab.append(0)
+    except BufferError:
+        return True
+    slab.pop()
+    return False
+
+
+class BufferPool:
+    def __init__(self, slab_size: int = SLAB_SIZE, slabs: int = BUFFER_POOL_SLABS):
+        self.slab_size = slab_size
+        self.max_slabs = slabs
+        self._free = deque(bytearray(slab_size) for _ in range(slabs))
+        self._lent: List[bytearray] = []  # handed out, waiting for their views to die
+        self._lock = threading.Lock()  # slabs are filled on executor threads
+        self.reused = 0
+        self.allocated = 0
+
+    def _reclaim(self):
+        still_used = []
+        for slab in self._lent:
+            if not _exported(slab):
+                self._free.append(slab)
+            else:
+                still_used.append(slab)
+        self._lent = still_used
+
+    def read(self, length: int, fill: Callable[[memoryview], int]) -> Optional[memoryview]:
+        """
+        Fill up to `length` bytes with fill(view) -> bytes written (e.g. a
+        file's readinto) and return a read-only view of them.
+        """
+        if length > self.slab_size:
+            buffer = bytearray(length)
+            pooled = False
+        else:
+            with self._lock:
+                if self._lent:
+                    self._reclaim()
+                if self._free:
+                    buffer = self._free.popleft()
+                    pooled = True
+                    self.reused += 1
+                else:
+                    # Pool exhausted: a one-off buffer, left to the GC
+                    buffer = bytearray(self.slab_size)
+                    pooled = False
+                    self.allocated += 1
+
+        try:
+            n = fill(memoryview(buffer)[:length])
+        except BaseException:
+            if pooled:
+                with self._lock:
+                    self._free.append(buffer)
+            raise
+        view = memoryview(buffer)[:n].toreadonly()
+        if pooled:
+            with self._lock:
+                self._lent.append(buffer)
+        return view
+
+    @staticmethod
+    def hold(data):
+        """A copy of a block that may be a pooled view, for keeping beyond one send."""
+        return bytes(data) if isinstance(data, memoryview) else data
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "slabs": self.max_slabs,
+                "free": len(self._free),
+                "lent": len(self._lent),
+                "reused": self.reused,
+                "overflow_allocations": self.allocated,
+            }
+
+
+buffer_pool = BufferPool()
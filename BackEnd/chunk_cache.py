@@ -0,0 +1,196 @@
+"""
+Chunk Cache Module
+Keeps aligned blocks of Telegram media on local disk so repeat plays
+and re-requested Ranges don't hit Telegram again.
+"""
+
+import os
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from buffer_pool import buffer_pool
+
+# Telegram's upload.getFile accepts 512 KiB requests on 512 KiB boundaries,
+# so one cache block maps onto exactly one RPC.
+CHUNK_SIZE = 512 * 1024
+
+CACHE_DIR = os.getenv("CHUNK_CACHE_DIR", os.path.join(os.path.dirname(__file__), "temp_uploads", "chunk_cache"))
+CACHE_MAX_BYTES = int(os.getenv("CHUNK_CACHE_MAX_MB", "256")) * 1024 * 1024
+
+
+class ChunkCache:
+    """
+    On-disk block cache keyed by (message_id, chunk index).
+
+    Every block lives in its own file, written to a temp name and renamed
+    into place so a crash never leaves a half-written block behind.
+    Eviction is LRU against a byte budget. invalidate() bumps the
+    message's generation; background writes started before it are dropped
+    instead of putting blocks of a removed or replaced file back.
+    """
+
+    def __init__(self, cache_dir: str = CACHE_DIR, max_bytes: int = CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Tuple[int, int], int]" = OrderedDict()  # key -> size
+        self._size = 0
+        self._generations: Dict[int, int] = {}  # message_id -> invalidate() count
+        self._lock = threading.Lock()  # index is touched from executor threads
+        self.hits = 0
+        self.misses = 0
+
+        if self.enabled:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._load_index()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _path(self, message_id: int, index: int) -> str:
+        return os.path.join(self.cache_dir, str(message_id), f"{index}.chunk")
+
+    def _load_index(self):
+        """Rebuild the LRU index from disk, oldest blocks first."""
+        found = []
+        for msg_dir in os.listdir(self.cache_dir):
+            dir_path = os.path.join(self.cache_dir, msg_dir)
+            if not msg_dir.lstrip("-").isdigit() or not os.path.isdir(dir_path):
+                continue
+            for name in os.listdir(dir_path):
+                path = os.path.join(dir_path, name)
+                if not name.endswith(".chunk"):
+                    # Leftover temp file from an interrupted write
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                    continue
+                try:
+                    st = os.stat(path)
+                    found.append((st.st_mtime, (int(msg_dir), int(name[:-6])), st.st_size))
+                except (OSError, ValueError):
+                    continue
+
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._size += size
+
+        self._evict()
+        print(f"[CHUNK_CACHE] Loaded {len(self._entries)} blocks ({self._size / (1024 * 1024):.1f} MB) from {self.cache_dir}")
+
+    def _evict(self):
+        """Drop least recently used blocks until we're within budget. Caller holds no lock."""
+        victims = []
+        with self._lock:
+            while self._size > self.max_bytes and self._entries:
+                key, size = self._entries.popitem(last=False)
+                self._size -= size
+                victims.append(key)
+
+        for message_id, index in victims:
+            try:
+                os.remove(self._path(message_id, index))
+            except OSError:
+                pass
+
+    def _read(self, message_id: int, index: int) -> Optional[memoryview]:
+        path = self._path(message_id, index)
+        try:
+            with open(path, "rb", buffering=0) as f:
+                data = buffer_pool.read(os.fstat(f.fileno()).st_size, f.readinto)
+            os.utime(path)  # keep on-disk order close to LRU order across restarts
+            return data
+        except OSError:
+            with self._lock:
+                size = self._entries.pop((message_id, index), None)
+                if size is not None:
+                    self._size -= size
+            return None
+
+    def _write(self, message_id: int, index: int, data: bytes, generation: int):
+        path = self._path(message_id, index)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            with self._lock:
+                # Invalidated while we were writing: the block belongs to a file that's gone
+                if self._generations.get(message_id, 0) != generation:
+                    os.remove(tmp_path)
+                    return
+                os.replace(tmp_path, path)
+                old = self._entries.pop((message_id, index), None)
+                if old is not None:
+                    self._size -= old
+                self._entries[(message_id, index)] = len(data)
+                self._size += len(data)
+        except OSError as e:
+            print(f"[CHUNK_CACHE] Write failed for {message_id}/{index}: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        self._evict()
+
+    def contains(self, message_id: int, index: int) -> bool:
+        return (message_id, index) in self._entries
+
+    async def get(self, message_id: int, index: int) -> Optional[memoryview]:
+        """Return a cached block (a read-only view of a pooled buffer), or None on a miss."""
+        if not self.enabled:
+            return None
+
+        key = (message_id, index)
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+
+        data = await asyncio.get_event_loop().run_in_executor(None, self._read, message_id, index)
+        if data is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return data
+
+    def put(self, message_id: int, index: int, data: bytes):
+        """Store a block in the background. Returns the executor future."""
+        if not self.enabled or not data or len(data) > self.max_bytes:
+            return None
+        generation = self._generations.get(message_id, 0)
+        return asyncio.get_event_loop().run_in_executor(None, self._write, message_id, index, data, generation)
+
+    def invalidate(self, message_id: int):
+        """Forget every block of a message (e.g. after the song was deleted)."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._generations[message_id] = self._generations.get(message_id, 0) + 1
+            keys = [k for k in self._entries if k[0] == message_id]
+            for key in keys:
+                self._size -= self._entries.pop(key)
+
+        msg_dir = os.path.join(self.cache_dir, str(message_id))
+        if os.path.isdir(msg_dir):
+            import shutil
+            shutil.rmtree(msg_dir, ignore_errors=True)
+
+    def stats(self) -> dict:
+        return {
+            "blocks": len(self._entries),
+            "bytes": self._size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+chunk_cache = ChunkCache()
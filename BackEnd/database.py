@@ -1,8 +1,17 @@
 import os
+import time
+import base64
+import asyncio
+from collections import Counter
+from typing import Dict, List, Optional
 import motor.motor_asyncio
-from bson import ObjectId
+from bson import ObjectId, json_util
+from pymongo import ASCENDING, DESCENDING, DeleteOne, IndexModel, UpdateOne
+from pymongo.errors import CollectionInvalid, DuplicateKeyError, OperationFailure
 from dotenv import load_dotenv
 
+from search_index import search_index
+
 # Load env from root or current dir
 load_dotenv("config.env")
 load_dotenv("../config.env")
@@ -42,12 +51,345 @@ def song_helper(song) -> dict:
         "file_name": file_name,
         "file_size": song.get("file_size"),
         "media_type": media_type,
+        "has_hls": bool(song.get("hls_index")),
     }
 
-async def init_db():
-    # Motor handles connection pooling automatically
+# Fields song_helper doesn't need: skip the feature vectors and HLS segment tables
+# (read on demand by get_all_audio_features / get_song_hls_index)
+SONG_LIST_PROJECTION = {"audio_features": 0, "hls_index.segments": 0}
+
+# ==================== Library Versioning ====================
+# Every change to what song_helper exposes bumps a global counter and is
+# logged in song_changes, so clients can revalidate /api/songs with an ETag
+# and fetch deltas instead of the whole library.
+counters_collection = db.get_collection("counters")
+song_changes_collection = db.get_collection("song_changes")
+LIBRARY_COUNTER = "library_version"
+# A version allocated but not logged this long after a later one is treated
+# as lost (the bump died between the two writes) instead of waited for
+LIBRARY_GAP_SECONDS = 30
+
+
+async def get_library_version() -> int:
+    doc = await counters_collection.find_one({"_id": LIBRARY_COUNTER})
+    return doc["seq"] if doc else 0
+
+
+async def _bump_library_version(song_id, op: str = "upsert") -> int:
+    """Allocate the next library version and log which song it touched."""
+    from datetime import datetime
+    from pymongo import ReturnDocument
+    doc = await counters_collection.find_one_and_update(
+        {"_id": LIBRARY_COUNTER},
+        {"$inc": {"seq": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    version = doc["seq"]
+    await song_changes_collection.insert_one({
+        "version": version,
+        "song_id": str(song_id),
+        "op": op,
+        "changed_at": datetime.utcnow()
+    })
+    if op == "upsert":
+        await songs_collection.update_one({"_id": ObjectId(song_id)}, {"$max": {"version": version}})
+    await song_catalog.refresh(song_id, version)
+    return version
+
+
+async def get_library_changes(since: int) -> dict:
+    """
+    Songs inserted/updated and ids deleted after version `since`.
+    `reset` is True when the log no longer reaches back that far and the
+    client has to reload the full library.
+    """
+    version = await get_library_version()
+    if since >= version:
+        return {"version": version, "reset": False, "upserted": [], "deleted": []}
+
+    oldest = await song_changes_collection.find_one({}, sort=[("version", 1)])
+    if since < 0 or not oldest or oldest["version"] > since + 1:
+        return {"version": version, "reset": True, "upserted": [], "deleted": []}
+
+    # Versions are allocated before they're logged, so concurrent bumps can log
+    # out of order. Report only up to the last version with nothing missing
+    # below it: a client resuming from there won't skip a late-logged change.
+    from datetime import datetime, timedelta
+    lost_before = datetime.utcnow() - timedelta(seconds=LIBRARY_GAP_SECONDS)
+    latest = {}  # latest op per song wins
+    reached = since
+    async for change in song_changes_collection.find({"version": {"$gt": since}}).sort("version", 1):
+        if change["version"] != reached + 1 and change["changed_at"] > lost_before:
+            break
+        latest[change["song_id"]] = change["op"]
+        reached = change["version"]
+    version = reached
+
+    upserted_ids = [ObjectId(sid) for sid, op in latest.items() if op == "upsert"]
+    deleted = [sid for sid, op in latest.items() if op == "delete"]
+    upserted = []
+    if upserted_ids:
+        async for song in songs_collection.find({"_id": {"$in": upserted_ids}}, SONG_LIST_PROJECTION):
+            upserted.append(song_helper(song))
+    return {"version": version, "reset": False, "upserted": upserted, "deleted": deleted}
+
+
+# ==================== Song Catalog ====================
+# Process-local copy of every song's song_helper projection, so id lookups
+# (playlists, queue, home, likes) are dict hits instead of one query each.
+# Kept current by a change stream on songs, or on standalone mongod (no
+# replica set, so no change streams) by polling the library version.
+CATALOG_POLL_SECONDS = float(os.getenv("CATALOG_POLL_SECONDS", "5"))
+
+
+class SongCatalog:
+    def __init__(self):
+        self.songs = {}  # id -> song_helper dict
+        self.version = 0  # library version the catalog is known to include
+        self.loaded = False
+        self.mode = None
+        self._task = None
+
+    async def load(self):
+        version = await get_library_version()  # before the scan: may lag, never lead
+        songs = {}
+        async for song in songs_collection.find({}, SONG_LIST_PROJECTION):
+            songs[str(song["_id"])] = song_helper(song)
+        await search_index.rebuild_async(songs.values())
+        self.songs = songs
+        self.version = version
+        self.loaded = True
+        print(f"[CATALOG] Loaded {len(songs)} songs (library version {version})")
+
+    def get(self, song_id: str):
+        song = self.songs.get(song_id)
+        return dict(song) if song else None
+
+    def all(self) -> list:
+        # ObjectId hex sorts by creation time: newest first like find().sort("_id", -1)
+        return [dict(self.songs[sid]) for sid in sorted(self.songs, reverse=True)]
+
+    def _apply(self, song: dict = None, deleted_id: str = None):
+        if song is not None:
+            self._put(song_helper(song))
+        if deleted_id is not None:
+            self.songs.pop(deleted_id, None)
+            search_index.remove(deleted_id)
+
+    def _put(self, song: dict):
+        self.songs[song["id"]] = song
+        search_index.add(song)
+
+    async def refresh(self, song_id: str, version: int = None):
+        """Re-read one song after a local write (read-your-writes without waiting for sync)."""
+        if not self.loaded:
+            return
+        try:
+            song = await songs_collection.find_one({"_id": ObjectId(song_id)}, SONG_LIST_PROJECTION)
+        except Exception:
+            return
+        if song:
+            self._apply(song=song)
+        else:
+            self._apply(deleted_id=str(song_id))
+        if version is not None and version == self.version + 1:
+            self.version = version
+
+    async def _catch_up(self):
+        """Apply logged changes after self.version (or reload if the log has gaps)."""
+        changes = await get_library_changes(self.version)
+        if changes["reset"]:
+            await self.load()
+            return
+        for song_id in changes["deleted"]:
+            self._apply(deleted_id=song_id)
+        for song in changes["upserted"]:
+            self._put(song)
+        self.version = changes["version"]
+
+    async def _watch(self):
+        # Leave the heavy fields out of the looked-up documents too
+        pipeline = [{"$project": {f"fullDocument.{field}": 0 for field in SONG_LIST_PROJECTION}}]
+        # Delete events carry no library version, so the version (the /api/songs
+        # ETag) is also advanced from the change log, deletes included
+        sync = asyncio.ensure_future(self._sync_version())
+        try:
+            async with songs_collection.watch(pipeline, full_document="updateLookup") as stream:
+                self.mode = "change_stream"
+                await self._catch_up()  # whatever changed between load() and the stream opening
+                async for change in stream:
+                    op = change["operationType"]
+                    if op in ("insert", "update", "replace") and change.get("fullDocument"):
+                        song = change["fullDocument"]
+                        self._apply(song=song)
+                        self.version = max(self.version, song.get("version", 0))
+                    elif op == "delete":
+                        self._apply(deleted_id=str(change["documentKey"]["_id"]))
+        finally:
+            sync.cancel()
+
+    async def _sync_version(self):
+        """Apply logged changes (upserts and deletes) whenever the library version moves."""
+        while True:
+            await asyncio.sleep(CATALOG_POLL_SECONDS)
+            try:
+                if await get_library_version() > self.version:
+                    await self._catch_up()
+            except Exception as e:
+                print(f"[CATALOG] Poll failed: {e}")
+
+    async def _poll(self):
+        self.mode = "polling"
+        await self._sync_version()
+
+    async def _run(self):
+        from pymongo.errors import OperationFailure
+        while not self.loaded:
+            try:
+                await self.load()
+            except Exception as e:
+                print(f"[CATALOG] Load failed, retrying: {e}")
+                await asyncio.sleep(CATALOG_POLL_SECONDS)
+        try:
+            await self._watch()
+        except OperationFailure as e:
+            print(f"[CATALOG] Change streams unavailable ({e.code}), polling every {CATALOG_POLL_SECONDS}s")
+        except Exception as e:
+            print(f"[CATALOG] Change stream ended ({e}), falling back to polling")
+        await self._poll()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> dict:
+        return {"loaded": self.loaded, "songs": len(self.songs), "version": self.version, "mode": self.mode,
+                "search": search_index.stats()}
+
+
+song_catalog = SongCatalog()
+
+
+async def get_library_snapshot():
+    """(version, songs) that belong together, for ETag'd full listings."""
+    if song_catalog.loaded:
+        return song_catalog.version, song_catalog.all()
+    version = await get_library_version()
+    return version, await get_all_songs()
+
+
+# ==================== Pagination ====================
+# Listings page by keyset: a page is "the next `limit` documents after this
+# sort key", so page 500 costs the same as page 1. The continuation token is
+# the last document's sort key, opaque to clients. Page numbers still work
+# (skip/limit) for callers that haven't moved to cursors.
+COUNT_CACHE_SECONDS = int(os.getenv("COUNT_CACHE_SECONDS", "300"))
+
+
+class InvalidCursor(ValueError):
     pass
 
+
+def encode_cursor(values: list) -> str:
+    payload = json_util.dumps(values).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+
+def decode_cursor(token: str, fields: int) -> list:
+    try:
+        values = json_util.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(f"Invalid cursor: {e}")
+    if not isinstance(values, list) or len(values) != fields:
+        raise InvalidCursor("Invalid cursor")
+    return values
+
+
+def _after(fields: list, values: list) -> dict:
+    """Filter for documents past `values` in descending (fields...) order."""
+    clauses = []
+    for i, (field, value) in enumerate(zip(fields, values)):
+        prefix = dict(zip(fields[:i], values[:i]))
+        if value is not None:
+            clauses.append({**prefix, field: {"$lt": value}})
+            if field != "_id":
+                clauses.append({**prefix, field: None})  # missing/null sorts last
+    return {"$or": clauses} if clauses else {"_id": {"$exists": False}}
+
+
+async def _page(collection, fields: list, page: int, limit: int, cursor: str = None):
+    """(documents, next_cursor) for one page in descending (fields...) order."""
+    query = _after(fields, decode_cursor(cursor, len(fields))) if cursor else {}
+    find = collection.find(query).sort([(field, -1) for field in fields])
+    if not cursor and page > 1:
+        find = find.skip((page - 1) * limit)  # page-number compatibility
+    docs = await find.limit(limit + 1).to_list(None)
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = encode_cursor([docs[-1].get(field) for field in fields])
+    return docs, next_cursor
+
+
+class CountCache:
+    """
+    Collection sizes for listings, kept up to date by this module's inserts
+    and deletes and recounted every COUNT_CACHE_SECONDS to pick up anything
+    written elsewhere.
+    """
+
+    def __init__(self):
+        self._counts: Dict[str, tuple] = {}  # name -> (count, counted_at)
+
+    async def get(self, collection) -> int:
+        cached = self._counts.get(collection.name)
+        if cached and time.monotonic() - cached[1] < COUNT_CACHE_SECONDS:
+            return cached[0]
+        count = await collection.count_documents({})
+        self._counts[collection.name] = (count, time.monotonic())
+        return count
+
+    def adjust(self, collection, delta: int):
+        cached = self._counts.get(collection.name)
+        if cached:
+            self._counts[collection.name] = (max(cached[0] + delta, 0), cached[1])
+
+    def invalidate(self, collection):
+        self._counts.pop(collection.name, None)
+
+
+collection_counts = CountCache()
+
+
+def _paged(key: str, items: list, page: int, limit: int, total: int, next_cursor: str) -> dict:
+    return {
+        key: items,
+        "page": page,
+        "limit": limit,
+        "total": total,
+        "pages": (total + limit - 1) // limit if total > 0 else 1,
+        "next_cursor": next_cursor,
+    }
+
+
+async def init_db():
+    # Motor handles connection pooling automatically.
+    # play_events has to exist (as time-series) before the first flush; the
+    # index builds can take minutes on a big library, so they run in the
+    # background and queries simply scan until they're done.
+    await _ensure_play_events(db)
+    asyncio.ensure_future(_build_indexes(db))
+    asyncio.ensure_future(_build_indexes(client.get_database(PEER_CACHE_DATABASE), PEER_CACHE_INDEXES))
+    signal_buffer.start()
+    # The song catalog loads in the background; lookups use MongoDB until it's ready.
+    song_catalog.start()
+
 async def add_song(
     telegram_file_id: str = None, 
     title: str = None, 
@@ -80,6 +422,7 @@ async def add_song(
             updates["has_video"] = True
         if updates:
             await songs_collection.update_one({"_id": existing["_id"]}, {"$set": updates})
+            await _bump_library_version(existing["_id"])
         return str(existing["_id"])  # Return existing song ID
     
     # Determine audio_telegram_id: use provided or legacy field
@@ -100,38 +443,83 @@ async def add_song(
         "file_size": file_size
     }
     new_song = await songs_collection.insert_one(song_data)
+    collection_counts.adjust(songs_collection, 1)
+    await _bump_library_version(new_song.inserted_id)
     return str(new_song.inserted_id)
 
 async def get_all_songs():
+    if song_catalog.loaded:
+        return song_catalog.all()
     songs = []
-    async for song in songs_collection.find().sort("_id", -1):
+    async for song in songs_collection.find({}, SONG_LIST_PROJECTION).sort("_id", -1):
         songs.append(song_helper(song))
     return songs
 
 async def get_song_by_id(song_id: str):
+    if song_catalog.loaded:
+        return song_catalog.get(song_id)
     try:
-        song = await songs_collection.find_one({"_id": ObjectId(song_id)})
+        song = await songs_collection.find_one({"_id": ObjectId(song_id)}, SONG_LIST_PROJECTION)
         if song:
             return song_helper(song)
     except:
         pass
     return None
 
-async def search_songs(query: str):
+async def get_songs_by_ids(song_ids: list) -> list:
+    """
+    Songs for a list of ids in the requested order, with one $in query
+    (or none once the catalog is loaded). Unknown or malformed ids are skipped.
+    """
+    if song_catalog.loaded:
+        return [song for song in (song_catalog.get(str(sid)) for sid in song_ids) if song]
+
+    object_ids = []
+    for sid in song_ids:
+        try:
+            object_ids.append(ObjectId(sid))
+        except Exception:
+            continue
+    if not object_ids:
+        return []
+
+    found = {}
+    async for song in songs_collection.find({"_id": {"$in": list(set(object_ids))}}, SONG_LIST_PROJECTION):
+        found[str(song["_id"])] = song_helper(song)
+    return [dict(found[str(oid)]) for oid in object_ids if str(oid) in found]
+
+
+async def search_songs(query: str, limit: int = None):
+    """Songs matching `query`, best first (search index once the catalog is loaded)."""
+    if song_catalog.loaded:
+        return [song_catalog.get(song_id) for song_id in search_index.search(query, limit)]
     songs = []
     # Basic regex search
     regex_query = {"$regex": query, "$options": "i"}
-    async for song in songs_collection.find({
+    cursor = songs_collection.find({
         "$or": [
             {"title": regex_query},
             {"artist": regex_query},
             {"album": regex_query}
         ]
-    }):
+    }, SONG_LIST_PROJECTION)
+    if limit:
+        cursor = cursor.limit(limit)
+    async for song in cursor:
         songs.append(song_helper(song))
     return songs
 
 
+async def search_songs_batch(queries: list, limit: int = 5) -> list:
+    """search_songs for several queries in one call: a list of results per query."""
+    if song_catalog.loaded:
+        return [
+            [song_catalog.get(song_id) for song_id in hits]
+            for hits in search_index.search_many(queries, limit)
+        ]
+    return [await search_songs(query, limit) for query in queries]
+
+
 
 async def get_all_vectors() -> dict:
     """Get all song vectors: {song_id: vector}"""
@@ -154,27 +542,19 @@ async def delete_song(song_id: str) -> bool:
     """Delete a song by ID"""
     try:
         result = await songs_collection.delete_one({"_id": ObjectId(song_id)})
+        if result.deleted_count > 0:
+            collection_counts.adjust(songs_collection, -1)
+            await _bump_library_version(song_id, op="delete")
         return result.deleted_count > 0
     except:
         return False
 
 
-async def get_songs_paginated(page: int = 1, limit: int = 20) -> dict:
-    """Get paginated songs, newest first"""
-    skip = (page - 1) * limit
-    total = await songs_collection.count_documents({})
-    
-    songs = []
-    async for song in songs_collection.find().sort("_id", -1).skip(skip).limit(limit):
-        songs.append(song_helper(song))
-    
-    return {
-        "songs": songs,
-        "page": page,
-        "limit": limit,
-        "total": total,
-        "pages": (total + limit - 1) // limit if total > 0 else 1
-    }
+async def get_songs_paginated(page: int = 1, limit: int = 20, cursor: str = None) -> dict:
+    """Get paginated songs, newest first (pass next_cursor back to get the next page)"""
+    docs, next_cursor = await _page(songs_collection, ["_id"], page, limit, cursor)
+    total = await collection_counts.get(songs_collection)
+    return _paged("songs", [song_helper(song) for song in docs], page, limit, total, next_cursor)
 
 
 # ==================== Playlists Collection ====================
@@ -202,33 +582,23 @@ async def create_playlist(name: str, songs: list = None, cover_art: str = None,
         "is_ai_generated": is_ai,
     }
     result = await playlists_collection.insert_one(data)
+    collection_counts.adjust(playlists_collection, 1)
     return str(result.inserted_id)
 
 
-async def get_playlists(page: int = 1, limit: int = 10) -> dict:
-    skip = (page - 1) * limit
-    total = await playlists_collection.count_documents({})
+async def get_playlists(page: int = 1, limit: int = 10, cursor: str = None) -> dict:
+    docs, next_cursor = await _page(playlists_collection, ["created_at", "_id"], page, limit, cursor)
+    total = await collection_counts.get(playlists_collection)
+    playlists = [playlist_helper(pl) for pl in docs]
     
-    playlists = []
-    async for pl in playlists_collection.find().sort("created_at", -1).skip(skip).limit(limit):
-        p_data = playlist_helper(pl)
-        
-        # Fetch cover art from first song if available
-        if p_data.get("songs") and len(p_data["songs"]) > 0:
-            first_song_id = p_data["songs"][0]
-            # Verify song exists and get cover
-            song = await get_song_by_id(first_song_id)
-            if song and song.get("cover_art"):
-                p_data["cover_image"] = song["cover_art"]
-        
-        playlists.append(p_data)
+    # Cover art from each playlist's first song, all fetched at once
+    first_ids = [p["songs"][0] for p in playlists if p.get("songs")]
+    covers = {song["id"]: song.get("cover_art") for song in await get_songs_by_ids(first_ids)}
+    for p_data in playlists:
+        if p_data.get("songs") and covers.get(p_data["songs"][0]):
+            p_data["cover_image"] = covers[p_data["songs"][0]]
     
-    return {
-        "playlists": playlists,
-        "page": page,
-        "total": total,
-        "pages": (total + limit - 1) // limit if total > 0 else 1
-    }
+    return _paged("playlists", playlists, page, limit, total, next_cursor)
 
 
 async def get_playlist_by_id(playlist_id: str) -> dict:
@@ -266,60 +636,154 @@ async def remove_song_from_playlist(playlist_id: str, song_id: str) -> bool:
 async def delete_playlist(playlist_id: str) -> bool:
     try:
         result = await playlists_collection.delete_one({"_id": ObjectId(playlist_id)})
+        collection_counts.adjust(playlists_collection, -result.deleted_count)
         return result.deleted_count > 0
     except:
         return False
 
 
 # ==================== Play History Collection ====================
-play_history_collection = db.get_collection("play_history")
+# Raw plays go to play_events, a time-series collection whose TTL compacts
+# history down to the rollups. play_rollups holds what the app actually
+# reads: one capped "recent_plays" document and a count per song per day.
+play_history_collection = db.get_collection("play_history")  # legacy raw plays
+play_events_collection = db.get_collection("play_events")
+play_rollups_collection = db.get_collection("play_rollups")
+
+RECENT_PLAYS_DOC = "recent_plays"
+RECENT_PLAYS_SIZE = int(os.getenv("RECENT_PLAYS_SIZE", "50"))
+RECENT_PLAYS_DAYS = int(os.getenv("RECENT_PLAYS_DAYS", "7"))  # "recently played" window
+PLAY_EVENTS_TTL_DAYS = int(os.getenv("PLAY_EVENTS_TTL_DAYS", "90"))
+
+
+def _latest_plays(plays: list) -> list:
+    """[(song_id, played_at)] in play order -> one entry per song, newest first."""
+    latest = {}
+    for song_id, played_at in plays:
+        latest.pop(song_id, None)
+        latest[song_id] = played_at
+    return [{"song_id": song_id, "played_at": played_at} for song_id, played_at in reversed(latest.items())]
+
+
+def _push_recent_plays(plays: list) -> list:
+    """Update pipeline: move the played songs to the front of recent_plays, keep it capped."""
+    entries = _latest_plays(plays)
+    song_ids = [entry["song_id"] for entry in entries]
+    return [{"$set": {"plays": {"$slice": [
+        {"$concatArrays": [
+            {"$literal": entries},
+            {"$filter": {
+                "input": {"$ifNull": ["$plays", []]},
+                "cond": {"$not": [{"$in": ["$$this.song_id", song_ids]}]}
+            }}
+        ]},
+        RECENT_PLAYS_SIZE
+    ]}}}]
+
+
+def _play_rollup_updates(plays: list) -> list:
+    daily = Counter((played_at.strftime("%Y-%m-%d"), song_id) for song_id, played_at in plays)
+    updates = [UpdateOne({"_id": RECENT_PLAYS_DOC}, _push_recent_plays(plays), upsert=True)]
+    for (day, song_id), count in daily.items():
+        updates.append(UpdateOne(
+            {"_id": f"day:{day}:{song_id}"},
+            {"$set": {"day": day, "song_id": song_id}, "$inc": {"count": count}},
+            upsert=True
+        ))
+    return updates
+
+
+def _play_count_updates(plays: list) -> list:
+    updates = []
+    for song_id, count in Counter(song_id for song_id, _ in plays).items():
+        if ObjectId.is_valid(song_id):
+            updates.append(UpdateOne({"_id": ObjectId(song_id)}, {"$inc": {"play_count": count}}))
+    return updates
+
+
+async def _write_play_events(plays: list):
+    await play_events_collection.insert_many(
+        [{"song_id": song_id, "played_at": played_at} for song_id, played_at in plays], ordered=False
+    )
+
+
+async def _write_play_rollups(plays: list):
+    await play_rollups_collection.bulk_write(_play_rollup_updates(plays), ordered=False)
+
+
+async def _write_play_counts(plays: list):
+    count_updates = _play_count_updates(plays)
+    if count_updates:
+        await songs_collection.bulk_write(count_updates, ordered=False)
+
+
+# Where a batch of (song_id, played_at) goes. None of these writes is
+# idempotent, so each target is written and retried on its own: one failing
+# must not make the others run twice.
+PLAY_WRITERS = {
+    "events": _write_play_events,
+    "rollups": _write_play_rollups,
+    "counts": _write_play_counts,
+}
 
 
 async def record_play(song_id: str):
-    """Record a song play"""
-    from datetime import datetime
-    await play_history_collection.insert_one({
-        "song_id": song_id,
-        "played_at": datetime.utcnow()
-    })
-    
-    # Increment play count on song
-    try:
-        await songs_collection.update_one(
-            {"_id": ObjectId(song_id)},
-            {"$inc": {"play_count": 1}}
-        )
-    except Exception as e:
-        print(f"Error incrementing play count: {e}")
+    """Record a song play (written behind, see SignalBuffer)"""
+    signal_buffer.add_play(song_id)
 
 
-async def get_recently_played(limit: int = 10) -> list:
-    """Get recently played songs (unique, most recent first)"""
+async def rebuild_recent_plays() -> list:
+    """Recompute the recent_plays rollup from raw history (first start, or after it was lost)."""
     from datetime import datetime, timedelta
-    
-    # Get plays from last 7 days
-    since = datetime.utcnow() - timedelta(days=7)
-    
+    since = datetime.utcnow() - timedelta(days=PLAY_EVENTS_TTL_DAYS)
+    latest = {"$group": {"_id": "$song_id", "played_at": {"$max": "$played_at"}}}
     pipeline = [
         {"$match": {"played_at": {"$gte": since}}},
+        latest,
+        {"$unionWith": {"coll": play_history_collection.name, "pipeline": [
+            {"$match": {"played_at": {"$gte": since}}},
+            latest,
+        ]}},
+        latest,
         {"$sort": {"played_at": -1}},
-        {"$group": {"_id": "$song_id", "last_played": {"$first": "$played_at"}}},
-        {"$sort": {"last_played": -1}},
-        {"$limit": limit}
+        {"$limit": RECENT_PLAYS_SIZE},
+        {"$project": {"_id": 0, "song_id": "$_id", "played_at": 1}},
     ]
+    plays = await play_events_collection.aggregate(pipeline).to_list(None)
+    try:
+        await play_rollups_collection.insert_one({"_id": RECENT_PLAYS_DOC, "plays": plays})
+    except DuplicateKeyError:
+        # A play created it meanwhile and is newer than anything rebuilt here
+        doc = await play_rollups_collection.find_one({"_id": RECENT_PLAYS_DOC})
+        plays = doc["plays"]
+    return plays
+
+
+async def get_recently_played(limit: int = 10) -> list:
+    """Get recently played songs of the last RECENT_PLAYS_DAYS (unique, most recent first)"""
+    from datetime import datetime, timedelta
+    since = datetime.utcnow() - timedelta(days=RECENT_PLAYS_DAYS)
     
-    song_ids = []
-    async for doc in play_history_collection.aggregate(pipeline):
-        song_ids.append(doc["_id"])
+    doc = await play_rollups_collection.find_one({"_id": RECENT_PLAYS_DOC})
+    plays = doc["plays"] if doc else await rebuild_recent_plays()
+    plays = [play for play in _latest_plays(signal_buffer.pending_plays()) + plays if play["played_at"] >= since]
+    song_ids = list(dict.fromkeys(play["song_id"] for play in plays))[:limit]
     
     # Fetch song details
-    songs = []
-    for sid in song_ids:
-        song = await get_song_by_id(sid)
-        if song:
-            songs.append(song)
-    
-    return songs
+    return await get_songs_by_ids(song_ids)
+
+
+async def get_daily_play_counts(days: int = 30) -> list:
+    """Total plays per day, oldest first: [{"day": "YYYY-MM-DD", "plays": n}]"""
+    from datetime import datetime, timedelta
+    since = (datetime.utcnow() - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+    pipeline = [
+        {"$match": {"day": {"$gte": since}}},
+        {"$group": {"_id": "$day", "plays": {"$sum": "$count"}}},
+        {"$sort": {"_id": 1}},
+        {"$project": {"_id": 0, "day": "$_id", "plays": 1}},
+    ]
+    return await play_rollups_collection.aggregate(pipeline).to_list(None)
 
 
 # ==================== AI Cache Collection ====================
@@ -400,6 +864,7 @@ async def save_youtube_task(task_data: dict) -> str:
         from datetime import datetime
         task_data["created_at"] = datetime.utcnow()
         result = await youtube_tasks_collection.insert_one(task_data)
+        collection_counts.adjust(youtube_tasks_collection, 1)
         return str(result.inserted_id)
 
 
@@ -411,22 +876,11 @@ async def get_youtube_task(task_id: str) -> dict:
     return None
 
 
-async def get_youtube_tasks(page: int = 1, limit: int = 10) -> dict:
+async def get_youtube_tasks(page: int = 1, limit: int = 10, cursor: str = None) -> dict:
     """Get paginated YouTube tasks, newest first"""
-    skip = (page - 1) * limit
-    total = await youtube_tasks_collection.count_documents({})
-    
-    tasks = []
-    async for task in youtube_tasks_collection.find().sort("created_at", -1).skip(skip).limit(limit):
-        tasks.append(youtube_task_helper(task))
-    
-    return {
-        "tasks": tasks,
-        "page": page,
-        "limit": limit,
-        "total": total,
-        "pages": (total + limit - 1) // limit if total > 0 else 1
-    }
+    docs, next_cursor = await _page(youtube_tasks_collection, ["created_at", "_id"], page, limit, cursor)
+    total = await collection_counts.get(youtube_tasks_collection)
+    return _paged("tasks", [youtube_task_helper(task) for task in docs], page, limit, total, next_cursor)
 
 
 async def update_youtube_task(task_id: str, updates: dict):
@@ -439,12 +893,14 @@ async def update_youtube_task(task_id: str, updates: dict):
 
 async def delete_youtube_task(task_id: str):
     """Delete a single YouTube task"""
-    await youtube_tasks_collection.delete_one({"task_id": task_id})
+    result = await youtube_tasks_collection.delete_one({"task_id": task_id})
+    collection_counts.adjust(youtube_tasks_collection, -result.deleted_count)
 
 
 async def clear_all_youtube_tasks():
     """Delete all YouTube tasks"""
     result = await youtube_tasks_collection.delete_many({})
+    collection_counts.invalidate(youtube_tasks_collection)
     return result.deleted_count
 
 
@@ -452,36 +908,56 @@ async def clear_all_youtube_tasks():
 likes_collection = db.get_collection("likes")
 
 
-async def like_song(song_id: str) -> bool:
-    """Like a song (upsert)"""
+async def _write_likes(likes: dict):
+    """Final like state per song: True/False upserts, None deletes."""
+    if not likes:
+        return
     from datetime import datetime
-    result = await likes_collection.update_one(
-        {"song_id": song_id},
-        {"$set": {"song_id": song_id, "liked": True, "updated_at": datetime.utcnow()}},
-        upsert=True
-    )
+    now = datetime.utcnow()
+    updates = []
+    for song_id, liked in likes.items():
+        if liked is None:
+            updates.append(DeleteOne({"song_id": song_id}))
+        else:
+            updates.append(UpdateOne(
+                {"song_id": song_id},
+                {"$set": {"song_id": song_id, "liked": liked, "updated_at": now}},
+                upsert=True
+            ))
+    await likes_collection.bulk_write(updates, ordered=False)
+
+
+def _with_pending_likes(song_ids: list, liked: bool) -> list:
+    """Stored song ids with the given like state, adjusted for buffered changes."""
+    pending = signal_buffer.pending_likes()
+    kept = [song_id for song_id in song_ids if song_id not in pending]
+    return kept + [song_id for song_id, state in pending.items() if state is liked]
+
+
+async def like_song(song_id: str) -> bool:
+    """Like a song (upsert, written behind)"""
+    signal_buffer.set_like(song_id, True)
     return True
 
 
 async def dislike_song(song_id: str) -> bool:
-    """Dislike a song (upsert)"""
-    from datetime import datetime
-    result = await likes_collection.update_one(
-        {"song_id": song_id},
-        {"$set": {"song_id": song_id, "liked": False, "updated_at": datetime.utcnow()}},
-        upsert=True
-    )
+    """Dislike a song (upsert, written behind)"""
+    signal_buffer.set_like(song_id, False)
     return True
 
 
 async def remove_like(song_id: str) -> bool:
     """Remove like/dislike entry (neutral)"""
-    result = await likes_collection.delete_one({"song_id": song_id})
-    return result.deleted_count > 0
+    existed = (await get_like_status(song_id))["liked"] is not None
+    signal_buffer.set_like(song_id, None)
+    return existed
 
 
 async def get_like_status(song_id: str) -> dict:
     """Get like status for a song. Returns {"liked": True/False/None}"""
+    pending = signal_buffer.pending_likes()
+    if song_id in pending:
+        return {"liked": pending[song_id]}
     doc = await likes_collection.find_one({"song_id": song_id})
     if doc:
         return {"liked": doc.get("liked")}
@@ -495,12 +971,7 @@ async def get_liked_songs() -> list:
         song_ids.append(doc["song_id"])
     
     # Fetch song details
-    songs = []
-    for sid in song_ids:
-        song = await get_song_by_id(sid)
-        if song:
-            songs.append(song)
-    return songs
+    return await get_songs_by_ids(_with_pending_likes(song_ids, True))
 
 
 async def get_disliked_song_ids() -> list:
@@ -508,7 +979,7 @@ async def get_disliked_song_ids() -> list:
     ids = []
     async for doc in likes_collection.find({"liked": False}):
         ids.append(doc["song_id"])
-    return ids
+    return _with_pending_likes(ids, False)
 
 
 async def get_recommendations(limit: int = 10) -> list:
@@ -547,9 +1018,12 @@ async def get_ai_queue() -> dict:
     """Get current AI queue from MongoDB"""
     queue = await ai_queue_collection.find_one({"_id": "main_queue"})
     if queue:
+        # Apply "played" marks that haven't been written yet
+        pending = signal_buffer.pending_played()
+        played_ids = queue.get("played_ids", [])
         return {
-            "song_ids": queue.get("song_ids", []),
-            "played_ids": queue.get("played_ids", []),
+            "song_ids": [s for s in queue.get("song_ids", []) if s not in pending],
+            "played_ids": played_ids + [s for s in pending if s not in played_ids],
             "created_at": queue.get("created_at"),
             "updated_at": queue.get("updated_at"),
         }
@@ -579,32 +1053,30 @@ async def save_ai_queue(song_ids: list) -> bool:
     return True
 
 
-async def mark_song_played(song_id: str) -> bool:
-    """Move song from song_ids to played_ids"""
+async def _write_played(song_ids: list):
+    """Move a batch of songs from song_ids to played_ids in one update."""
+    if not song_ids:
+        return
     from datetime import datetime
-    
-    queue = await ai_queue_collection.find_one({"_id": "main_queue"})
-    if not queue:
-        return False
-    
-    song_ids = queue.get("song_ids", [])
-    played_ids = queue.get("played_ids", [])
-    
-    # Remove from queue and add to played
-    if song_id in song_ids:
-        song_ids.remove(song_id)
-    if song_id not in played_ids:
-        played_ids.append(song_id)
-    
     await ai_queue_collection.update_one(
         {"_id": "main_queue"},
-        {"$set": {"song_ids": song_ids, "played_ids": played_ids, "updated_at": datetime.utcnow()}}
+        {
+            "$pull": {"song_ids": {"$in": song_ids}},
+            "$addToSet": {"played_ids": {"$each": song_ids}},
+            "$set": {"updated_at": datetime.utcnow()}
+        }
     )
+
+
+async def mark_song_played(song_id: str) -> bool:
+    """Move song from song_ids to played_ids (written behind)"""
+    signal_buffer.mark_played(song_id)
     return True
 
 
 async def clear_played_queue() -> bool:
     """Clear played_ids list (for fresh start)"""
+    await signal_buffer.flush()  # or buffered marks would land after the clear
     await ai_queue_collection.update_one(
         {"_id": "main_queue"},
         {"$set": {"played_ids": []}}
@@ -615,12 +1087,27 @@ async def clear_played_queue() -> bool:
 async def get_queue_songs() -> list:
     """Get full song objects for queue"""
     queue = await get_ai_queue()
-    songs = []
-    for song_id in queue["song_ids"]:
-        song = await get_song_by_id(song_id)
-        if song:
-            songs.append(song)
-    return songs
+    return await get_songs_by_ids(queue["song_ids"])
+
+
+async def _append_to_ai_queue(song_ids: list):
+    """Append songs not already queued; concurrent removals and appends are kept."""
+    from datetime import datetime
+    now = datetime.utcnow()
+    await ai_queue_collection.update_one(
+        {"_id": "main_queue"},
+        {
+            "$addToSet": {"song_ids": {"$each": song_ids}},
+            "$set": {"updated_at": now},
+            "$setOnInsert": {"played_ids": [], "created_at": now},
+        },
+        upsert=True
+    )
+
+
+# Signals schedule refills after their response; two of them reading the same
+# queue snapshot would otherwise add the same songs twice
+_queue_refill_lock = asyncio.Lock()
 
 
 async def refill_queue_if_needed(min_songs: int = 10) -> bool:
@@ -628,6 +1115,11 @@ async def refill_queue_if_needed(min_songs: int = 10) -> bool:
     Check if queue has minimum songs, refill from recommendations if needed.
     Returns True if queue was refilled.
     """
+    async with _queue_refill_lock:
+        return await _refill_queue(min_songs)
+
+
+async def _refill_queue(min_songs: int) -> bool:
     queue = await get_ai_queue()
     current_count = len(queue["song_ids"])
     
@@ -658,12 +1150,10 @@ async def refill_queue_if_needed(min_songs: int = 10) -> bool:
     new_song_ids = [s["id"] for s in candidates[:needed]]
     
     if new_song_ids:
-        updated_queue = queue["song_ids"] + new_song_ids
-        await save_ai_queue(updated_queue)
+        await _append_to_ai_queue(new_song_ids)
         return True
     
     return False
-    return False
 
 
 # ==================== App Playlists Collection ====================
@@ -709,13 +1199,7 @@ async def get_playlist_with_songs(playlist_id: str) -> dict:
         playlist["id"] = str(playlist["_id"])
         del playlist["_id"]
         
-        full_songs = []
-        for sid in playlist.get("song_ids", []):
-            s = await get_song_by_id(sid)
-            if s:
-                full_songs.append(s)
-        
-        playlist["songs"] = full_songs
+        playlist["songs"] = await get_songs_by_ids(playlist.get("song_ids", []))
         return playlist
     except:
         return None
@@ -754,7 +1238,387 @@ async def update_song_video(song_id: str, video_telegram_id: str):
                 "media_type": "video"
             }}
         )
+        if result.modified_count > 0:
+            await _bump_library_version(song_id)
         return result.modified_count > 0
     except Exception as e:
         print(f"Error updating song video: {e}")
         return False
+
+
+async def update_song_hls(song_id: str, video_telegram_id: str, hls_message_id: str, hls_index: dict):
+    """
+    Store the HLS segment index of the HLS-only remux (hls_message_id)
+    built from a song's video upload (video_telegram_id)
+    """
+    if not song_id or not video_telegram_id or not hls_message_id or not hls_index:
+        return False
+    
+    try:
+        result = await songs_collection.update_one(
+            {"_id": ObjectId(song_id)},
+            {"$set": {"hls_index": {
+                **hls_index,
+                "message_id": str(hls_message_id),
+                "source_id": str(video_telegram_id),
+            }}}
+        )
+        if result.modified_count > 0:
+            await _bump_library_version(song_id)
+        return result.modified_count > 0
+    except Exception as e:
+        print(f"Error updating song HLS index: {e}")
+        return False
+
+
+async def get_song_hls_index(song_id: str):
+    """Get the HLS segment index for a song's current video, if any"""
+    try:
+        song = await songs_collection.find_one(
+            {"_id": ObjectId(song_id)},
+            {"hls_index": 1, "video_telegram_id": 1}
+        )
+    except:
+        return None
+    if not song or not song.get("hls_index"):
+        return None
+    
+    hls_index = song["hls_index"]
+    # Ignore an index left over from a previous video upload
+    # (indexes stored before the remux had its own message have no source_id)
+    source_id = hls_index.get("source_id", hls_index.get("message_id"))
+    if source_id != str(song.get("video_telegram_id")):
+        return None
+    return hls_index
+
+
+# ==================== Upload Sessions ====================
+# Part numbers Telegram has acknowledged for big uploads in progress,
+# so an interrupted upload can resume with the same file_id.
+
+upload_sessions_collection = db.get_collection("upload_sessions")
+
+
+# Each session is leased to the upload using it (owner), so two concurrent
+# uploads of the same content never share a file_id or delete each other's
+# record. Leases are renewed as parts are recorded.
+UPLOAD_SESSION_LEASE_SECONDS = int(os.getenv("UPLOAD_SESSION_LEASE_SECONDS", "300"))
+
+
+async def claim_upload_session(key: str, owner: str) -> Optional[dict]:
+    """Lease an existing session to `owner`; None if there is none or another upload holds it."""
+    from datetime import datetime, timedelta
+    from pymongo import ReturnDocument
+    now = datetime.utcnow()
+    return await upload_sessions_collection.find_one_and_update(
+        {"_id": key, "$or": [
+            {"leased_until": {"$exists": False}},
+            {"leased_until": {"$lt": now}},
+            {"owner": owner},
+        ]},
+        {"$set": {"owner": owner, "leased_until": now + timedelta(seconds=UPLOAD_SESSION_LEASE_SECONDS)}},
+        return_document=ReturnDocument.AFTER
+    )
+
+
+async def create_upload_session(key: str, owner: str, file_id: int, file_size: int,
+                                total_parts: int, file_name: str) -> bool:
+    """Start a fresh session leased to `owner`; False if another upload holds the key."""
+    from datetime import datetime, timedelta
+    now = datetime.utcnow()
+    try:
+        await upload_sessions_collection.replace_one(
+            {"_id": key, "owner": owner},
+            {
+                "file_id": file_id,
+                "file_size": file_size,
+                "total_parts": total_parts,
+                "file_name": file_name,
+                "parts": [],
+                "owner": owner,
+                "leased_until": now + timedelta(seconds=UPLOAD_SESSION_LEASE_SECONDS),
+                "created_at": now,
+                "updated_at": now,
+            },
+            upsert=True
+        )
+    except DuplicateKeyError:
+        return False
+    return True
+
+
+async def add_upload_session_parts(key: str, owner: str, parts: list):
+    from datetime import datetime, timedelta
+    now = datetime.utcnow()
+    await upload_sessions_collection.update_one(
+        {"_id": key, "owner": owner},
+        {
+            "$addToSet": {"parts": {"$each": parts}},
+            "$set": {"updated_at": now, "leased_until": now + timedelta(seconds=UPLOAD_SESSION_LEASE_SECONDS)}
+        }
+    )
+
+
+async def release_upload_session(key: str, owner: str):
+    """Keep the recorded parts for a later retry, but let any upload resume them."""
+    await upload_sessions_collection.update_one(
+        {"_id": key, "owner": owner},
+        {"$unset": {"owner": "", "leased_until": ""}}
+    )
+
+
+async def delete_upload_session(key: str, owner: str):
+    await upload_sessions_collection.delete_one({"_id": key, "owner": owner})
+
+
+# ==================== Signal Buffer ====================
+# Plays, likes and queue marks are accepted in memory and written behind in
+# batches, so interaction endpoints never wait on MongoDB. Reads above
+# overlay what is still pending, and shutdown writes out the remainder.
+SIGNAL_FLUSH_SECONDS = float(os.getenv("SIGNAL_FLUSH_SECONDS", "1"))
+SIGNAL_FLUSH_SIZE = int(os.getenv("SIGNAL_FLUSH_SIZE", "500"))
+SIGNAL_MAX_PLAYS = 100000  # kept while MongoDB is unreachable; oldest dropped beyond that
+
+
+class SignalBuffer:
+    """
+    Likes and queue marks coalesce to the last state per song; plays are
+    kept individually (raw events) and summed per song when written.
+    A batch that fails to write goes back into the buffer (plays per
+    PLAY_WRITERS target), so delivery is at-least-once.
+    """
+
+    def __init__(self):
+        # (song_id, played_at), oldest first, still to be written to each target
+        self._plays: Dict[str, List[tuple]] = {target: [] for target in PLAY_WRITERS}
+        self._likes: Dict[str, Optional[bool]] = {}  # None = remove
+        self._played: Dict[str, None] = {}  # ordered set of song ids
+        self._wake: Optional[asyncio.Event] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._task = None
+        self._stopping = False
+        self.flushes = 0
+        self.written = 0  # batch items written, per target
+        self.failures = 0
+        self.dropped = 0
+
+    def pending(self) -> int:
+        return max(map(len, self._plays.values())) + len(self._likes) + len(self._played)
+
+    def _added(self):
+        if self._wake is not None and self.pending() >= SIGNAL_FLUSH_SIZE:
+            self._wake.set()
+
+    def add_play(self, song_id: str):
+        from datetime import datetime
+        play = (song_id, datetime.utcnow())
+        for plays in self._plays.values():
+            plays.append(play)
+            if len(plays) > SIGNAL_MAX_PLAYS:
+                del plays[0]
+                self.dropped += 1
+        self._added()
+
+    def set_like(self, song_id: str, liked: Optional[bool]):
+        self._likes[song_id] = liked
+        self._added()
+
+    def mark_played(self, song_id: str):
+        self._played[song_id] = None
+        self._added()
+
+    def pending_plays(self) -> list:
+        """Plays not yet in the recent_plays rollup."""
+        return list(self._plays["rollups"])
+
+    def pending_likes(self) -> dict:
+        return dict(self._likes)
+
+    def pending_played(self) -> list:
+        return list(self._played)
+
+    async def flush(self):
+        """Write out everything buffered so far."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            plays, self._plays = self._plays, {target: [] for target in PLAY_WRITERS}
+            likes, self._likes = self._likes, {}
+            played, self._played = list(self._played), {}
+            if not (any(plays.values()) or likes or played):
+                return
+
+            targets = [target for target, batch in plays.items() if batch]
+            outcomes = await asyncio.gather(
+                *(PLAY_WRITERS[target](plays[target]) for target in targets),
+                _write_likes(likes), _write_played(played),
+                return_exceptions=True
+            )
+            play_errors = dict(zip(targets, outcomes))
+            likes_error, played_error = outcomes[-2:]
+            # Failed batches go back in front of anything buffered meanwhile
+            for target, error in play_errors.items():
+                if error:
+                    self._plays[target][:0] = plays[target]
+            if likes_error:
+                self._likes = {**likes, **self._likes}
+            if played_error:
+                self._played = {**dict.fromkeys(played), **self._played}
+
+            self.flushes += 1
+            batches = [(plays[target], error) for target, error in play_errors.items()]
+            batches += [(likes, likes_error), (played, played_error)]
+            self.written += sum(len(batch) for batch, error in batches if not error)
+            errors = [error for _, error in batches if error]
+            if errors:
+                self.failures += 1
+                print(f"[SIGNALS] Flush failed, {self.pending()} signals kept for retry: {errors[0]}")
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wake.wait(), SIGNAL_FLUSH_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"[SIGNALS] Flush error: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._wake = asyncio.Event()
+            self._lock = asyncio.Lock()
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        """Stop the flusher and write out what's left (graceful shutdown)."""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wake.set()
+        await self._task  # lets an in-progress flush finish instead of cancelling it
+        self._task = None
+        await self.flush()
+        if self.pending():
+            print(f"[SIGNALS] {self.pending()} signals could not be written before shutdown")
+
+    def stats(self) -> dict:
+        return {
+            "pending": self.pending(),
+            "flushes": self.flushes,
+            "written": self.written,
+            "failures": self.failures,
+            "dropped_plays": self.dropped,
+        }
+
+
+signal_buffer = SignalBuffer()
+
+
+# ==================== Indexes ====================
+# One definition per query shape above. create_indexes is idempotent, so this
+# runs on every start; an index whose definition changed has to be dropped by hand.
+SONG_CHANGES_TTL_DAYS = int(os.getenv("SONG_CHANGES_TTL_DAYS", "30"))
+UPLOAD_SESSION_TTL_HOURS = int(os.getenv("UPLOAD_SESSION_MAX_AGE_HOURS", "12"))
+
+INDEXES = {
+    "songs": [
+        # add_song's duplicate check: {"$or": [{file_name}, {title, artist}]}
+        IndexModel([("file_name", ASCENDING)], name="file_name"),
+        IndexModel([("title", ASCENDING), ("artist", ASCENDING)], name="title_artist"),
+    ],
+    "play_history": [
+        IndexModel([("played_at", DESCENDING)], name="played_at"),
+        IndexModel([("song_id", ASCENDING), ("played_at", DESCENDING)], name="song_played_at"),
+    ],
+    "play_events": [
+        IndexModel([("played_at", DESCENDING)], name="played_at"),
+    ],
+    "play_rollups": [
+        IndexModel([("day", ASCENDING)], name="day", sparse=True),
+    ],
+    "likes": [
+        IndexModel([("song_id", ASCENDING)], name="song_id", unique=True),
+        IndexModel([("liked", ASCENDING)], name="liked"),
+    ],
+    "youtube_tasks": [
+        IndexModel([("task_id", ASCENDING)], name="task_id", unique=True),
+        # Keyset pagination sorts on (created_at, _id); see _page()
+        IndexModel([("created_at", DESCENDING), ("_id", DESCENDING)], name="created_at_id"),
+    ],
+    "playlists": [
+        IndexModel([("created_at", DESCENDING), ("_id", DESCENDING)], name="created_at_id"),
+    ],
+    "app_playlists": [
+        IndexModel([("created_at", DESCENDING)], name="created_at"),
+    ],
+    "ai_cache": [
+        IndexModel([("key", ASCENDING)], name="key", unique=True),
+    ],
+    "song_changes": [
+        IndexModel([("version", ASCENDING)], name="version", unique=True),
+        # Clients further behind than this get a full resync (see get_library_changes)
+        IndexModel([("changed_at", ASCENDING)], name="changed_at_ttl",
+                   expireAfterSeconds=SONG_CHANGES_TTL_DAYS * 86400),
+    ],
+    "upload_sessions": [
+        # Sessions older than this can't be resumed anyway
+        IndexModel([("updated_at", ASCENDING)], name="updated_at_ttl",
+                   expireAfterSeconds=UPLOAD_SESSION_TTL_HOURS * 3600),
+    ],
+}
+
+# peer_cache.py keeps its collection in a database of its own
+PEER_CACHE_DATABASE = "lazyio"
+PEER_CACHE_INDEXES = {
+    "peer_cache": [
+        # get_peer / save_peer upsert
+        IndexModel([("peer_id", ASCENDING)], name="peer_id", unique=True),
+    ],
+}
+
+
+async def _ensure_play_events(database):
+    """play_events is a time-series collection; it has to exist before its first insert."""
+    ttl = PLAY_EVENTS_TTL_DAYS * 86400
+    try:
+        await database.create_collection(
+            play_events_collection.name,
+            timeseries={"timeField": "played_at", "metaField": "song_id", "granularity": "hours"},
+            expireAfterSeconds=ttl
+        )
+    except CollectionInvalid:
+        pass  # already there
+    except OperationFailure as e:
+        # MongoDB < 5.0: a plain collection with a TTL index does the same job
+        print(f"[DB] Time-series collections unavailable ({e}), using a TTL index for play_events")
+        await database[play_events_collection.name].create_index(
+            "played_at", name="played_at_ttl", expireAfterSeconds=ttl
+        )
+
+
+async def _build_indexes(database, indexes=INDEXES):
+    for name, models in indexes.items():
+        try:
+            await database[name].create_indexes(models)
+        except OperationFailure as e:
+            # e.g. duplicates blocking a unique index; the rest still get built
+            print(f"[DB] Could not create indexes on {name}: {e}")
+        except Exception as e:
+            print(f"[DB] Index build on {name} failed: {e}")
+    print(f"[DB] Indexes ready on {database.name}")
+
+
+async def ensure_indexes(database=None):
+    """
+    Create the indexes above, on `database` instead of music_app (and
+    lazyio for the peer cache) if given.
+    """
+    peer_database = client.get_database(PEER_CACHE_DATABASE) if database is None else database
+    database = db if database is None else database
+    await _ensure_play_events(database)
+    await _build_indexes(database)
+    await _build_indexes(peer_database, PEER_CACHE_INDEXES)
@@ -0,0 +1,270 @@
+"""
+HLS Module
+Builds a byte-offset segment index for uploaded videos so they can be served
+as HLS (fMP4 segments) straight out of the Telegram message.
+
+At upload time the video is remuxed (no re-encode) to fragmented MP4 with
+fragments starting on keyframes. Each moof+mdat pair is then one
+independently decodable segment. ffprobe's keyframe scan supplies the
+segment durations.
+
+The remux only carries the first video and audio stream, so it is uploaded
+as a separate HLS-only message; the original upload (every audio and
+subtitle track) stays what progressive /api/stream serves.
+"""
+
+import os
+import json
+import math
+import struct
+import asyncio
+import subprocess
+from typing import List, Optional, Tuple
+
+# Fragments start on a keyframe at least this long after the previous one
+HLS_SEGMENT_SECONDS = int(os.getenv("HLS_SEGMENT_SECONDS", "6"))
+
+
+async def _run(cmd: list) -> Tuple[int, bytes, bytes]:
+    process = await asyncio.create_subprocess_exec(
+        *cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    stdout, stderr = await process.communicate()
+    return process.returncode, stdout, stderr
+
+
+async def remux_fragmented(input_path: str) -> Optional[str]:
+    """Stream-copy a video into keyframe-aligned fragmented MP4."""
+    output_path = f"{os.path.splitext(input_path)[0]}_hls.mp4"
+    cmd = [
+        "ffmpeg", "-y", "-hide_banner", "-loglevel", "error",
+        "-i", input_path,
+        "-map", "0:v:0", "-map", "0:a:0?",
+        "-c", "copy",
+        "-movflags", "frag_keyframe+empty_moov+default_base_moof",
+        "-min_frag_duration", str(HLS_SEGMENT_SECONDS * 1000000),
+        output_path
+    ]
+    try:
+        code, _, stderr = await _run(cmd)
+    except FileNotFoundError:
+        print("[HLS] ffmpeg not found. Please install ffmpeg.")
+        return None
+
+    if code != 0 or not os.path.exists(output_path):
+        print(f"[HLS] Remux failed: {stderr.decode(errors='ignore')[-300:]}")
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        return None
+    return output_path
+
+
+def _top_level_boxes(path: str) -> List[Tuple[str, int, int]]:
+    """(type, offset, size) of every top-level MP4 box."""
+    boxes = []
+    file_size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        offset = 0
+        while offset + 8 <= file_size:
+            f.seek(offset)
+            size, box_type = struct.unpack(">I4s", f.read(8))
+            if size == 1:
+                size = struct.unpack(">Q", f.read(8))[0]
+            elif size == 0:
+                size = file_size - offset
+            if size < 8:
+                break
+            boxes.append((box_type.decode("latin-1"), offset, size))
+            offset += size
+    return boxes
+
+
+async def _keyframes(path: str) -> Tuple[List[Tuple[float, int]], float]:
+    """ffprobe keyframe scan: ([(pts_time, byte_pos)], total duration)."""
+    code, stdout, _ = await _run([
+        "ffprobe", "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time,pos,flags",
+        "-of", "csv=p=0",
+        path
+    ])
+    keyframes = []
+    if code == 0:
+        for line in stdout.decode().splitlines():
+            fields = line.split(",")
+            if len(fields) >= 3 and "K" in fields[2]:
+                try:
+                    keyframes.append((float(fields[0]), int(fields[1])))
+                except ValueError:
+                    continue  # pts_time or pos is "N/A"
+
+    code, stdout, _ = await _run([
+        "ffprobe", "-v", "error",
+        "-show_entries", "format=duration",
+        "-of", "default=noprint_wrappers=1:nokey=1",
+        path
+    ])
+    try:
+        duration = float(stdout.decode().strip()) if code == 0 else 0.0
+    except ValueError:
+        duration = 0.0  # "N/A" for some streams
+    keyframes.sort(key=lambda k: k[1])
+    if duration <= 0 and len(keyframes) > 1:
+        # Fall back to the last keyframe time, plus one average keyframe
+        # interval so the final segment doesn't come out empty
+        first, last = min(pts for pts, _ in keyframes), max(pts for pts, _ in keyframes)
+        duration = (last - first) * len(keyframes) / (len(keyframes) - 1)
+    return keyframes, duration
+
+
+# ffprobe profile names -> (profile_idc, constraint flags) for RFC 6381 avc1 strings
+_AVC_PROFILES = {
+    "Constrained Baseline": (66, 0xC0),
+    "Baseline": (66, 0x00),
+    "Main": (77, 0x00),
+    "Extended": (88, 0x00),
+    "High": (100, 0x00),
+    "High 10": (110, 0x00),
+    "High 4:2:2": (122, 0x00),
+    "High 4:4:4 Predictive": (244, 0x00),
+}
+
+# ffprobe AAC profile names -> mp4a object type
+_AAC_PROFILES = {"LC": 2, "HE-AAC": 5, "HE-AACv2": 29}
+
+
+async def _codecs(path: str) -> Optional[str]:
+    """
+    RFC 6381 CODECS value for the remux's video (+ audio) stream, e.g.
+    "avc1.64001f,mp4a.40.2". None when a stream's string can't be derived:
+    a wrong CODECS attribute is worse than none.
+    """
+    code, stdout, _ = await _run([
+        "ffprobe", "-v", "error",
+        "-show_entries", "stream=codec_type,codec_name,profile,level",
+        "-of", "json",
+        path
+    ])
+    if code != 0:
+        return None
+    try:
+        streams = json.loads(stdout.decode()).get("streams", [])
+    except ValueError:
+        return None
+
+    codecs = []
+    for stream in streams:
+        codec_type, codec_name = stream.get("codec_type"), stream.get("codec_name")
+        profile, level = stream.get("profile"), stream.get("level")
+        if codec_type == "video" and codec_name == "h264":
+            if profile not in _AVC_PROFILES or not isinstance(level, int) or level <= 0:
+                return None
+            profile_idc, constraints = _AVC_PROFILES[profile]
+            codecs.append(f"avc1.{profile_idc:02x}{constraints:02x}{level:02x}")
+        elif codec_type == "audio" and codec_name == "aac":
+            if profile not in _AAC_PROFILES:
+                return None
+            codecs.append(f"mp4a.40.{_AAC_PROFILES[profile]}")
+        elif codec_type == "audio" and codec_name == "mp3":
+            codecs.append("mp4a.40.34")
+        elif codec_type in ("video", "audio"):
+            return None
+    return ",".join(codecs) or None
+
+
+async def build_segment_index(path: str) -> Optional[dict]:
+    """
+    Returns {"init": [offset, length], "segments": [[offset, length, duration], ...],
+    "target_duration", "duration", "file_size", "codecs"} or None if the file isn't fMP4.
+    """
+    try:
+        boxes = await asyncio.get_event_loop().run_in_executor(None, _top_level_boxes, path)
+        keyframes, duration = await _keyframes(path)
+        codecs = await _codecs(path)
+    except (OSError, struct.error, ValueError) as e:
+        print(f"[HLS] Could not index {path}: {e}")
+        return None
+
+    moofs = [(offset, size) for box_type, offset, size in boxes if box_type == "moof"]
+    moov = next(((offset, size) for box_type, offset, size in boxes if box_type == "moov"), None)
+    if not moofs or not moov or not keyframes or duration <= 0:
+        return None
+    file_size = os.path.getsize(path)
+    # ftyp + moov
+    init_end = moov[0] + moov[1]
+
+    # Segment i spans moof[i] up to moof[i+1]; its start time is the first keyframe inside it
+    starts = []
+    bounds = [offset for offset, _ in moofs] + [file_size]
+    k = 0
+    for i in range(len(moofs)):
+        seg_start, seg_end = bounds[i], bounds[i + 1]
+        while k < len(keyframes) and keyframes[k][1] < seg_start:
+            k += 1
+        if k < len(keyframes) and keyframes[k][1] < seg_end:
+            starts.append(keyframes[k][0])
+        else:
+            return None  # fragment without a keyframe: not independently decodable
+
+    first_pts = starts[0]
+    segments = []
+    for i in range(len(moofs)):
+        seg_duration = (starts[i + 1] if i + 1 < len(starts) else first_pts + duration) - starts[i]
+        segments.append([bounds[i], bounds[i + 1] - bounds[i], round(max(seg_duration, 0.001), 3)])
+
+    return {
+        "init": [0, init_end],
+        "segments": segments,
+        "target_duration": math.ceil(max(s[2] for s in segments)),
+        "duration": round(duration, 3),
+        "file_size": file_size,
+        "codecs": codecs,
+    }
+
+
+async def prepare_for_hls(video_path: str) -> Tuple[str, Optional[dict]]:
+    """
+    Remux a video for HLS and index it.
+    Returns (path of the HLS-only remux to upload, segment index), or (None, None).
+    """
+    remuxed = await remux_fragmented(video_path)
+    if not remuxed:
+        return None, None
+
+    index = await build_segment_index(remuxed)
+    if not index:
+        os.remove(remuxed)
+        return None, None
+
+    print(f"[HLS] Indexed {len(index['segments'])} segments for {os.path.basename(video_path)}")
+    return remuxed, index
+
+
+def master_playlist(index: dict, media_uri: str) -> str:
+    bandwidth = int(index["file_size"] * 8 / index["duration"]) if index["duration"] else 0
+    peak = max((s[1] * 8 / s[2] for s in index["segments"]), default=bandwidth)
+    codecs = f',CODECS="{index["codecs"]}"' if index.get("codecs") else ""
+    return (
+        "#EXTM3U\n"
+        "#EXT-X-VERSION:7\n"
+        "#EXT-X-INDEPENDENT-SEGMENTS\n"
+        f"#EXT-X-STREAM-INF:BANDWIDTH={int(peak)},AVERAGE-BANDWIDTH={bandwidth}{codecs}\n"
+        f"{media_uri}\n"
+    )
+
+
+def media_playlist(index: dict, base_uri: str) -> str:
+    lines = [
+        "#EXTM3U",
+        "#EXT-X-VERSION:7",
+        f"#EXT-X-TARGETDURATION:{index['target_duration']}",
+        "#EXT-X-PLAYLIST-TYPE:VOD",
+        "#EXT-X-INDEPENDENT-SEGMENTS",
+        "#EXT-X-MEDIA-SEQUENCE:0",
+        f'#EXT-X-MAP:URI="{base_uri}/init.mp4"',
+    ]
+    for n, (_, _, duration) in enumerate(index["segments"]):
+        lines.append(f"#EXTINF:{duration:.3f},")
+        lines.append(f"{base_uri}/{n}.m4s")
+    lines.append("#EXT-X-ENDLIST")
+    return "\n".join(lines) + "\n"
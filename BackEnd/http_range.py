@@ -0,0 +1,138 @@
+"""
+HTTP Range Module
+Range / conditional request handling for /api/stream (RFC 9110 sections 13 and 14).
+"""
+
+import hashlib
+import uuid
+from typing import AsyncGenerator, Callable, List, Optional, Tuple
+
+# More ranges than this (after coalescing) is treated as abuse and the
+# Range header is ignored, which the spec allows.
+MAX_RANGES = 16
+
+
+class RangeNotSatisfiable(Exception):
+    """None of the requested ranges overlap the representation (-> 416)."""
+    pass
+
+
+def make_etag(file_id, file_size: int) -> str:
+    """Strong ETag derived from the Telegram file id and size."""
+    digest = hashlib.sha1(f"{file_id}:{file_size}".encode()).hexdigest()[:24]
+    return f'"{digest}"'
+
+
+def _etag_list(header: str) -> List[str]:
+    return [tag.strip() for tag in header.split(",") if tag.strip()]
+
+
+def etag_matches(header: Optional[str], etag: str, weak: bool = True) -> bool:
+    """
+    If-None-Match uses weak comparison, If-Range uses strong comparison.
+    """
+    if not header:
+        return False
+    for tag in _etag_list(header):
+        if tag == "*":
+            return True
+        if tag.startswith("W/"):
+            if weak and tag[2:] == etag:
+                return True
+            continue
+        if tag == etag:
+            return True
+    return False
+
+
+def parse_range_header(header: Optional[str], size: int) -> Optional[List[Tuple[int, int]]]:
+    """
+    Parse a Range header into sorted, coalesced (start, end) pairs, end inclusive.
+
+    Returns None when the header should be ignored (absent, not bytes,
+    syntactically invalid or too many ranges) so the full body is served.
+    Raises RangeNotSatisfiable when it is valid but no range overlaps the file.
+    """
+    if not header:
+        return None
+
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec.strip():
+        return None
+
+    ranges = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, sep, last = part.partition("-")
+        first, last = first.strip(), last.strip()
+        if not sep or (first and not first.isdigit()) or (last and not last.isdigit()):
+            return None
+
+        if not first:
+            # Suffix range: the last N bytes
+            if not last:
+                return None
+            length = int(last)
+            if length == 0 or size == 0:
+                continue
+            ranges.append((max(size - length, 0), size - 1))
+            continue
+
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        if start >= size:
+            continue  # unsatisfiable on its own, others may still match
+        end = int(last) if last else size - 1
+        ranges.append((start, min(end, size - 1)))
+
+    if not ranges:
+        raise RangeNotSatisfiable()
+
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end + 1:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+
+    if len(merged) > MAX_RANGES:
+        return None
+    return merged
+
+
+def multipart_parts(ranges: List[Tuple[int, int]], size: int, mime_type: str):
+    """
+    Lay out a multipart/byteranges body.
+    Returns (boundary, [(part_header, start, end)], closing, content_length).
+    """
+    boundary = uuid.uuid4().hex
+    parts = []
+    content_length = 0
+    for start, end in ranges:
+        head = (
+            f"--{boundary}\r\n"
+            f"Content-Type: {mime_type}\r\n"
+            f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+        ).encode()
+        parts.append((head, start, end))
+        content_length += len(head) + (end - start + 1) + 2  # trailing CRLF
+
+    closing = f"--{boundary}--\r\n".encode()
+    content_length += len(closing)
+    return boundary, parts, closing, content_length
+
+
+async def iter_multipart(parts, closing: bytes,
+                         fetch: Callable[[int, int], AsyncGenerator[bytes, None]]) -> AsyncGenerator[bytes, None]:
+    """Stream a multipart/byteranges body, pulling each range from fetch(offset, limit)."""
+    for head, start, end in parts:
+        yield head
+        async for chunk in fetch(start, end - start + 1):
+            yield chunk
+        yield b"\r\n"
+    yield closing
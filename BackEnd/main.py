@@ -1,6 +1,6 @@
 from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks, Request, WebSocket, WebSocketDisconnect
 from typing import List
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.responses import StreamingResponse, JSONResponse, Response, FileResponse
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 import os
@@ -15,17 +15,26 @@ import asyncio
 
 # Local imports
 from database import (
-    init_db, add_song, get_all_songs, get_song_by_id, search_songs,
+    init_db, add_song, get_all_songs, get_song_by_id, get_songs_by_ids, search_songs_batch,
     delete_song, get_songs_paginated,
     create_playlist, get_playlists, get_playlist_by_id,
     add_song_to_playlist, remove_song_from_playlist, delete_playlist,
-    record_play, get_recently_played,
+    record_play, get_recently_played, get_daily_play_counts,
     get_ai_cache, update_ai_cache,
     like_song, dislike_song, get_like_status, get_liked_songs, get_recommendations,
-    get_all_vectors, update_song_features
+    get_all_vectors, update_song_features,
+    update_song_hls, get_song_hls_index,
+    get_library_version, get_library_changes, get_library_snapshot, song_catalog,
+    signal_buffer, InvalidCursor
 )
-from telegram_client import tg_client, FileNotFound
-from metadata import extract_metadata
+from telegram_client import tg_client, FileNotFound, PRIORITY_AUDIO, PRIORITY_VIDEO
+from http_range import (
+    parse_range_header, RangeNotSatisfiable, make_etag, etag_matches,
+    multipart_parts, iter_multipart
+)
+from renditions import rendition_manager, normalize_quality, is_video_quality
+from hls import prepare_for_hls, master_playlist, media_playlist
+from metadata import extract_metadata, extract_metadata_from_prefix
 from mistral_agent import get_music_recommendations, get_homepage_recommendations
 from audio_recommender import audio_recommender
 
@@ -116,6 +125,8 @@ async def lifespan(app: FastAPI):
     # Shutdown
     ai_task.cancel()
     init_task.cancel()
+    await signal_buffer.stop()
+    song_catalog.stop()
     await tg_client.stop()
 
 app = FastAPI(lifespan=lifespan)
@@ -126,7 +137,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
-    expose_headers=["Content-Range", "Accept-Ranges", "Content-Length", "Content-Type"],
+    expose_headers=["Content-Range", "Accept-Ranges", "Content-Length", "Content-Type", "ETag", "X-Library-Version"],
 )
 
 TEMP_DIR = "temp_uploads"
@@ -301,6 +312,59 @@ async def delete_cookies():
     return {"success": False, "message": "No cookies file found"}
 
 
+async def _upload_hls_rendition(song_id: str, video_path: str, video_telegram_id: str, **upload_kwargs):
+    """
+    Remux a video to fragmented MP4, upload it as a separate HLS-only message
+    and store its segment index. The original video message is left untouched.
+    HLS is an optional extra, so failures are only logged. Removes video_path.
+    """
+    try:
+        hls_path, hls_index = await prepare_for_hls(video_path)
+        if not hls_path:
+            return
+        try:
+            hls_msg = await tg_client.upload_file(hls_path, **upload_kwargs)
+        finally:
+            if os.path.exists(hls_path):
+                os.remove(hls_path)
+        if hls_msg:
+            await update_song_hls(song_id, video_telegram_id, str(hls_msg.id), hls_index)
+        else:
+            print(f"[HLS] Upload of HLS remux failed for {os.path.basename(video_path)}")
+    except Exception as e:
+        print(f"[HLS] Could not build HLS rendition for song {song_id}: {e}")
+    finally:
+        if os.path.exists(video_path):
+            os.remove(video_path)
+
+
+def _schedule_hls_rendition(song_id: str, video_path: str, video_telegram_id: str, **upload_kwargs):
+    """
+    Build the HLS rendition in the background, so the upload is reported
+    done without waiting for a remux and a second upload. The video is
+    moved into TEMP_DIR first, out of reach of the caller's own cleanup.
+    """
+    if not song_id or not video_path or not os.path.exists(video_path):
+        return
+    import uuid
+    os.makedirs(TEMP_DIR, exist_ok=True)
+    hls_source = os.path.join(TEMP_DIR, f"hls_src_{uuid.uuid4().hex[:8]}_{os.path.basename(video_path)}")
+    try:
+        os.replace(video_path, hls_source)
+    except OSError as e:
+        print(f"[HLS] Could not keep {os.path.basename(video_path)} for HLS: {e}")
+        return
+    asyncio.create_task(_upload_hls_rendition(song_id, hls_source, video_telegram_id, **upload_kwargs))
+
+
+def _message_file_size(msg, fallback_path: str) -> int:
+    """Size of the file Telegram actually stored, or the local file's size"""
+    file = getattr(msg, "file", None)
+    if file is not None and file.size:
+        return file.size
+    return os.path.getsize(fallback_path) if fallback_path and os.path.exists(fallback_path) else 0
+
+
 @app.post("/api/upload")
 async def upload_files(background_tasks: BackgroundTasks, files: list[UploadFile] = File(...)):
     """
@@ -407,8 +471,11 @@ async def upload_files(background_tasks: BackgroundTasks, files: list[UploadFile
                 duration=meta.get("duration"),
                 cover_art=meta.get("cover_art"),
                 file_name=file_name,
-                file_size=os.path.getsize(file_path)
+                file_size=_message_file_size(tg_msg, file_path)
             )
+            if is_video:
+                # Served as HLS from a separate fMP4 remux of the video
+                _schedule_hls_rendition(song_id, file_path, video_telegram_id)
             
             # Broadcast: File complete
             await notify_update("upload_progress", {
@@ -474,12 +541,118 @@ async def upload_files(background_tasks: BackgroundTasks, files: list[UploadFile
     # Return immediately while processing happens in background
     return {"status": "success", "message": "Uploads started in background", "files": uploaded_songs}
 
+# Bytes read ahead of the Telegram upload for tags/Shazam
+STREAM_UPLOAD_PREFIX_BYTES = 1024 * 1024
+
+@app.put("/api/upload/stream")
+@app.post("/api/upload/stream")
+async def upload_stream(request: Request, filename: str):
+    """
+    Uploads one audio file sent as the raw request body straight into
+    Telegram upload parts, without spooling it to disk first
+    (multipart UploadFile always writes to a temp file).
+    Content-Length is required. Videos go through /api/upload, which needs
+    the whole file locally for HLS remuxing and audio extraction.
+    """
+    VIDEO_EXTENSIONS = ['.mp4', '.mkv', '.webm', '.avi', '.mov']
+    file_name = os.path.basename(filename) or "unknown"
+    if any(file_name.lower().endswith(ext) for ext in VIDEO_EXTENSIONS):
+        raise HTTPException(status_code=415, detail="Videos must be uploaded through /api/upload")
+    
+    try:
+        file_size = int(request.headers.get("content-length", ""))
+    except ValueError:
+        raise HTTPException(status_code=411, detail="Content-Length required")
+    if file_size <= 0:
+        raise HTTPException(status_code=400, detail="Empty body")
+    
+    async def _progress(stage: str, message: str):
+        await notify_update("upload_progress", {
+            "file_name": file_name,
+            "file_index": 0,
+            "total_files": 1,
+            "stage": stage,
+            "message": message
+        })
+    
+    body = request.stream()
+    prefix = bytearray()
+    async for data in body:
+        prefix += data
+        if len(prefix) >= STREAM_UPLOAD_PREFIX_BYTES:
+            break
+    
+    await _progress("metadata", f"Extracting metadata from {file_name}...")
+    meta = await extract_metadata_from_prefix(bytes(prefix), file_name, file_size)
+    
+    async def _chunks():
+        yield bytes(prefix)
+        async for data in body:
+            yield data
+    
+    await _progress("telegram", f"Uploading {file_name} to Telegram...")
+    tg_msg = await tg_client.upload_stream(
+        _chunks(), file_name, file_size,
+        title=meta.get("title"), artist=meta.get("artist"), duration=meta.get("duration", 0)
+    )
+    if not tg_msg:
+        await _progress("error", f"Failed to upload {file_name} to Telegram")
+        raise HTTPException(status_code=502, detail="Telegram upload failed")
+    
+    await _progress("database", f"Saving {file_name} to database...")
+    telegram_ref = str(tg_msg.id)
+    song_id = await add_song(
+        telegram_file_id=telegram_ref,
+        audio_telegram_id=telegram_ref,
+        video_telegram_id=None,
+        has_video=False,
+        title=meta.get("title"),
+        artist=meta.get("artist"),
+        album=meta.get("album"),
+        duration=meta.get("duration"),
+        cover_art=meta.get("cover_art"),
+        file_name=file_name,
+        file_size=file_size
+    )
+    
+    await _progress("complete", f"Upload complete: {meta.get('title', file_name)}")
+    await notify_update("upload_complete", {"count": 1})
+    return {"status": "success", "song_id": song_id, "telegram_id": telegram_ref}
+
 @app.get("/api/songs")
-async def list_songs():
-    return await get_all_songs()
+async def list_songs(request: Request):
+    """Whole library. ETag is the library version, so unchanged libraries cost a 304."""
+    version = song_catalog.version if song_catalog.loaded else await get_library_version()
+    if etag_matches(request.headers.get("If-None-Match"), f'"lib-{version}"'):
+        return Response(status_code=304, headers={"ETag": f'W/"lib-{version}"', "X-Library-Version": str(version)})
+    
+    version, songs = await get_library_snapshot()
+    return JSONResponse(songs, headers={
+        "ETag": f'W/"lib-{version}"',
+        "X-Library-Version": str(version),
+        "Cache-Control": "no-cache",
+    })
+
+
+@app.get("/api/songs/changes")
+async def list_song_changes(since: int = 0):
+    """
+    Library delta since a version from X-Library-Version (or a previous call):
+    {"version", "reset", "upserted": [songs], "deleted": [ids]}.
+    On reset the client should reload /api/songs.
+    """
+    return await get_library_changes(since)
 
 # ... (Keep your existing imports and setup) ...
 
+def _client_key(request: Request) -> str:
+    """Best guess at the real client address behind Fly/Nginx proxies"""
+    forwarded = request.headers.get("Fly-Client-IP") or request.headers.get("X-Forwarded-For")
+    if forwarded:
+        return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
 @app.get("/api/stream/{song_id}")
 async def stream_song(song_id: str, request: Request, type: str = None, quality: str = "original"):
     """
@@ -515,47 +688,95 @@ async def stream_song(song_id: str, request: Request, type: str = None, quality:
         file_size = file_info["file_size"]
         mime_type = file_info["mime_type"]
         
-        # Parse Range Header (Standard HTTP 206)
-        range_header = request.headers.get("Range")
-        start = 0
-        end = file_size - 1
+        # Lower quality requested: serve (or start) a transcoded rendition
+        rendition = normalize_quality(quality)
+        if rendition and not (is_video_quality(rendition) and not mime_type.startswith("video")):
+            source_path = f"/api/stream/{song_id}?type={type or ''}&quality=original"
+            # An encode in progress can only be played from the start; seeks get the original
+            seeking = (request.headers.get("Range") or "bytes=0-").replace(" ", "").lower() != "bytes=0-"
+            kind, target, rendition_mime = await rendition_manager.get_or_start(
+                msg_id, rendition, source_path, follow=not seeking
+            )
+            if kind == "file":
+                return FileResponse(target, media_type=rendition_mime)
+            if kind == "job":
+                return StreamingResponse(
+                    target,
+                    media_type=rendition_mime,
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+                )
+            # No encode possible: fall through to the original
         
-        if range_header:
-            try:
-                # Format: bytes=0-1024
-                range_str = range_header.replace("bytes=", "")
-                parts = range_str.split("-")
-                start = int(parts[0]) if parts[0] else 0
-                if len(parts) > 1 and parts[1]:
-                    end = int(parts[1])
-            except ValueError:
-                pass
+        etag = make_etag(file_info.get("file_id", msg_id), file_size)
+        client_id = _client_key(request)
+        priority = PRIORITY_VIDEO if mime_type.startswith("video") else PRIORITY_AUDIO
         
-        # Ensure end is valid
-        if end >= file_size: 
-            end = file_size - 1
-            
-        content_length = end - start + 1
+        def _stream(offset: int, limit: int):
+            return tg_client.stream_file(msg_id, offset=offset, limit=limit, client_id=client_id, priority=priority)
         
-        # Industry Standard Headers for Streaming
-        headers = {
-            "Content-Range": f"bytes {start}-{end}/{file_size}",
+        base_headers = {
             "Accept-Ranges": "bytes",
-            "Content-Length": str(content_length),
-            "Content-Type": mime_type,
+            "ETag": etag,
             "Connection": "keep-alive",
-            "Cache-Control": "no-cache, no-store, must-revalidate",
+            # Let clients keep bytes but revalidate with If-None-Match/If-Range
+            "Cache-Control": "no-cache",
             # CRITICAL: Tells Nginx/Proxies NOT to buffer chunks
             "X-Accel-Buffering": "no", 
         }
         
+        if etag_matches(request.headers.get("If-None-Match"), etag):
+            return Response(status_code=304, headers=base_headers)
+        
+        # Parse Range Header (RFC 9110). A stale If-Range means "send it all".
+        range_header = request.headers.get("Range")
+        if_range = request.headers.get("If-Range")
+        if range_header and if_range and not etag_matches(if_range, etag, weak=False):
+            range_header = None
+        
+        try:
+            ranges = parse_range_header(range_header, file_size)
+        except RangeNotSatisfiable:
+            return Response(
+                status_code=416,
+                headers={**base_headers, "Content-Range": f"bytes */{file_size}"}
+            )
+        
+        if not ranges:
+            return StreamingResponse(
+                _stream(0, file_size),
+                status_code=200,
+                headers={**base_headers, "Content-Length": str(file_size), "Content-Type": mime_type},
+                media_type=mime_type
+            )
+        
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            content_length = end - start + 1
+            headers = {
+                **base_headers,
+                "Content-Range": f"bytes {start}-{end}/{file_size}",
+                "Content-Length": str(content_length),
+                "Content-Type": mime_type,
+            }
+            return StreamingResponse(
+                _stream(start, content_length),
+                status_code=206,
+                headers=headers,
+                media_type=mime_type
+            )
+        
+        # Several disjoint ranges: multipart/byteranges
+        boundary, parts, closing, content_length = multipart_parts(ranges, file_size, mime_type)
+        content_type = f"multipart/byteranges; boundary={boundary}"
         return StreamingResponse(
-            tg_client.stream_file(msg_id, offset=start, limit=content_length),
+            iter_multipart(parts, closing, _stream),
             status_code=206,
-            headers=headers,
-            media_type=mime_type
+            headers={**base_headers, "Content-Length": str(content_length), "Content-Type": content_type},
+            media_type=content_type
         )
 
+    except HTTPException:
+        raise
     except FileNotFound:
         print(f"[Stream] 404 Error: File {msg_id} not found in Telegram channel.")
         raise HTTPException(status_code=404, detail="File lost in Telegram. Please re-upload.")
@@ -567,6 +788,74 @@ async def stream_song(song_id: str, request: Request, type: str = None, quality:
 
 
 
+# ==================== HLS (video songs) ====================
+# Segments are addressed by the HLS remux's Telegram message id, so their URLs
+# never change meaning and can be cached forever by CDNs and players.
+
+HLS_MIME = "application/vnd.apple.mpegurl"
+
+
+async def _hls_index_or_404(song_id: str) -> dict:
+    hls_index = await get_song_hls_index(song_id)
+    if not hls_index:
+        raise HTTPException(status_code=404, detail="HLS not available for this song")
+    return hls_index
+
+
+@app.get("/api/stream/{song_id}/master.m3u8")
+async def stream_hls_master(song_id: str):
+    """HLS entry point for video songs"""
+    hls_index = await _hls_index_or_404(song_id)
+    return Response(
+        master_playlist(hls_index, f"/api/stream/{song_id}/hls/{hls_index['message_id']}/video.m3u8"),
+        media_type=HLS_MIME,
+        headers={"Cache-Control": "no-cache"}
+    )
+
+
+@app.get("/api/stream/{song_id}/hls/{message_id}/video.m3u8")
+async def stream_hls_media(song_id: str, message_id: str):
+    """HLS media playlist: one fMP4 segment per fragment of the Telegram file"""
+    hls_index = await _hls_index_or_404(song_id)
+    if hls_index["message_id"] != message_id:
+        raise HTTPException(status_code=404, detail="Stale HLS playlist")
+    return Response(
+        media_playlist(hls_index, f"/api/stream/{song_id}/hls/{message_id}"),
+        media_type=HLS_MIME,
+        headers={"Cache-Control": "public, max-age=31536000, immutable"}
+    )
+
+
+@app.get("/api/stream/{song_id}/hls/{message_id}/{segment}")
+async def stream_hls_segment(song_id: str, message_id: str, segment: str, request: Request):
+    """Serve init.mp4 or <n>.m4s as an independent byte range of the video message"""
+    hls_index = await _hls_index_or_404(song_id)
+    if hls_index["message_id"] != message_id:
+        raise HTTPException(status_code=404, detail="Stale HLS segment")
+    
+    if segment == "init.mp4":
+        offset, length = hls_index["init"]
+        media_type = "video/mp4"
+    elif segment.endswith(".m4s") and segment[:-4].isdigit() and int(segment[:-4]) < len(hls_index["segments"]):
+        offset, length, _ = hls_index["segments"][int(segment[:-4])]
+        media_type = "video/iso.segment"
+    else:
+        raise HTTPException(status_code=404, detail="Segment not found")
+    
+    return StreamingResponse(
+        tg_client.stream_file(
+            int(message_id), offset=offset, limit=length,
+            client_id=_client_key(request), priority=PRIORITY_VIDEO
+        ),
+        media_type=media_type,
+        headers={
+            "Content-Length": str(length),
+            "Cache-Control": "public, max-age=31536000, immutable",
+            "X-Accel-Buffering": "no",
+        }
+    )
+
+
 @app.post("/api/recommend")
 async def recommend(current_song_id: str, history_ids: list[str]):
     """
@@ -574,11 +863,7 @@ async def recommend(current_song_id: str, history_ids: list[str]):
     """
     current_song = await get_song_by_id(current_song_id)
     
-    history = []
-    for hid in history_ids:
-        s = await get_song_by_id(hid)
-        if s:
-            history.append(s)
+    history = await get_songs_by_ids(history_ids)
     
     if not current_song:
         return {"recommendations": []}
@@ -588,16 +873,11 @@ async def recommend(current_song_id: str, history_ids: list[str]):
     # In a real app, we would match these strings to songs in our DB or search Youtube/Spotify
     # For now, we return the strings or try to find matches in our DB
     
+    # Fuzzy search in our library, all suggestions at once
+    # Assuming rec format "Title - Artist"
     db_matches = []
-    for rec in recs:
-        # Simple fuzzy search in our DB
-        # Assuming rec format "Title - Artist"
-        parts = rec.split("-")
-        if len(parts) >= 1:
-            query = parts[0].strip()
-            matches = await search_songs(query)
-            if matches:
-                db_matches.extend(matches)
+    for matches in await search_songs_batch([rec.split("-")[0].strip() for rec in recs]):
+        db_matches.extend(matches)
                 
     # remove duplicates
     unique_matches = {v['id']:v for v in db_matches}.values()
@@ -643,17 +923,55 @@ async def api_scan_audio_features(background_tasks: BackgroundTasks):
     return {"status": "started", "message": "Scan functionality requires persistent local storage or temporary download logic."}
 
 
+@app.get("/api/admin/stream-stats")
+async def api_stream_stats():
+    """Cache hit/miss counters and scheduler queue depth for the streaming path"""
+    return {**tg_client.cache_stats(), "catalog": song_catalog.stats(), "signals": signal_buffer.stats()}
+
+
+@app.get("/api/admin/play-stats")
+async def api_play_stats(days: int = 30):
+    """Plays per day from the daily rollups"""
+    return {"days": await get_daily_play_counts(max(1, min(days, 366)))}
+
+
+def _song_message_ids(songs: list) -> list:
+    """Every Telegram message id referenced by a list of songs."""
+    ids = []
+    for song in songs:
+        for key in ("audio_telegram_id", "video_telegram_id", "telegram_file_id"):
+            value = song.get(key)
+            if value and str(value).isdigit():
+                ids.append(int(value))
+    return ids
+
+
+@app.get("/api/admin/verify-library")
+async def api_verify_library():
+    """Check that every song's Telegram messages still exist (batched lookups)"""
+    songs = await get_all_songs()
+    ids = _song_message_ids(songs)
+    resolved = await tg_client.resolve_messages(ids)
+    
+    missing = []
+    for song in songs:
+        gone = [mid for mid in _song_message_ids([song]) if mid in resolved and resolved[mid] is None]
+        if gone:
+            missing.append({"id": song["id"], "title": song.get("title"), "message_ids": gone})
+    return {
+        "songs": len(songs),
+        "messages": len(set(ids)),
+        "unchecked": len(set(ids) - set(resolved)),
+        "missing": missing,
+    }
+
+
 @app.get("/api/recommend/similar/{song_id}")
 async def api_recommend_similar(song_id: str, limit: int = 10):
     """Get content-based similar songs using Vector Search"""
     similar_ids = audio_recommender.find_similar(song_id, limit)
     
-    songs = []
-    for sid in similar_ids:
-        s = await get_song_by_id(sid)
-        if s:
-            songs.append(s)
-            
+    songs = await get_songs_by_ids(similar_ids)
     return {"similar_songs": songs}
 
 
@@ -722,17 +1040,13 @@ async def api_get_upcoming_queue(song_id: str):
     
     # Match suggestions to songs in library
     matches = []
-    for suggestion in ai_suggestions:
-        # Try to find matching song in library
-        parts = suggestion.split(" - ")
-        if len(parts) >= 1:
-            query = parts[0].strip()
-            found = await search_songs(query)
-            # Filter out current song and add unique matches
-            for s in found:
-                if s["id"] != song_id and s["id"] not in [m["id"] for m in matches]:
-                    matches.append(s)
-                    break
+    queries = [suggestion.split(" - ")[0].strip() for suggestion in ai_suggestions]
+    for found in await search_songs_batch(queries):
+        # Filter out current song and add unique matches
+        for s in found:
+            if s["id"] != song_id and s["id"] not in [m["id"] for m in matches]:
+                matches.append(s)
+                break
     
     # If we don't have enough matches, fill with liked songs then random
     if len(matches) < 5:
@@ -795,15 +1109,12 @@ async def api_refresh_ai_queue():
     
     # Match to library songs
     matched_ids = []
-    for suggestion in ai_suggestions:
-        parts = suggestion.split(" - ")
-        if parts:
-            query = parts[0].strip()
-            found = await search_songs(query)
-            for s in found:
-                if s["id"] not in matched_ids:
-                    matched_ids.append(s["id"])
-                    break
+    queries = [suggestion.split(" - ")[0].strip() for suggestion in ai_suggestions]
+    for found in await search_songs_batch(queries):
+        for s in found:
+            if s["id"] not in matched_ids:
+                matched_ids.append(s["id"])
+                break
     
     # Add liked songs
     for s in liked_songs:
@@ -837,10 +1148,10 @@ async def api_refresh_ai_queue():
 
 
 @app.post("/api/ai-queue/mark-played/{song_id}")
-async def api_mark_song_played(song_id: str):
+async def api_mark_song_played(song_id: str, background_tasks: BackgroundTasks):
     """Mark a song as played (removes from queue)"""
     await db_mark_played(song_id)
-    await refill_queue_if_needed(min_songs=10)
+    background_tasks.add_task(refill_queue_if_needed, min_songs=10)
     return {"status": "marked", "song_id": song_id}
 
 
@@ -852,7 +1163,7 @@ class SignalRequest(PydanticBaseModel):
 
 
 @app.post("/api/ai-queue/signal/{song_id}")
-async def api_queue_signal(song_id: str, request: SignalRequest):
+async def api_queue_signal(song_id: str, request: SignalRequest, background_tasks: BackgroundTasks):
     """
     Report user behavior signal for smart queue updates.
     - listen: played > 60 seconds (positive signal)
@@ -884,8 +1195,8 @@ async def api_queue_signal(song_id: str, request: SignalRequest):
         await dislike_song(song_id)
         await db_mark_played(song_id)
     
-    # Ensure queue stays filled
-    await refill_queue_if_needed(min_songs=10)
+    # Ensure queue stays filled (after the response; the signal itself is written behind)
+    background_tasks.add_task(refill_queue_if_needed, min_songs=10)
     
     return {"status": "processed", "signal": signal_type, "song_id": song_id}
 
@@ -902,9 +1213,11 @@ async def api_get_app_playlists():
     return await get_app_playlists()
 
 @app.get("/api/app-playlists/{playlist_id}")
-async def api_get_app_playlist(playlist_id: str):
+async def api_get_app_playlist(playlist_id: str, background_tasks: BackgroundTasks):
     """Get specific playlist with full song details"""
     playlist = await get_playlist_with_songs(playlist_id)
+    if playlist:
+        background_tasks.add_task(tg_client.resolve_messages, _song_message_ids(playlist.get("songs", [])))
     if not playlist:
         raise HTTPException(status_code=404, detail="Playlist not found")
     return playlist
@@ -1115,12 +1428,13 @@ async def process_youtube_download(task_id: str, url: str, quality: str):
                     print(f"[MAIN] Video uploaded! Telegram ID: {video_telegram_id}")
                     
                     # Update song with video ID
-                    await add_song(
+                    video_song_id = await add_song(
                         title=audio_task.title,
                         artist=audio_task.artist,
                         video_telegram_id=video_telegram_id,
                         has_video=True
                     )
+                    _schedule_hls_rendition(video_song_id, video_task.file_path, video_telegram_id)
                     
                     await notify_update("library_updated")
                 else:
@@ -1331,7 +1645,7 @@ async def vidssave_download(background_tasks: BackgroundTasks, request: YouTubeR
                         duration=final_duration,
                         thumbnail=final_thumbnail,
                         file_name=os.path.basename(task.file_path),
-                        file_size=os.path.getsize(task.file_path) if task.file_path else 0
+                        file_size=_message_file_size(tg_msg, task.file_path)
                     )
 
                     # Update song with video if available
@@ -1343,16 +1657,17 @@ async def vidssave_download(background_tasks: BackgroundTasks, request: YouTubeR
                             "message": "Uploading video to Telegram..."
                         })
                         
-                        video_msg = await tg_client.upload_file(
-                            task.video_path,
+                        video_kwargs = dict(
                             title=final_title,
                             artist=final_artist,
                             duration=final_duration,
                             thumbnail=final_thumbnail
                         )
+                        video_msg = await tg_client.upload_file(task.video_path, **video_kwargs)
                         if video_msg:
                             # Use the captured song_id
                             await update_song_video(song_id, str(video_msg.id))
+                            _schedule_hls_rendition(song_id, task.video_path, str(video_msg.id), **video_kwargs)
                     
                     await notify_update("youtube_progress", {
                         "task_id": task_id,
@@ -1418,7 +1733,7 @@ async def youtube_status(task_id: str):
 
 @app.get("/api/youtube/tasks")
 @app.get("/api/youtube/tasks")
-async def list_youtube_tasks(page: int = 1, limit: int = 10):
+async def list_youtube_tasks(page: int = 1, limit: int = 10, cursor: str = None):
     """
     List all YouTube download tasks with pagination.
     Merges in-memory VidsSave tasks with persisted DB tasks.
@@ -1440,7 +1755,10 @@ async def list_youtube_tasks(page: int = 1, limit: int = 10):
         pass
     
     # 2. Get persisted tasks from DB
-    db_result = await get_youtube_tasks(page=page, limit=limit)
+    try:
+        db_result = await get_youtube_tasks(page=page, limit=limit, cursor=cursor)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
     db_tasks = db_result.get("tasks", [])
     
     # 3. Merge: Active in-memory tasks override DB tasks with same ID
@@ -1469,7 +1787,8 @@ async def list_youtube_tasks(page: int = 1, limit: int = 10):
         "tasks": final_tasks,
         "page": page,
         "pages": db_result.get("pages", 1),
-        "total": total_count
+        "total": total_count,
+        "next_cursor": db_result.get("next_cursor"),
     }
 
 
@@ -1521,17 +1840,27 @@ async def youtube_cancel(task_id: str):
 # ==================== Songs Management ====================
 
 @app.get("/api/songs/paginated")
-async def get_songs_page(page: int = 1, limit: int = 20):
-    """Get paginated songs list"""
-    return await get_songs_paginated(page=page, limit=limit)
+async def get_songs_page(page: int = 1, limit: int = 20, cursor: str = None):
+    """Get paginated songs list (follow next_cursor for cheap deep pages)"""
+    try:
+        return await get_songs_paginated(page=page, limit=limit, cursor=cursor)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 @app.delete("/api/songs/{song_id}")
 async def remove_song(song_id: str):
     """Delete a song from library"""
+    song = await get_song_by_id(song_id)
     success = await delete_song(song_id)
     if not success:
         raise HTTPException(status_code=404, detail="Song not found")
+    
+    # Drop cached Telegram metadata/blocks for every stream of this song
+    for key in ("telegram_file_id", "audio_telegram_id", "video_telegram_id"):
+        if song and song.get(key):
+            tg_client.forget_message(int(song[key]))
+            rendition_manager.remove(int(song[key]))
     return {"status": "success", "message": "Song deleted"}
 
 
@@ -1553,9 +1882,12 @@ class CreatePlaylistRequest(BaseModel):
 
 
 @app.get("/api/playlists")
-async def list_playlists(page: int = 1, limit: int = 10):
+async def list_playlists(page: int = 1, limit: int = 10, cursor: str = None):
     """Get paginated playlists"""
-    return await get_playlists(page=page, limit=limit)
+    try:
+        return await get_playlists(page=page, limit=limit, cursor=cursor)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 @app.post("/api/playlists/import-app-playlist/{playlist_id}")
@@ -1589,18 +1921,17 @@ async def new_playlist(request: CreatePlaylistRequest):
 
 
 @app.get("/api/playlists/{playlist_id}")
-async def get_playlist(playlist_id: str):
+async def get_playlist(playlist_id: str, background_tasks: BackgroundTasks):
     """Get a playlist with song details"""
     pl = await get_playlist_by_id(playlist_id)
     if not pl:
         raise HTTPException(status_code=404, detail="Playlist not found")
     
     # Fetch song details
-    songs = []
-    for sid in pl.get("songs", []):
-        song = await get_song_by_id(sid)
-        if song:
-            songs.append(song)
+    songs = await get_songs_by_ids(pl.get("songs", []))
+    
+    # Warm the message cache for the whole playlist in a batch or two
+    background_tasks.add_task(tg_client.resolve_messages, _song_message_ids(songs))
     
     pl["song_details"] = songs
     return pl
@@ -1640,10 +1971,7 @@ async def get_homepage():
     # Get AI playlist song details
     ai_playlist_songs = []
     if ai_cache and ai_cache.get("ai_playlist_songs"):
-        for sid in ai_cache["ai_playlist_songs"]:
-            song = await get_song_by_id(sid)
-            if song:
-                ai_playlist_songs.append(song)
+        ai_playlist_songs = await get_songs_by_ids(ai_cache["ai_playlist_songs"])
     
     return {
         "recently_played": recently_played,
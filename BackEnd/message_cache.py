@@ -0,0 +1,91 @@
+"""
+Message Cache Module
+In-process TTL + LRU cache of Telegram messages from BIN_CHANNEL, so a
+Range request doesn't pay for get_messages before its first byte.
+"""
+
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+MESSAGE_CACHE_SIZE = int(os.getenv("MESSAGE_CACHE_SIZE", "2048"))
+MESSAGE_CACHE_TTL = int(os.getenv("MESSAGE_CACHE_TTL", "1800"))  # seconds
+# Missing ids are remembered briefly so a dead song can't hammer Telegram
+MESSAGE_CACHE_NEGATIVE_TTL = int(os.getenv("MESSAGE_CACHE_NEGATIVE_TTL", "60"))
+
+# Sentinel stored for message ids Telegram told us don't exist
+MISSING = object()
+
+
+class MessageCache:
+    """
+    Maps message_id -> (expires_at, message, file_info).
+
+    `message` is the Telethon Message (its `.media` is what iter_download
+    needs) and `file_info` is the dict returned by get_file_info.
+    """
+
+    def __init__(self, max_size: int = MESSAGE_CACHE_SIZE, ttl: int = MESSAGE_CACHE_TTL,
+                 negative_ttl: int = MESSAGE_CACHE_NEGATIVE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+
+    def get(self, message_id: int) -> Optional[tuple]:
+        """
+        Returns (message, file_info) on a hit, (MISSING, None) for a cached
+        negative, or None when Telegram has to be asked.
+        """
+        entry = self._entries.get(message_id)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, message, file_info = entry
+        if expires_at < time.monotonic():
+            del self._entries[message_id]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(message_id)
+        if message is MISSING:
+            self.negative_hits += 1
+        else:
+            self.hits += 1
+        return message, file_info
+
+    def put(self, message_id: int, message: Any, file_info: dict):
+        self._store(message_id, message, file_info, self.ttl)
+
+    def put_missing(self, message_id: int):
+        self._store(message_id, MISSING, None, self.negative_ttl)
+
+    def _store(self, message_id: int, message: Any, file_info: Optional[dict], ttl: int):
+        if self.max_size <= 0:
+            return
+        self._entries[message_id] = (time.monotonic() + ttl, message, file_info)
+        self._entries.move_to_end(message_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, message_id: int):
+        self._entries.pop(message_id, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.negative_hits
+        return {
+            "entries": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.negative_hits) / lookups, 3) if lookups else 0.0,
+        }
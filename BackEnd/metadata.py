@@ -1,3 +1,4 @@
+import io
 import os
 import shutil
 import asyncio
@@ -7,18 +8,60 @@ from mutagen.flac import FLAC
 from mutagen.id3 import ID3, TIT2, TPE1, TALB, APIC
 from shazamio import Shazam
 
-async def extract_metadata(file_path: str) -> dict:
-    """
-    Extracts metadata from a music file.
-    Returns dict: {title, artist, album, duration, cover_art_path}
-    """
-    metadata = {
-        "title": os.path.basename(file_path),
+def _default_metadata(file_name: str) -> dict:
+    return {
+        "title": os.path.basename(file_name),
         "artist": "Unknown Artist",
         "album": "Unknown Album",
         "duration": 0,
         "cover_art": None
     }
+
+def _read_tags(audio, metadata: dict):
+    # ID3/Tags (Basic)
+    if isinstance(audio, MP3) or isinstance(audio, ID3):
+         tags = audio.tags
+         if tags:
+             if 'TIT2' in tags: metadata["title"] = str(tags['TIT2'])
+             if 'TPE1' in tags: metadata["artist"] = str(tags['TPE1'])
+             if 'TALB' in tags: metadata["album"] = str(tags['TALB'])
+    elif isinstance(audio, FLAC):
+        if 'title' in audio: metadata["title"] = audio['title'][0]
+        if 'artist' in audio: metadata["artist"] = audio['artist'][0]
+        if 'album' in audio: metadata["album"] = audio['album'][0]
+
+async def _apply_shazam(source, metadata: dict):
+    # ENHANCEMENT: Use Shazam to get high quality Cover Art and better Metadata
+    # This solves the "missing image" issue on ephemeral hosting
+    try:
+        print(f"[Metadata] Running Shazam for: {metadata['title']}")
+        shazam = Shazam()
+        out = await shazam.recognize_song(source)
+        
+        if out and 'track' in out:
+            track = out['track']
+            # Prefer Shazam metadata if available, as it's cleaner
+            if 'title' in track: metadata["title"] = track['title']
+            if 'subtitle' in track: metadata["artist"] = track['subtitle']
+            
+            # Get Cover Art
+            if 'images' in track and 'coverart' in track['images']:
+                metadata["cover_art"] = track['images']['coverart']
+                print(f"[Metadata] Found cover art: {metadata['cover_art']}")
+            elif 'images' in track and 'background' in track['images']:
+                metadata["cover_art"] = track['images']['background']
+                
+            # Store full data for future use?
+            # metadata["shazam_data"] = track 
+    except Exception as es:
+        print(f"[Metadata] Shazam lookup failed: {es}")
+
+async def extract_metadata(file_path: str) -> dict:
+    """
+    Extracts metadata from a music file.
+    Returns dict: {title, artist, album, duration, cover_art_path}
+    """
+    metadata = _default_metadata(file_path)
     
     try:
         audio = File(file_path)
@@ -29,48 +72,44 @@ async def extract_metadata(file_path: str) -> dict:
         if hasattr(audio, 'info') and hasattr(audio.info, 'length'):
             metadata["duration"] = int(audio.info.length)
 
-        # ID3/Tags (Basic)
-        if isinstance(audio, MP3) or isinstance(audio, ID3):
-             tags = audio.tags
-             if tags:
-                 if 'TIT2' in tags: metadata["title"] = str(tags['TIT2'])
-                 if 'TPE1' in tags: metadata["artist"] = str(tags['TPE1'])
-                 if 'TALB' in tags: metadata["album"] = str(tags['TALB'])
-        elif isinstance(audio, FLAC):
-            if 'title' in audio: metadata["title"] = audio['title'][0]
-            if 'artist' in audio: metadata["artist"] = audio['artist'][0]
-            if 'album' in audio: metadata["album"] = audio['album'][0]
-
-        # ENHANCEMENT: Use Shazam to get high quality Cover Art and better Metadata
-        # This solves the "missing image" issue on ephemeral hosting
-        try:
-            print(f"[Metadata] Running Shazam for: {metadata['title']}")
-            shazam = Shazam()
-            out = await shazam.recognize_song(file_path)
-            
-            if out and 'track' in out:
-                track = out['track']
-                # Prefer Shazam metadata if available, as it's cleaner
-                if 'title' in track: metadata["title"] = track['title']
-                if 'subtitle' in track: metadata["artist"] = track['subtitle']
-                
-                # Get Cover Art
-                if 'images' in track and 'coverart' in track['images']:
-                    metadata["cover_art"] = track['images']['coverart']
-                    print(f"[Metadata] Found cover art: {metadata['cover_art']}")
-                elif 'images' in track and 'background' in track['images']:
-                    metadata["cover_art"] = track['images']['background']
-                    
-                # Store full data for future use?
-                # metadata["shazam_data"] = track 
-        except Exception as es:
-            print(f"[Metadata] Shazam lookup failed: {es}")
+        _read_tags(audio, metadata)
+        await _apply_shazam(file_path, metadata)
 
     except Exception as e:
         print(f"Error extracting metadata for {file_path}: {e}")
         
     return metadata
 
+async def extract_metadata_from_prefix(data: bytes, file_name: str, file_size: int) -> dict:
+    """
+    Same as extract_metadata, but from the first bytes of a file that is
+    being streamed elsewhere (tags live at the start of MP3/FLAC files).
+    Duration is estimated from the bitrate when only a prefix is available.
+    """
+    metadata = _default_metadata(file_name)
+    
+    try:
+        fileobj = io.BytesIO(data)
+        fileobj.name = file_name  # lets mutagen score by extension too
+        audio = File(fileobj)
+        if not audio:
+            return metadata
+
+        info = getattr(audio, 'info', None)
+        bitrate = getattr(info, 'bitrate', 0) or 0
+        if len(data) < file_size and bitrate > 0:
+            metadata["duration"] = int(file_size * 8 / bitrate)
+        elif info is not None and hasattr(info, 'length'):
+            metadata["duration"] = int(info.length)
+
+        _read_tags(audio, metadata)
+        await _apply_shazam(data, metadata)
+
+    except Exception as e:
+        print(f"Error extracting metadata for {file_name}: {e}")
+        
+    return metadata
+
 async def recognize_song(file_path: str):
     """
     Uses ShazamIO to recognize a song.
@@ -11,6 +11,7 @@ _collection = None
 
 
 async def get_collection():
+    # The peer_id index is built with the others, see database.PEER_CACHE_INDEXES
     global _client, _collection
     if _collection is None:
         _client = AsyncIOMotorClient(MONGO_URI)
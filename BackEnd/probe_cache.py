@@ -0,0 +1,237 @@
+"""
+Probe Cache Module
+Persists the first and last blocks of every uploaded file so players probing
+container indexes (MP4 moov, WebM cues, ID3v1 tags) never wait on Telegram.
+"""
+
+import os
+import json
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from chunk_cache import CHUNK_SIZE
+from buffer_pool import buffer_pool
+
+PROBE_DIR = os.getenv("PROBE_CACHE_DIR", os.path.join(os.path.dirname(__file__), "temp_uploads", "probe_cache"))
+PROBE_HEAD_BYTES = int(os.getenv("PROBE_HEAD_KB", "512")) * 1024
+PROBE_TAIL_BYTES = int(os.getenv("PROBE_TAIL_KB", "512")) * 1024
+PROBE_MAX_BYTES = int(os.getenv("PROBE_CACHE_MAX_MB", "1024")) * 1024 * 1024
+
+
+class ProbeStore:
+    """
+    One compact record per message: `<id>.bin` holds the captured blocks back
+    to back and `<id>.json` holds the file info plus where each block sits.
+    Blocks use the same CHUNK_SIZE alignment as the chunk cache, so the
+    streamer can treat a probe hit exactly like a cache hit.
+    Records are evicted LRU against a byte budget, like the chunk cache.
+    """
+
+    def __init__(self, probe_dir: str = PROBE_DIR, max_bytes: int = PROBE_MAX_BYTES):
+        self.probe_dir = probe_dir
+        self.max_bytes = max_bytes
+        self._meta: "OrderedDict[int, dict]" = OrderedDict()  # least recently used first
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+
+        if PROBE_HEAD_BYTES > 0 or PROBE_TAIL_BYTES > 0:
+            os.makedirs(self.probe_dir, exist_ok=True)
+            self._load()
+
+    def _paths(self, message_id: int):
+        base = os.path.join(self.probe_dir, str(message_id))
+        return f"{base}.bin", f"{base}.json"
+
+    @staticmethod
+    def _record_size(meta: dict) -> int:
+        return sum(length for _, length in meta["blocks"].values())
+
+    def _load(self):
+        """Rebuild the record index from disk, least recently used first."""
+        found = []
+        for name in os.listdir(self.probe_dir):
+            if not name.endswith(".json"):
+                continue
+            try:
+                message_id = int(name[:-5])
+                with open(os.path.join(self.probe_dir, name)) as f:
+                    meta = json.load(f)
+                meta["blocks"] = {int(k): v for k, v in meta["blocks"].items()}
+                found.append((os.stat(self._paths(message_id)[0]).st_mtime, message_id, meta))
+            except (OSError, ValueError, KeyError) as e:
+                print(f"[PROBE] Skipping corrupt record {name}: {e}")
+
+        for _, message_id, meta in sorted(found, key=lambda record: record[0]):
+            self._meta[message_id] = meta
+            self._size += self._record_size(meta)
+
+        self._evict()
+        print(f"[PROBE] Loaded {len(self._meta)} probe records ({self._size / (1024 * 1024):.1f} MB)")
+
+    def _evict(self):
+        """Drop least recently used records until we're within budget. Caller holds no lock."""
+        victims = []
+        with self._lock:
+            while self._size > self.max_bytes and self._meta:
+                message_id, meta = self._meta.popitem(last=False)
+                self._size -= self._record_size(meta)
+                victims.append(message_id)
+
+        for message_id in victims:
+            self._remove_files(message_id)
+
+    def _probe_indexes(self, file_size: int) -> list:
+        if file_size <= 0:
+            return []
+        last = (file_size - 1) // CHUNK_SIZE
+        head_last = min((PROBE_HEAD_BYTES - 1) // CHUNK_SIZE, last) if PROBE_HEAD_BYTES > 0 else -1
+        tail_first = max((file_size - PROBE_TAIL_BYTES) // CHUNK_SIZE, 0) if PROBE_TAIL_BYTES > 0 else last + 1
+        return sorted(set(range(0, head_last + 1)) | set(range(tail_first, last + 1)))
+
+    def _write_record(self, message_id: int, file_info: dict, read_range: Callable[[int, int], Optional[bytes]]) -> bool:
+        """Write the probe blocks that read_range(start, length) can supply."""
+        file_size = file_info["file_size"]
+        bin_path, meta_path = self._paths(message_id)
+        blocks = {}
+        position = 0
+        with open(f"{bin_path}.tmp", "wb") as out:
+            for index in self._probe_indexes(file_size):
+                start = index * CHUNK_SIZE
+                data = read_range(start, min(CHUNK_SIZE, file_size - start))
+                if not data:
+                    continue
+                out.write(data)
+                blocks[index] = [position, len(data)]
+                position += len(data)
+            out.flush()
+            os.fsync(out.fileno())
+
+        if not blocks:
+            os.remove(f"{bin_path}.tmp")
+            return False
+
+        meta = {**file_info, "blocks": blocks}
+        with open(f"{meta_path}.tmp", "w") as f:
+            json.dump(meta, f)
+        # Data first, then the record that points at it
+        os.replace(f"{bin_path}.tmp", bin_path)
+        os.replace(f"{meta_path}.tmp", meta_path)
+
+        with self._lock:
+            old = self._meta.pop(message_id, None)
+            if old is not None:
+                self._size -= self._record_size(old)
+            self._meta[message_id] = meta
+            self._size += self._record_size(meta)
+        self._evict()
+        return True
+
+    def _capture(self, message_id: int, file_path: str, file_info: dict) -> bool:
+        if os.path.getsize(file_path) != file_info["file_size"]:
+            # Telegram altered the file, local bytes wouldn't match the stream
+            return False
+
+        with open(file_path, "rb") as src:
+            def read_range(start: int, length: int) -> bytes:
+                src.seek(start)
+                return src.read(length)
+            return self._write_record(message_id, file_info, read_range)
+
+    async def capture(self, message_id: int, file_path: str, file_info: dict) -> bool:
+        """Store head/tail blocks of a freshly uploaded local file."""
+        if not self._probe_indexes(file_info.get("file_size", 0)) or not os.path.exists(file_path):
+            return False
+        try:
+            ok = await asyncio.get_event_loop().run_in_executor(None, self._capture, message_id, file_path, file_info)
+            if ok:
+                print(f"[PROBE] Captured head/tail of {os.path.basename(file_path)} (msg {message_id})")
+            return ok
+        except OSError as e:
+            print(f"[PROBE] Capture failed for {message_id}: {e}")
+            return False
+
+    async def capture_buffers(self, message_id: int, file_info: dict, head: bytes, tail: bytes) -> bool:
+        """
+        Store probe blocks from bytes kept during a streaming upload:
+        `head` is the start of the file, `tail` the bytes ending at file_size.
+        Blocks not fully covered by either buffer are skipped.
+        """
+        file_size = file_info.get("file_size", 0)
+        if not self._probe_indexes(file_size):
+            return False
+        tail_start = file_size - len(tail)
+
+        def read_range(start: int, length: int) -> Optional[bytes]:
+            if start + length <= len(head):
+                return head[start:start + length]
+            if start >= tail_start:
+                return tail[start - tail_start:start - tail_start + length]
+            return None
+
+        try:
+            return await asyncio.get_event_loop().run_in_executor(None, self._write_record, message_id, file_info, read_range)
+        except OSError as e:
+            print(f"[PROBE] Capture failed for {message_id}: {e}")
+            return False
+
+    def file_info(self, message_id: int) -> Optional[dict]:
+        meta = self._meta.get(message_id)
+        if not meta:
+            return None
+        return {k: v for k, v in meta.items() if k != "blocks"}
+
+    def has(self, message_id: int, index: int) -> bool:
+        meta = self._meta.get(message_id)
+        return bool(meta) and index in meta["blocks"]
+
+    def _read(self, message_id: int, position: int, length: int) -> Optional[memoryview]:
+        bin_path, _ = self._paths(message_id)
+        try:
+            with open(bin_path, "rb", buffering=0) as f:
+                f.seek(position)
+                data = buffer_pool.read(length, f.readinto)
+            os.utime(bin_path)  # keep on-disk order close to LRU order across restarts
+            return data
+        except OSError:
+            return None
+
+    async def get(self, message_id: int, index: int) -> Optional[memoryview]:
+        meta = self._meta.get(message_id)
+        if not meta or index not in meta["blocks"]:
+            return None
+        position, length = meta["blocks"][index]
+        with self._lock:
+            if message_id in self._meta:
+                self._meta.move_to_end(message_id)
+        data = await asyncio.get_event_loop().run_in_executor(None, self._read, message_id, position, length)
+        if data is not None:
+            self.hits += 1
+        return data
+
+    def remove(self, message_id: int):
+        with self._lock:
+            meta = self._meta.pop(message_id, None)
+            if meta is not None:
+                self._size -= self._record_size(meta)
+        self._remove_files(message_id)
+
+    def _remove_files(self, message_id: int):
+        for path in self._paths(message_id):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        return {
+            "records": len(self._meta),
+            "size_mb": round(self._size / (1024 * 1024), 2),
+            "max_mb": round(self.max_bytes / (1024 * 1024), 2),
+            "hits": self.hits,
+        }
+
+
+probe_store = ProbeStore()
@@ -0,0 +1,254 @@
+"""
+Renditions Module
+On-demand ffmpeg transcodes of songs at lower qualities, streamed to the
+client while encoding and cached on disk for later plain byte serving.
+"""
+
+import os
+import shutil
+import asyncio
+from typing import AsyncGenerator, Dict, Optional, Tuple
+
+RENDITION_DIR = os.path.join(os.path.dirname(__file__), "temp_uploads", "renditions")
+RENDITION_MAX_BYTES = int(os.getenv("RENDITION_CACHE_MAX_MB", "1024")) * 1024 * 1024
+RENDITION_MAX_JOBS = int(os.getenv("RENDITION_MAX_JOBS", "1"))  # concurrent ffmpeg encodes
+# opus is the smallest for the quality; aac (ADTS) plays everywhere incl. iOS
+RENDITION_AUDIO_CODEC = os.getenv("RENDITION_AUDIO_CODEC", "opus").lower()
+# ffmpeg reads the original through our own /api/stream endpoint, which gives
+# it seekable Range access (MP4s with the moov atom at the end need that)
+RENDITION_SOURCE_URL = os.getenv("RENDITION_SOURCE_URL", f"http://127.0.0.1:{os.getenv('PORT', '8000')}")
+
+READ_SIZE = 256 * 1024
+
+AUDIO_PRESETS = {"low": "64k", "medium": "96k", "high": "160k"}
+VIDEO_PRESETS = {"360p": 360, "480p": 480, "720p": 720}
+QUALITY_ALIASES = {"64k": "low", "96k": "medium", "160k": "high"}
+
+
+def normalize_quality(quality: Optional[str]) -> Optional[str]:
+    """
+    Map a `quality` query value onto a preset name.
+    Returns None for the original file, which unknown values also get
+    (older clients send values this server never knew).
+    """
+    if not quality:
+        return None
+    quality = quality.lower()
+    quality = QUALITY_ALIASES.get(quality, quality)
+    if quality in AUDIO_PRESETS or quality in VIDEO_PRESETS:
+        return quality
+    return None
+
+
+def is_video_quality(quality: str) -> bool:
+    return quality in VIDEO_PRESETS
+
+
+def _encode_args(quality: str) -> Tuple[str, str, list]:
+    """(extension, mime type, ffmpeg output args) for a preset."""
+    if quality in VIDEO_PRESETS:
+        height = VIDEO_PRESETS[quality]
+        return "mp4", "video/mp4", [
+            "-map", "0:v:0", "-map", "0:a:0?",
+            "-vf", f"scale=-2:'min({height},ih)'",
+            "-c:v", "libx264", "-preset", "veryfast", "-crf", "28",
+            "-c:a", "aac", "-b:a", "96k",
+            # Fragmented MP4 can be written to a pipe and played while it grows
+            "-movflags", "frag_keyframe+empty_moov+default_base_moof",
+            "-f", "mp4",
+        ]
+
+    bitrate = AUDIO_PRESETS[quality]
+    if RENDITION_AUDIO_CODEC == "aac":
+        return "aac", "audio/aac", ["-vn", "-c:a", "aac", "-b:a", bitrate, "-f", "adts"]
+    return "ogg", "audio/ogg", ["-vn", "-c:a", "libopus", "-b:a", bitrate, "-f", "ogg"]
+
+
+class RenditionJob:
+    """A running encode. Readers follow the growing .part file."""
+
+    def __init__(self, path: str, mime_type: str):
+        self.path = path
+        self.part_path = f"{path}.part"
+        self.mime_type = mime_type
+        self.size = 0
+        self.done = False
+        self.error: Optional[str] = None
+        self._changed = asyncio.Event()
+        # Create the file up front so readers can open it immediately
+        open(self.part_path, "wb").close()
+
+    def notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def ready(self) -> bool:
+        """Wait for ffmpeg's first output; False if the encode failed before producing any."""
+        while self.size == 0 and not self.done:
+            await self._changed.wait()
+        return not self.error
+
+    async def follow(self, f) -> AsyncGenerator[bytes, None]:
+        """Yield the encoded output from the start of `f` (opened on part_path), waiting for ffmpeg as needed."""
+        loop = asyncio.get_event_loop()
+        position = 0
+        # The fd stays valid after the .part file is renamed into place or removed
+        with f:
+            while True:
+                if position < self.size:
+                    data = await loop.run_in_executor(None, f.read, min(self.size - position, READ_SIZE))
+                    if not data:
+                        break
+                    position += len(data)
+                    yield data
+                    continue
+                if self.done:
+                    if self.error:
+                        raise RuntimeError(self.error)
+                    return
+                changed = self._changed
+                await changed.wait()
+
+
+class RenditionManager:
+    def __init__(self, rendition_dir: str = RENDITION_DIR):
+        self.rendition_dir = rendition_dir
+        self._jobs: Dict[str, RenditionJob] = {}
+        self._slots: Optional[asyncio.Semaphore] = None
+        os.makedirs(self.rendition_dir, exist_ok=True)
+
+        # Partial encodes from a previous run can't be resumed
+        for name in os.listdir(self.rendition_dir):
+            if name.endswith(".part"):
+                try:
+                    os.remove(os.path.join(self.rendition_dir, name))
+                except OSError:
+                    pass
+
+    def _path(self, message_id: int, quality: str) -> Tuple[str, str]:
+        ext, mime_type, _ = _encode_args(quality)
+        return os.path.join(self.rendition_dir, f"{message_id}_{quality}.{ext}"), mime_type
+
+    async def get_or_start(self, message_id: int, quality: str, source_path: str, follow: bool = True):
+        """
+        Returns ("file", path, mime) for a finished rendition, ("job", byte
+        generator, mime) for an encode in progress (started if needed), or
+        ("original", None, None) when no encode can run: serve the original.
+        `source_path` is the /api/stream URL path of the original.
+        With follow=False (e.g. a Range request past byte 0, which a growing
+        file can't answer) the encode is started but the original is served.
+        """
+        path, mime_type = self._path(message_id, quality)
+        if os.path.exists(path):
+            os.utime(path)  # eviction is oldest-first
+            return "file", path, mime_type
+        if shutil.which("ffmpeg") is None:
+            return "original", None, None
+
+        job = self._jobs.get(path)
+        if job is None:
+            job = self._jobs[path] = RenditionJob(path, mime_type)
+            asyncio.ensure_future(self._encode(job, quality, f"{RENDITION_SOURCE_URL}{source_path}"))
+        if not follow:
+            return "original", None, None
+        # Open before anything can fail: a failed encode deletes the .part file
+        try:
+            f = open(job.part_path, "rb")
+        except OSError:
+            return "original", None, None
+        # Headers go out once we answer, so find out now whether ffmpeg gets going at all
+        if not await job.ready():
+            f.close()
+            return "original", None, None
+        return "job", job.follow(f), mime_type
+
+    async def _encode(self, job: RenditionJob, quality: str, source_url: str):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(RENDITION_MAX_JOBS)
+
+        _, _, output_args = _encode_args(quality)
+        cmd = [
+            "ffmpeg", "-hide_banner", "-loglevel", "error", "-nostdin",
+            "-i", source_url,
+            *output_args,
+            "pipe:1",
+        ]
+
+        try:
+            async with self._slots:
+                print(f"[RENDITION] Encoding {os.path.basename(job.path)}")
+                process = await asyncio.create_subprocess_exec(
+                    *cmd,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE
+                )
+                # Drained alongside stdout: a full stderr pipe would stall ffmpeg
+                stderr_task = asyncio.ensure_future(process.stderr.read())
+
+                with open(job.part_path, "ab") as out:
+                    while True:
+                        data = await process.stdout.read(READ_SIZE)
+                        if not data:
+                            break
+                        out.write(data)
+                        out.flush()
+                        job.size += len(data)
+                        job.notify()
+
+                stderr = await stderr_task
+                if await process.wait() != 0 or job.size == 0:
+                    raise RuntimeError(f"ffmpeg failed: {stderr.decode(errors='ignore')[-500:]}")
+
+            os.replace(job.part_path, job.path)
+            print(f"[RENDITION] Cached {os.path.basename(job.path)} ({job.size / (1024 * 1024):.1f} MB)")
+            self._evict()
+        except FileNotFoundError:
+            job.error = "ffmpeg not found. Please install ffmpeg."
+        except Exception as e:
+            job.error = str(e)
+        finally:
+            if job.error:
+                print(f"[RENDITION] {os.path.basename(job.path)} failed: {job.error}")
+                try:
+                    os.remove(job.part_path)
+                except OSError:
+                    pass
+            job.done = True
+            job.notify()
+            self._jobs.pop(job.path, None)
+
+    def _evict(self):
+        """Delete least recently served renditions until under budget."""
+        files = []
+        for name in os.listdir(self.rendition_dir):
+            path = os.path.join(self.rendition_dir, name)
+            if name.endswith(".part"):
+                continue
+            try:
+                st = os.stat(path)
+                files.append((st.st_mtime, st.st_size, path))
+            except OSError:
+                continue
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= RENDITION_MAX_BYTES:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def remove(self, message_id: int):
+        """Drop every cached rendition of a message."""
+        prefix = f"{message_id}_"
+        for name in os.listdir(self.rendition_dir):
+            if name.startswith(prefix) and not name.endswith(".part"):
+                try:
+                    os.remove(os.path.join(self.rendition_dir, name))
+                except OSError:
+                    pass
+
+
+rendition_manager = RenditionManager()
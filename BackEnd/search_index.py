@@ -0,0 +1,188 @@
+"""
+Search Index Module
+In-process full-text index over the song catalog (title, artist, album),
+so searches and AI-suggestion matching never scan MongoDB.
+
+- Text is NFKD-folded (diacritics dropped) and casefolded, then split into
+  word tokens: "Beyoncé" and "beyonce" are the same term.
+- Query tokens match index terms exactly, by prefix, or fuzzily via shared
+  trigrams (typos, partial words); weaker matches count for less.
+- Every query token (stopwords aside) has to match for a song to be a hit,
+  so "The Scientist" doesn't return whatever else has "the" in it.
+- Ranking is BM25 with per-field weights, title counting most.
+"""
+
+import os
+import re
+import math
+import asyncio
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional
+
+FIELD_WEIGHTS = {"title": 3.0, "artist": 2.0, "album": 1.0}
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Dice coefficient on trigrams a term needs to count as a fuzzy match
+SEARCH_FUZZY_THRESHOLD = float(os.getenv("SEARCH_FUZZY_THRESHOLD", "0.5"))
+PREFIX_WEIGHT = 0.8
+FUZZY_WEIGHT = 0.6
+
+_TOKEN = re.compile(r"\w+")
+STOPWORDS = {
+    "a", "an", "and", "at", "by", "feat", "for", "from", "ft", "in", "is",
+    "my", "of", "on", "or", "the", "to", "with",
+}
+
+
+def fold(text: str) -> str:
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN.findall(fold(text))
+
+
+def _trigrams(term: str) -> set:
+    padded = f"${term}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    def __init__(self):
+        self._postings: Dict[str, Dict[str, float]] = defaultdict(dict)  # term -> {song_id: weighted tf}
+        self._doc_terms: Dict[str, Dict[str, float]] = {}  # song_id -> {term: weighted tf}
+        self._doc_length: Dict[str, float] = {}
+        self._total_length = 0.0
+        self._trigram_terms: Dict[str, set] = defaultdict(set)  # trigram -> terms containing it
+        self.queries = 0
+
+    def __len__(self):
+        return len(self._doc_terms)
+
+    def add(self, song: dict):
+        """Index (or re-index) a song_helper dict."""
+        song_id = song["id"]
+        self.remove(song_id)
+
+        terms = Counter()
+        for field, weight in FIELD_WEIGHTS.items():
+            for token in tokenize(song.get(field)):
+                terms[token] += weight
+        if not terms:
+            return
+
+        self._doc_terms[song_id] = dict(terms)
+        length = sum(terms.values())
+        self._doc_length[song_id] = length
+        self._total_length += length
+        for term, tf in terms.items():
+            if not self._postings[term]:
+                for trigram in _trigrams(term):
+                    self._trigram_terms[trigram].add(term)
+            self._postings[term][song_id] = tf
+
+    def remove(self, song_id: str):
+        terms = self._doc_terms.pop(song_id, None)
+        if terms is None:
+            return
+        self._total_length -= self._doc_length.pop(song_id)
+        for term in terms:
+            posting = self._postings[term]
+            posting.pop(song_id, None)
+            if not posting:
+                del self._postings[term]
+                for trigram in _trigrams(term):
+                    self._trigram_terms[trigram].discard(term)
+                    if not self._trigram_terms[trigram]:
+                        del self._trigram_terms[trigram]
+
+    def rebuild(self, songs: Iterable[dict]):
+        self._postings.clear()
+        self._doc_terms.clear()
+        self._doc_length.clear()
+        self._total_length = 0.0
+        self._trigram_terms.clear()
+        for song in songs:
+            self.add(song)
+
+    async def rebuild_async(self, songs: Iterable[dict]):
+        """
+        rebuild() without stalling the event loop: a fresh index is built in
+        an executor and swapped in whole, so searches meanwhile use the old one.
+        """
+        fresh = SearchIndex()
+        await asyncio.get_event_loop().run_in_executor(None, fresh.rebuild, list(songs))
+        self._postings = fresh._postings
+        self._doc_terms = fresh._doc_terms
+        self._doc_length = fresh._doc_length
+        self._total_length = fresh._total_length
+        self._trigram_terms = fresh._trigram_terms
+
+    def _expand(self, token: str) -> Dict[str, float]:
+        """Index terms a query token matches, with how much each match counts."""
+        matches = {}
+        if token in self._postings:
+            matches[token] = 1.0
+
+        grams = _trigrams(token)
+        shared = Counter()
+        for trigram in grams:
+            for term in self._trigram_terms.get(trigram, ()):
+                shared[term] += 1
+        for term, count in shared.items():
+            if term in matches:
+                continue
+            if term.startswith(token):
+                matches[term] = PREFIX_WEIGHT
+                continue
+            similarity = 2 * count / (len(grams) + len(term))  # a padded term has ~len(term) trigrams
+            if similarity >= SEARCH_FUZZY_THRESHOLD:
+                matches[term] = FUZZY_WEIGHT * similarity
+        return matches
+
+    def search(self, query: str, limit: Optional[int] = None) -> List[str]:
+        """Song ids matching `query`, best first."""
+        self.queries += 1
+        docs = len(self._doc_terms)
+        if not docs:
+            return []
+        avg_length = self._total_length / docs
+
+        tokens = set(tokenize(query))
+        # A query made only of stopwords ("The The") still has to match them
+        tokens = (tokens - STOPWORDS) or tokens
+
+        scores = None
+        for token in tokens:
+            # A token matching several terms of one song counts its best match only
+            best = defaultdict(float)
+            for term, match_weight in self._expand(token).items():
+                posting = self._postings[term]
+                idf = math.log(1 + (docs - len(posting) + 0.5) / (len(posting) + 0.5))
+                for song_id, tf in posting.items():
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * self._doc_length[song_id] / avg_length)
+                    score = match_weight * idf * tf * (BM25_K1 + 1) / (tf + norm)
+                    if score > best[song_id]:
+                        best[song_id] = score
+            if scores is None:
+                scores = best
+            else:
+                scores = {song_id: score + best[song_id] for song_id, score in scores.items() if song_id in best}
+            if not scores:
+                return []
+
+        if not scores:
+            return []
+        ranked = sorted(scores, key=scores.get, reverse=True)
+        return ranked[:limit] if limit else ranked
+
+    def search_many(self, queries: List[str], limit: Optional[int] = None) -> List[List[str]]:
+        return [self.search(query, limit) for query in queries]
+
+    def stats(self) -> dict:
+        return {"songs": len(self._doc_terms), "terms": len(self._postings), "queries": self.queries}
+
+
+search_index = SearchIndex()
@@ -0,0 +1,190 @@
+"""
+Stream Scheduler Module
+Admission control for Telegram block fetches, so one client pulling a
+large video can't starve everyone else's audio.
+
+- A fixed number of fetch slots is shared by all streams.
+- When slots run out, waiters are served audio first, then video, then
+  background read-ahead.
+- Within a priority, the client holding the fewest slots goes next.
+- A queued fetch that a more urgent reader joins (e.g. a stream catching up
+  with its own read-ahead) can be promoted to that reader's priority.
+- Each client gets a token bucket per stream kind that paces delivered bytes.
+"""
+
+import os
+import time
+import asyncio
+import itertools
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, List, Optional
+
+PRIORITY_AUDIO = 0
+PRIORITY_VIDEO = 1
+PRIORITY_PREFETCH = 2
+PRIORITY_NAMES = {PRIORITY_AUDIO: "audio", PRIORITY_VIDEO: "video", PRIORITY_PREFETCH: "prefetch"}
+
+# Concurrent Telegram fetches allowed per pool worker
+SCHEDULER_SLOTS_PER_WORKER = int(os.getenv("SCHEDULER_SLOTS_PER_WORKER", "4"))
+# Per-client delivery rate in KiB/s, 0 = unlimited. Audio is a few hundred
+# kbps at most, so by default only video is paced.
+STREAM_RATE_AUDIO_KBPS = int(os.getenv("STREAM_RATE_AUDIO_KBPS", "0"))
+STREAM_RATE_VIDEO_KBPS = int(os.getenv("STREAM_RATE_VIDEO_KBPS", "4096"))
+STREAM_BURST_KB = int(os.getenv("STREAM_BURST_KB", "2048"))
+BUCKET_IDLE_SECONDS = 300
+
+
+class TokenBucket:
+    """Byte-rate limiter. Tokens may go negative; the caller then sleeps off the debt."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    async def consume(self, amount: int) -> float:
+        """Take `amount` bytes; returns seconds slept."""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= amount
+        if self.tokens >= 0:
+            return 0.0
+        delay = -self.tokens / self.rate
+        await asyncio.sleep(delay)
+        return delay
+
+
+class _Waiter:
+    __slots__ = ("priority", "client_id", "seq", "future", "queued_at")
+
+    def __init__(self, priority: int, client_id: str, seq: int, future: asyncio.Future):
+        self.priority = priority
+        self.client_id = client_id
+        self.seq = seq
+        self.future = future
+        self.queued_at = time.monotonic()
+
+
+class StreamScheduler:
+    def __init__(self, slots: int):
+        self.slots = max(1, slots)
+        self._active = 0
+        self._per_client: Dict[str, int] = {}
+        self._waiters: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._buckets: Dict[tuple, TokenBucket] = {}
+
+        # Metrics
+        self.granted = 0
+        self.queued = 0
+        self.promoted = 0
+        self.wait_seconds = 0.0
+        self.throttle_seconds = 0.0
+
+    def resize(self, slots: int):
+        """Change the number of fetch slots (e.g. when the worker pool grows)."""
+        self.slots = max(1, slots)
+        self._wake()
+
+    def _grant(self, client_id: str):
+        self._active += 1
+        self._per_client[client_id] = self._per_client.get(client_id, 0) + 1
+        self.granted += 1
+
+    def _release(self, client_id: str):
+        self._active -= 1
+        remaining = self._per_client.get(client_id, 1) - 1
+        if remaining > 0:
+            self._per_client[client_id] = remaining
+        else:
+            self._per_client.pop(client_id, None)
+        self._wake()
+
+    def _wake(self):
+        while self._active < self.slots and self._waiters:
+            waiter = min(
+                self._waiters,
+                key=lambda w: (w.priority, self._per_client.get(w.client_id, 0), w.seq)
+            )
+            self._waiters.remove(waiter)
+            if waiter.future.done():
+                continue
+            self._grant(waiter.client_id)
+            self.wait_seconds += time.monotonic() - waiter.queued_at
+            waiter.future.set_result(None)
+
+    async def acquire(self, client_id: str, priority: int,
+                      on_queued: Optional[Callable[[_Waiter], None]] = None):
+        """Take a slot; `on_queued` receives the waiter (for promote()) if we have to queue."""
+        if self._active < self.slots and not self._waiters:
+            self._grant(client_id)
+            return
+
+        future = asyncio.get_event_loop().create_future()
+        waiter = _Waiter(priority, client_id, next(self._seq), future)
+        self._waiters.append(waiter)
+        self.queued += 1
+        if on_queued:
+            on_queued(waiter)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Slot was handed to us just as we got cancelled
+                self._release(client_id)
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            raise
+
+    def promote(self, waiter: _Waiter, priority: int):
+        """Move a still-queued waiter up to `priority` (lower is more urgent)."""
+        if priority < waiter.priority and waiter in self._waiters:
+            waiter.priority = priority
+            self.promoted += 1
+
+    @asynccontextmanager
+    async def slot(self, client_id: str, priority: int,
+                   on_queued: Optional[Callable[[_Waiter], None]] = None):
+        await self.acquire(client_id, priority, on_queued)
+        try:
+            yield
+        finally:
+            self._release(client_id)
+
+    async def throttle(self, client_id: str, priority: int, amount: int):
+        """Pace bytes delivered to a client according to its stream kind."""
+        if priority == PRIORITY_PREFETCH:
+            return
+        rate_kbps = STREAM_RATE_VIDEO_KBPS if priority == PRIORITY_VIDEO else STREAM_RATE_AUDIO_KBPS
+        if rate_kbps <= 0:
+            return
+
+        key = (client_id, priority)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            now = time.monotonic()
+            for k, b in list(self._buckets.items()):
+                if now - b.updated > BUCKET_IDLE_SECONDS:
+                    del self._buckets[k]
+            bucket = self._buckets[key] = TokenBucket(rate_kbps * 1024, STREAM_BURST_KB * 1024)
+        self.throttle_seconds += await bucket.consume(amount)
+
+    def stats(self) -> dict:
+        depth = {name: 0 for name in PRIORITY_NAMES.values()}
+        for waiter in self._waiters:
+            depth[PRIORITY_NAMES[waiter.priority]] += 1
+        return {
+            "slots": self.slots,
+            "active": self._active,
+            "queue_depth": depth,
+            "clients": dict(self._per_client),
+            "granted": self.granted,
+            "queued": self.queued,
+            "promoted": self.promoted,
+            "avg_wait_ms": round(self.wait_seconds / self.queued * 1000, 1) if self.queued else 0.0,
+            "throttle_seconds": round(self.throttle_seconds, 1),
+        }
@@ -2,7 +2,8 @@ import asyncio
 import os
 import time
 import mimetypes
-from typing import AsyncGenerator, Dict, Any, Optional
+from collections import deque, OrderedDict
+from typing import AsyncGenerator, AsyncIterator, Callable, Dict, Any, Optional, Tuple
 
 # 1. OPTIMIZATION: Install uvloop for faster async handling
 try:
@@ -11,10 +12,21 @@ try:
 except ImportError:
     pass
 
-from telethon import TelegramClient, events, utils, errors
-from telethon.tl.types import DocumentAttributeFilename, InputPeerChannel
+from telethon import TelegramClient, events, utils, errors, helpers
+from telethon.tl.types import DocumentAttributeFilename, InputPeerChannel, InputFile, InputFileBig
+from telethon.tl.functions.upload import SaveFilePartRequest, SaveBigFilePartRequest
 from dotenv import load_dotenv
 
+from chunk_cache import chunk_cache, CHUNK_SIZE
+from buffer_pool import buffer_pool
+from message_cache import MessageCache, MISSING
+from probe_cache import probe_store, PROBE_HEAD_BYTES, PROBE_TAIL_BYTES
+from worker_manager import WorkerManager, CONNECTION_ERRORS
+from stream_scheduler import (
+    StreamScheduler, SCHEDULER_SLOTS_PER_WORKER,
+    PRIORITY_AUDIO, PRIORITY_VIDEO, PRIORITY_PREFETCH
+)
+
 # Load env
 load_dotenv("../config.env")
 load_dotenv("config.env")
@@ -26,9 +38,70 @@ BIN_CHANNEL = int(os.getenv("BIN_CHANNEL", "0"))
 
 print(f"DEBUG: API_ID={API_ID} BIN_CHANNEL={BIN_CHANNEL}")
 
+# Read-ahead: once a message is being read sequentially, keep the next
+# READAHEAD_CHUNKS blocks warm. READAHEAD_MAX_CHUNKS caps buffered + in-flight
+# blocks across all streams (512 KiB each).
+READAHEAD_CHUNKS = int(os.getenv("READAHEAD_CHUNKS", "4"))
+READAHEAD_MAX_CHUNKS = int(os.getenv("READAHEAD_MAX_CHUNKS", "32"))
+READAHEAD_TRIGGER = 2  # sequential blocks seen before prefetch kicks in
+READAHEAD_IDLE_SECONDS = 300
+
+# Striped streaming: blocks fetched ahead of the one being sent, per stream and
+# across all streams (512 KiB each), so a full house of streams can't exhaust RAM
+STRIPE_WINDOW = int(os.getenv("TELEGRAM_STRIPE_WINDOW", "3"))
+STRIPE_MAX_BLOCKS = int(os.getenv("TELEGRAM_STRIPE_MAX_BLOCKS", "32"))
+
+# Streaming uploads: 512 KiB is the largest part Telegram accepts, and files
+# over 10 MB must go through saveBigFilePart
+UPLOAD_PART_SIZE = 512 * 1024
+BIG_FILE_THRESHOLD = 10 * 1024 * 1024
+# Elastic pool: TELEGRAM_POOL_SIZE is the ceiling. Start with POOL_MIN workers,
+# add one when each running worker carries more than POOL_STREAMS_PER_WORKER
+# active streams (or fetches queue up), stop extras idle for POOL_IDLE_SECONDS.
+POOL_MIN = int(os.getenv("TELEGRAM_POOL_MIN", "1"))
+POOL_STREAMS_PER_WORKER = int(os.getenv("TELEGRAM_POOL_STREAMS_PER_WORKER", "2"))
+POOL_IDLE_SECONDS = int(os.getenv("TELEGRAM_POOL_IDLE_SECONDS", "300"))
+POOL_START_STAGGER = float(os.getenv("TELEGRAM_POOL_START_STAGGER", "1.0"))  # seconds between parallel starts
+POOL_CHECK_SECONDS = 30
+
+# Largest id list Telegram accepts in one channels.getMessages call
+MESSAGE_BATCH_SIZE = 100
+
+# Parallel uploads: parts in flight per pool worker
+UPLOAD_PARTS_PER_WORKER = int(os.getenv("UPLOAD_PARTS_PER_WORKER", "2"))
+# Resumable uploads: acknowledged parts of big files are recorded in MongoDB
+# (flushed every UPLOAD_SESSION_FLUSH_PARTS) so a retry or restart only sends
+# the rest. Telegram drops unfinished uploads after a while, so old sessions
+# are started over.
+UPLOAD_SESSION_FLUSH_PARTS = 16
+UPLOAD_SESSION_MAX_AGE = int(os.getenv("UPLOAD_SESSION_MAX_AGE_HOURS", "12")) * 3600
+UPLOAD_RESUME_ATTEMPTS = int(os.getenv("UPLOAD_RESUME_ATTEMPTS", "3"))
+TEMP_DIR = os.path.join(os.path.dirname(__file__), "temp_uploads")
+
 class FileNotFound(Exception):
     pass
 
+class _ReadAheadState:
+    """Sequential access tracker for one message_id, shared by its readers."""
+    __slots__ = ("last_index", "streak", "tasks", "touched", "readers")
+
+    def __init__(self):
+        self.last_index = -2
+        self.streak = 0
+        self.tasks: Dict[int, asyncio.Task] = {}
+        self.touched = time.monotonic()
+        self.readers = 0  # streams currently serving this message
+
+class _ChunkFlight:
+    """One Telegram fetch of a block, shared by every reader that wants it."""
+    __slots__ = ("task", "readers", "priority", "waiter")
+
+    def __init__(self, priority: int):
+        self.task: Optional[asyncio.Task] = None
+        self.readers = 0
+        self.priority = priority  # most urgent reader so far
+        self.waiter = None  # scheduler queue entry while waiting for a slot
+
 class TelegramClientWrapper:
     def __init__(self):
         if not all([API_ID, API_HASH, BOT_TOKEN, BIN_CHANNEL]):
@@ -37,12 +110,44 @@ class TelegramClientWrapper:
         # 1. OPTIMIZATION: Multi-Client Pool (IDM Style)
 
         # We spawn multiple clients to open multiple TCP connections.
-        # Configurable via env var, default 4 for best performance
+        # Configurable via env var, default 4 for best performance.
+        # This is the maximum: workers are started on demand (see _scale_up)
         self.pool_size = int(os.getenv("TELEGRAM_POOL_SIZE", "4"))
+        self.pool_min = max(1, min(POOL_MIN, self.pool_size))
         self.clients = []
         self.session_base = "TelethonBot"
         self.bin_channel = BIN_CHANNEL
         self._bin_entity = None
+        self.message_cache = MessageCache()
+        # Single-flight message lookups: message_id -> future of (message, file_info) or None
+        self._resolving: Dict[int, asyncio.Future] = {}
+
+        # Striped streaming: fetch blocks of one stream concurrently across the pool.
+        # The window caps in-flight blocks (and memory) per stream; blocks beyond
+        # the one each stream is waiting on also draw from a process-wide budget.
+        self.striped = os.getenv("TELEGRAM_STRIPED_STREAMING", "True").lower() == "true"
+        self.stripe_window = STRIPE_WINDOW
+        self._stripe_blocks = 0  # extra striped blocks in flight or buffered, all streams
+
+        # Read-ahead engine: per-message access state + shared prefetched block pool
+        self._readahead: Dict[int, _ReadAheadState] = {}
+        self._prefetched: "OrderedDict[tuple, bytes]" = OrderedDict()
+
+        # Block fetches in flight, keyed by (message_id, index), so overlapping
+        # Range requests for the same song share one download
+        self._chunk_flights: Dict[tuple, _ChunkFlight] = {}
+        self.coalesced_fetches = 0
+
+        # Fair, priority-aware admission for Telegram block fetches
+        # (resized as workers come and go)
+        self.scheduler = StreamScheduler(self.pool_min * SCHEDULER_SLOTS_PER_WORKER)
+        self._active_streams = 0
+        self._scaling = False
+        self._autoscale_task: Optional[asyncio.Task] = None
+
+        # Part-parallel uploads across the pool, resumable for big files
+        self.parallel_uploads = os.getenv("TELEGRAM_PARALLEL_UPLOADS", "True").lower() == "true"
+        self.resumable_uploads = os.getenv("TELEGRAM_RESUMABLE_UPLOADS", "True").lower() == "true"
         
         # Initialize the pool
         for i in range(self.pool_size):
@@ -61,25 +166,18 @@ class TelegramClientWrapper:
         # The primary client (worker 0) for general tasks
         self.client = self.clients[0]
 
+        # Per-worker health (in-flight, latency, FloodWait) drives worker selection
+        self.workers = WorkerManager(self.clients, self._reconnect_worker)
+
     async def start(self):
-        print(f"Starting {self.pool_size} Telegram Clients (Multi-Socket)...")
+        print(f"Starting {self.pool_min} of up to {self.pool_size} Telegram Clients (Multi-Socket)...")
         
-        # Start all clients in parallel, with FloodWait handling
-        for i, client in enumerate(self.clients):
-            max_retries = 3
-            for attempt in range(max_retries):
-                try:
-                    await client.start(bot_token=BOT_TOKEN)
-                    print(f"[TG] Worker {i} started successfully.")
-                    break
-                except errors.FloodWaitError as e:
-                    wait_time = e.seconds
-                    print(f"[TG] Worker {i} hit FloodWait: Waiting {wait_time} seconds...")
-                    await asyncio.sleep(wait_time + 1) # Wait the required time + 1s buffer
-                except Exception as e:
-                    print(f"[TG] Worker {i} failed to start (attempt {attempt+1}): {e}")
-                    if attempt == max_retries - 1:
-                        print(f"[TG] CRITICAL: Worker {i} could not start after {max_retries} attempts.")
+        # Start the initial workers in parallel, staggered to stay clear of FloodWait
+        await asyncio.gather(*(
+            self._start_worker(i, delay=i * POOL_START_STAGGER) for i in range(self.pool_min)
+        ))
+        self._resize_scheduler()
+        self._autoscale_task = asyncio.ensure_future(self._autoscale_loop())
         
         # Check cryptg
         try:
@@ -94,27 +192,98 @@ class TelegramClientWrapper:
         # Resolve entity using primary client
         await self._resolve_bin_channel()
 
+    async def _start_worker(self, i: int, delay: float = 0) -> bool:
+        """Start one pool worker, with FloodWait handling."""
+        if delay:
+            await asyncio.sleep(delay)
+        self.workers.claim(i)
+        client = self.clients[i]
+        max_retries = 3
+        for attempt in range(max_retries):
+            try:
+                await client.start(bot_token=BOT_TOKEN)
+                if i > 0:
+                    # Populate this worker's entity cache for message lookups
+                    try:
+                        await client.get_input_entity(self.bin_channel)
+                    except Exception as e:
+                        print(f"⚠️ Worker {i} failed to resolve channel: {e}")
+                self.workers.mark_up(i)
+                print(f"[TG] Worker {i} started successfully.")
+                return True
+            except errors.FloodWaitError as e:
+                wait_time = e.seconds
+                print(f"[TG] Worker {i} hit FloodWait: Waiting {wait_time} seconds...")
+                await asyncio.sleep(wait_time + 1) # Wait the required time + 1s buffer
+            except Exception as e:
+                print(f"[TG] Worker {i} failed to start (attempt {attempt+1}): {e}")
+                if attempt == max_retries - 1:
+                    print(f"[TG] CRITICAL: Worker {i} could not start after {max_retries} attempts.")
+        self.workers.mark_down(i, "failed to start")
+        return False
+
+    def _resize_scheduler(self):
+        self.scheduler.resize(max(1, len(self.workers.active())) * SCHEDULER_SLOTS_PER_WORKER)
+
+    def _maybe_scale_up(self, force: bool = False):
+        """Add a worker when the running ones are saturated (or a big upload wants more)."""
+        if self._scaling:
+            return
+        active = self.workers.active()
+        if len(active) >= self.pool_size:
+            return
+        queued = sum(self.scheduler.stats()["queue_depth"].values())
+        if not force and self._active_streams <= len(active) * POOL_STREAMS_PER_WORKER and not queued:
+            return
+        index = next(i for i in range(self.pool_size) if i not in active)
+        self._scaling = True
+        asyncio.ensure_future(self._scale_up(index))
+
+    async def _scale_up(self, index: int):
+        try:
+            print(f"[POOL] Load is up ({self._active_streams} streams), starting worker {index}")
+            await self._start_worker(index)
+            self._resize_scheduler()
+        finally:
+            self._scaling = False
+
+    async def _autoscale_loop(self):
+        """Stop surplus workers once they have been idle for a while."""
+        while True:
+            await asyncio.sleep(POOL_CHECK_SECONDS)
+            try:
+                idle = [i for i in self.workers.idle(POOL_IDLE_SECONDS) if i != 0]
+                surplus = len(self.workers.active()) - self.pool_min
+                for index in sorted(idle, reverse=True)[:max(surplus, 0)]:
+                    print(f"[POOL] Worker {index} idle for {POOL_IDLE_SECONDS}s, stopping it")
+                    self.workers.park(index)
+                    await self.clients[index].disconnect()
+                self._resize_scheduler()
+            except Exception as e:
+                print(f"[POOL] Autoscale check failed: {e}")
+
+    async def _reconnect_worker(self, index: int):
+        """Bring a quarantined worker back (used by the worker manager)."""
+        client = self.clients[index]
+        if not client.is_connected():
+            await client.connect()
+        if not await client.is_user_authorized():
+            await client.start(bot_token=BOT_TOKEN)
+        await client.get_input_entity(self.bin_channel)
+
     async def stop(self):
         print("Stopping Telegram Client Pool...")
+        if self._autoscale_task:
+            self._autoscale_task.cancel()
         tasks = [client.disconnect() for client in self.clients]
         await asyncio.gather(*tasks)
 
     async def _resolve_bin_channel(self):
-        """Resolves and caches the BIN_CHANNEL entity for ALL clients."""
+        """Resolves and caches the BIN_CHANNEL entity on the primary client.
+        Other workers resolve it themselves when they start."""
         try:
-            # Resolve on primary client first
             self._bin_entity = await self.client.get_input_entity(self.bin_channel)
             print(f"✅  Resolved BIN_CHANNEL (Worker 0): {self.bin_channel}")
-            
-            # Resolve on other workers to populate their cache
-            # This ensures they can fetch messages during retries
-            for i, worker in enumerate(self.clients[1:], 1):
-                try:
-                    await worker.get_input_entity(self.bin_channel)
-                    print(f"✅  Resolved BIN_CHANNEL (Worker {i}): {self.bin_channel}")
-                except Exception as e:
-                    print(f"⚠️ Worker {i} failed to resolve channel: {e}")
-                    
         except Exception as e:
             print(f"❌  Could not resolve BIN_CHANNEL: {e}")
             print("   Uploads might fail if the bot hasn't seen the channel yet.")
@@ -142,6 +311,64 @@ class TelegramClientWrapper:
             filename = name[:195] + ext
         return filename
 
+    async def _prepare_thumb(self, thumbnail: str, work_dir: str) -> Optional[str]:
+        """Local path for a thumbnail given as URL or path (URLs are downloaded to work_dir)."""
+        thumb_path = None
+        if thumbnail and (thumbnail.startswith("http://") or thumbnail.startswith("https://")):
+            try:
+                import urllib.request
+                import uuid
+                thumb_name = f"thumb_{uuid.uuid4()}.jpg"
+                thumb_path = os.path.join(work_dir, thumb_name)
+                
+                def _d_thumb():
+                    with urllib.request.urlopen(thumbnail, timeout=10) as response:
+                        with open(thumb_path, 'wb') as f:
+                            f.write(response.read())
+                
+                await asyncio.get_event_loop().run_in_executor(None, _d_thumb)
+            except Exception as e:
+                print(f"[TG] Failed to download thumbnail: {e}")
+                thumb_path = None
+        elif thumbnail and os.path.exists(thumbnail):
+            thumb_path = thumbnail
+        return thumb_path
+
+    def _cleanup_thumb(self, thumbnail: str, thumb_path: Optional[str]):
+        if thumb_path and thumbnail.startswith("http") and os.path.exists(thumb_path):
+            try:
+                os.remove(thumb_path)
+            except:
+                pass
+
+    def _media_attributes(self, file_name: str, clean_name: str, duration: int, title: str, artist: str) -> list:
+        attributes = []
+        
+        # Add MIME-specific attributes
+        mime_type, _ = mimetypes.guess_type(file_name)
+        is_video = mime_type and mime_type.startswith('video')
+        is_audio = mime_type and mime_type.startswith('audio')
+        
+        if is_video:
+            from telethon.tl.types import DocumentAttributeVideo
+            attributes.append(DocumentAttributeVideo(
+                duration=duration or 0,
+                w=0, h=0, # Unknown dimensions
+                supports_streaming=True
+            ))
+        elif is_audio:
+            from telethon.tl.types import DocumentAttributeAudio
+            attributes.append(DocumentAttributeAudio(
+                duration=duration or 0,
+                title=title,
+                performer=artist
+            ))
+        
+        # Always add filename attribute as backup
+        if clean_name != file_name:
+            attributes.append(DocumentAttributeFilename(file_name=clean_name))
+        return attributes
+
     async def upload_file(
         self, 
         file_path: str, 
@@ -165,182 +392,891 @@ class TelegramClientWrapper:
                 progress_callback(current, total, speed)
 
         # Download thumbnail if URL provided
-        thumb_path = None
-        if thumbnail and (thumbnail.startswith("http://") or thumbnail.startswith("https://")):
-            try:
-                import urllib.request
-                import uuid
-                thumb_name = f"thumb_{uuid.uuid4()}.jpg"
-                thumb_path = os.path.join(os.path.dirname(file_path), thumb_name)
-                
-                def _d_thumb():
-                    with urllib.request.urlopen(thumbnail, timeout=10) as response:
-                        with open(thumb_path, 'wb') as f:
-                            f.write(response.read())
-                
-                await asyncio.get_event_loop().run_in_executor(None, _d_thumb)
-            except Exception as e:
-                print(f"[TG] Failed to download thumbnail: {e}")
-                thumb_path = None
-        elif thumbnail and os.path.exists(thumbnail):
-            thumb_path = thumbnail
+        thumb_path = await self._prepare_thumb(thumbnail, os.path.dirname(file_path))
 
         try:
             print(f"[TG] Uploading {clean_name}...")
             
-            attributes = []
+            attributes = self._media_attributes(os.path.basename(file_path), clean_name, duration, title, artist)
             
-            # Add MIME-specific attributes
-            mime_type, _ = mimetypes.guess_type(file_path)
-            is_video = mime_type and mime_type.startswith('video')
-            is_audio = mime_type and mime_type.startswith('audio')
+            # Big files: spread the parts over every pool worker and
+            # remember acknowledged parts so a failure can resume
+            msg = None
+            file_size = os.path.getsize(file_path)
+            if file_size > BIG_FILE_THRESHOLD and (self.resumable_uploads or (self.parallel_uploads and len(self.clients) > 1)):
+                try:
+                    msg = await self._upload_parallel(file_path, file_size, clean_name, attributes, thumb_path, progress_callback)
+                except Exception as e:
+                    print(f"[TG] Part upload of {clean_name} failed ({e!r}), falling back to send_file")
             
-            if is_video:
-                from telethon.tl.types import DocumentAttributeVideo
-                attributes.append(DocumentAttributeVideo(
-                    duration=duration or 0,
-                    w=0, h=0, # Unknown dimensions
+            if msg is None:
+                msg = await self.client.send_file(
+                    self.bin_channel,
+                    file_path,
+                    caption=f"Uploaded via mPlay: {clean_name}",
+                    progress_callback=_progress if progress_callback else None,
+                    attributes=attributes,
+                    thumb=thumb_path,
+                    force_document=False, # Let Telethon decide (Audio/Video vs Document)
                     supports_streaming=True
-                ))
-            elif is_audio:
-                from telethon.tl.types import DocumentAttributeAudio
-                attributes.append(DocumentAttributeAudio(
-                    duration=duration or 0,
-                    title=title,
-                    performer=artist
-                ))
-            
-            # Always add filename attribute as backup
-            if clean_name != os.path.basename(file_path):
-                attributes.append(DocumentAttributeFilename(file_name=clean_name))
+                )
+            print(f"[TG] Upload complete! Msg ID: {msg.id}")
             
-            # Telethon handles parallel upload automatically for large files
-            msg = await self.client.send_file(
+            # We already know this message: seed the caches from the local copy
+            file_info = self._file_info(msg, msg.id)
+            self.message_cache.put(msg.id, msg, file_info)
+            await probe_store.capture(msg.id, file_path, file_info)
+            return msg
+        except Exception as e:
+            print(f"[TG] Upload failed: {e}")
+            return None
+        finally:
+            # Cleanup temp thumbnail
+            self._cleanup_thumb(thumbnail, thumb_path)
+
+    def _upload_workers(self) -> list:
+        if not self.parallel_uploads:
+            return [0]
+        return self.workers.available() or [0]
+
+    def _part_request(self, file_id: int, part: int, total_parts: int, data: bytes, is_big: bool):
+        if is_big:
+            return SaveBigFilePartRequest(file_id=file_id, file_part=part, file_total_parts=total_parts, bytes=data)
+        return SaveFilePartRequest(file_id=file_id, file_part=part, bytes=data)
+
+    async def _upload_parts(
+        self,
+        parts: AsyncIterator[Tuple[int, bytes]],
+        file_id: int,
+        total_parts: int,
+        is_big: bool,
+        on_part: Optional[Callable[[int, int], None]] = None,
+        workers: Optional[list] = None
+    ) -> int:
+        """
+        Send (part number, UPLOAD_PART_SIZE block) pairs concurrently across
+        `workers` (default: the pool's upload workers). A worker that hits
+        FloodWait hands its part back to the others and sits the wait out
+        alone. Returns the number of parts sent.
+        """
+        workers = workers or self._upload_workers()
+        queue: asyncio.Queue = asyncio.Queue()
+        # Bounds how many parts are buffered in memory at once
+        window = asyncio.Semaphore(len(workers) * UPLOAD_PARTS_PER_WORKER * 2)
+        failures = []
+
+        async def _sender(worker_idx: int):
+            while True:
+                wait = self.workers.flood_remaining(worker_idx)
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                part, data, attempts = await queue.get()
+                try:
+                    if failures:
+                        window.release()
+                        continue
+                    try:
+                        async with self.workers.track(worker_idx) as client:
+                            if not await client(self._part_request(file_id, part, total_parts, data, is_big)):
+                                raise RuntimeError(f"Telegram rejected part {part}")
+                    except errors.FloodWaitError as e:
+                        print(f"[TG] Worker {worker_idx} hit FloodWait on part {part}: backing off {e.seconds}s")
+                        queue.put_nowait((part, data, attempts))
+                        continue
+                    except Exception as e:
+                        if attempts + 1 >= 3:
+                            failures.append(e)
+                            window.release()
+                        else:
+                            queue.put_nowait((part, data, attempts + 1))
+                        continue
+                    window.release()
+                    if on_part:
+                        on_part(part, len(data))
+                finally:
+                    queue.task_done()
+
+        senders = [
+            asyncio.ensure_future(_sender(worker_idx))
+            for worker_idx in workers
+            for _ in range(UPLOAD_PARTS_PER_WORKER)
+        ]
+        count = 0
+        try:
+            async for part, data in parts:
+                if failures:
+                    break
+                await window.acquire()
+                queue.put_nowait((part, data, 0))
+                count += 1
+            await queue.join()
+        finally:
+            for task in senders:
+                task.cancel()
+
+        if failures:
+            raise failures[0]
+        return count
+
+    async def _send_uploaded(self, file_id: int, total_parts: int, is_big: bool,
+                             clean_name: str, attributes: list, thumb_path: Optional[str]):
+        """Turn saved parts into a BIN_CHANNEL message."""
+        if is_big:
+            input_file = InputFileBig(id=file_id, parts=total_parts, name=clean_name)
+        else:
+            input_file = InputFile(id=file_id, parts=total_parts, name=clean_name, md5_checksum="")
+        
+        try:
+            return await self.client.send_file(
                 self.bin_channel,
-                file_path,
+                input_file,
                 caption=f"Uploaded via mPlay: {clean_name}",
-                progress_callback=_progress if progress_callback else None,
                 attributes=attributes,
                 thumb=thumb_path,
-                force_document=False, # Let Telethon decide (Audio/Video vs Document)
+                force_document=False,
                 supports_streaming=True
             )
+        except errors.FilePartMissingError:
+            if self.parallel_uploads and len(self.clients) > 1:
+                # Parts saved by other sessions aren't visible to worker 0 here
+                print("[TG] Parts from other workers were not found, disabling parallel uploads")
+                self.parallel_uploads = False
+            raise
+
+    def _file_fingerprint(self, file_path: str, file_size: int) -> str:
+        """Content-based key for an upload session: size plus a hash of every byte.
+        Survives the file being re-downloaded to the same bytes; any other file
+        (even one with the same size, headers and tail) gets its own session,
+        so saved parts are never assembled into the wrong file. Runs in an executor."""
+        import hashlib
+        digest = hashlib.sha1(str(file_size).encode())
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(UPLOAD_PART_SIZE * 8), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    async def _open_upload_session(self, file_path: str, file_size: int, total_parts: int, owner: str):
+        """
+        (session key, file_id, acknowledged parts) for a big local file, leased
+        to `owner`. The key is None when another upload of the same content
+        holds the session: this one then goes ahead on its own file_id.
+        """
+        from database import claim_upload_session, create_upload_session
+        from datetime import datetime
+        
+        key = await asyncio.get_event_loop().run_in_executor(None, self._file_fingerprint, file_path, file_size)
+        session = await claim_upload_session(key, owner)
+        if session and session.get("total_parts") == total_parts:
+            age = (datetime.utcnow() - session["created_at"]).total_seconds()
+            if age < UPLOAD_SESSION_MAX_AGE:
+                return key, session["file_id"], set(session.get("parts", []))
+        
+        file_id = helpers.generate_random_long()
+        if not await create_upload_session(key, owner, file_id, file_size, total_parts, os.path.basename(file_path)):
+            print(f"[TG] {os.path.basename(file_path)} is already being uploaded, uploading without resume")
+            return None, file_id, set()
+        return key, file_id, set()
+
+    async def _upload_parallel(self, file_path: str, file_size: int, clean_name: str, attributes: list,
+                               thumb_path: Optional[str], progress_callback=None) -> Optional[Any]:
+        """
+        Part-parallel upload of a local file. None (or an exception) means
+        upload_file falls back to send_file.
+        With resumable uploads on, parts Telegram already acknowledged for
+        this file (same content) are skipped, and the send is retried a few
+        times before giving up.
+        """
+        self._maybe_scale_up(force=True)  # helps the next big upload, this one uses who's running
+        total_parts = (file_size + UPLOAD_PART_SIZE - 1) // UPLOAD_PART_SIZE
+        is_big = file_size > BIG_FILE_THRESHOLD
+        loop = asyncio.get_event_loop()
+        start_time = time.time()
+        
+        session_key, done = None, set()
+        file_id = helpers.generate_random_long()
+        owner = f"{os.getpid()}:{helpers.generate_random_long()}"
+        if self.resumable_uploads:
+            from database import add_upload_session_parts, delete_upload_session, release_upload_session
+            try:
+                session_key, file_id, done = await self._open_upload_session(file_path, file_size, total_parts, owner)
+                if done:
+                    print(f"[TG] Resuming {clean_name}: {len(done)}/{total_parts} parts already uploaded")
+            except Exception as e:
+                print(f"[TG] Upload session unavailable, uploading without resume: {e}")
+        
+        pending = []
+        sent = len(done) * UPLOAD_PART_SIZE
+
+        async def _parts():
+            with open(file_path, "rb") as f:
+                for part in range(total_parts):
+                    if part in done:
+                        continue
+                    f.seek(part * UPLOAD_PART_SIZE)
+                    data = await loop.run_in_executor(None, f.read, UPLOAD_PART_SIZE)
+                    if not data:
+                        raise ValueError(f"{file_path} shrank during upload")
+                    yield part, data
+
+        async def _flush_parts():
+            if session_key and pending:
+                batch = pending[:]
+                pending.clear()
+                try:
+                    await add_upload_session_parts(session_key, owner, batch)
+                except Exception as e:
+                    print(f"[TG] Could not record upload progress: {e}")
+
+        def _on_part(part: int, length: int):
+            nonlocal sent
+            done.add(part)
+            sent += length
+            if session_key:
+                pending.append(part)
+                if len(pending) >= UPLOAD_SESSION_FLUSH_PARTS:
+                    asyncio.ensure_future(_flush_parts())
+            if progress_callback:
+                elapsed = time.time() - start_time
+                progress_callback(min(sent, file_size), file_size, sent / elapsed if elapsed > 0 else 0)
+
+        async def _drop_session():
+            if not session_key:
+                return
+            pending.clear()
+            try:
+                await delete_upload_session(session_key, owner)
+            except Exception as e:
+                print(f"[TG] Could not delete upload session: {e}")
+
+        attempts = UPLOAD_RESUME_ATTEMPTS if session_key else 1
+        for attempt in range(attempts):
+            try:
+                workers = len(self._upload_workers())
+                count = await self._upload_parts(_parts(), file_id, total_parts, is_big, _on_part)
+                elapsed = time.time() - start_time
+                print(f"[TG] Sent {count} parts over {workers} workers "
+                      f"({count * UPLOAD_PART_SIZE / (1024 * 1024) / elapsed if elapsed > 0 else 0:.1f} MB/s)")
+                msg = await self._send_uploaded(file_id, total_parts, is_big, clean_name, attributes, thumb_path)
+            except errors.FilePartMissingError:
+                # Parts expired or live in another session: the record is useless now
+                await _drop_session()
+                return None
+            except Exception as e:
+                if attempt == attempts - 1:
+                    if session_key:
+                        # Recorded parts stay resumable by the next attempt at this file
+                        await _flush_parts()
+                        try:
+                            await release_upload_session(session_key, owner)
+                        except Exception as release_error:
+                            print(f"[TG] Could not release upload session: {release_error}")
+                    raise
+                print(f"[TG] Upload of {clean_name} interrupted ({e}), resuming from {len(done)}/{total_parts} parts")
+                await asyncio.sleep(2 ** attempt)
+                continue
+            finally:
+                await _flush_parts()
+
+            # The message is posted: nothing from here on may lead to a retry (a second post)
+            await _drop_session()
+            return msg
+
+    async def upload_stream(
+        self,
+        chunks: AsyncIterator[bytes],
+        file_name: str,
+        file_size: int,
+        progress_callback=None,
+        title: str = None,
+        artist: str = None,
+        duration: int = 0,
+        thumbnail: str = None
+    ) -> Optional[Any]:
+        """
+        Upload a file of known size straight from an async byte source
+        (e.g. a request body) using upload.save*FilePart, no temp file.
+        Head/tail bytes are kept on the way through for the probe store.
+        Parts all go through worker 0, the session that sends the message:
+        the body can't be replayed, so FILE_PART_MISSING from parts saved by
+        another session would be unrecoverable here.
+        """
+        clean_name = self._sanitize_filename(os.path.basename(file_name))
+        is_big = file_size > BIG_FILE_THRESHOLD
+        total_parts = max(1, (file_size + UPLOAD_PART_SIZE - 1) // UPLOAD_PART_SIZE)
+        file_id = helpers.generate_random_long()
+        start_time = time.time()
+        
+        head = bytearray()
+        tail = bytearray()
+        tail_keep = PROBE_TAIL_BYTES + CHUNK_SIZE  # enough to cover aligned tail blocks
+        
+        thumb_path = await self._prepare_thumb(thumbnail, TEMP_DIR)
+        try:
+            print(f"[TG] Streaming upload {clean_name} ({file_size} bytes, {total_parts} parts)...")
+            sent = 0
+            
+            async def _parts():
+                buffer = bytearray()
+                received = 0
+                part = 0
+                async for data in chunks:
+                    if not data:
+                        continue
+                    received += len(data)
+                    if received > file_size:
+                        raise ValueError("Body is larger than the declared size")
+                    if len(head) < PROBE_HEAD_BYTES:
+                        head.extend(data[:PROBE_HEAD_BYTES - len(head)])
+                    tail.extend(data)
+                    if len(tail) > tail_keep:
+                        del tail[:len(tail) - tail_keep]
+                    
+                    buffer += data
+                    while len(buffer) >= UPLOAD_PART_SIZE:
+                        yield part, bytes(buffer[:UPLOAD_PART_SIZE])
+                        del buffer[:UPLOAD_PART_SIZE]
+                        part += 1
+                if received != file_size:
+                    raise ValueError(f"Expected {file_size} bytes, received {received}")
+                if buffer:
+                    yield part, bytes(buffer)
+            
+            def _on_part(part: int, length: int):
+                nonlocal sent
+                sent += length
+                if progress_callback:
+                    elapsed = time.time() - start_time
+                    progress_callback(sent, file_size, sent / elapsed if elapsed > 0 else 0)
+            
+            await self._upload_parts(_parts(), file_id, total_parts, is_big, _on_part, workers=[0])
+            msg = await self._send_uploaded(
+                file_id, total_parts, is_big, clean_name,
+                self._media_attributes(os.path.basename(file_name), clean_name, duration, title, artist),
+                thumb_path
+            )
             print(f"[TG] Upload complete! Msg ID: {msg.id}")
+            
+            file_info = self._file_info(msg, msg.id)
+            self.message_cache.put(msg.id, msg, file_info)
+            await probe_store.capture_buffers(msg.id, file_info, bytes(head), bytes(tail))
             return msg
         except Exception as e:
-            print(f"[TG] Upload failed: {e}")
+            print(f"[TG] Streaming upload failed: {e}")
             return None
         finally:
-            # Cleanup temp thumbnail
-            if thumb_path and thumbnail.startswith("http") and os.path.exists(thumb_path):
+            self._cleanup_thumb(thumbnail, thumb_path)
+
+    def _file_info(self, message, message_id: int) -> Dict[str, Any]:
+        return {
+            "file_name": message.file.name or f"file_{message_id}.mp3",
+            "mime_type": message.file.mime_type or mimetypes.guess_type(message.file.name or "")[0] or "audio/mpeg",
+            "file_size": message.file.size,
+            "file_id": message.file.id or str(message_id),
+        }
+
+    def _start_flight(self, message_id: int) -> asyncio.Future:
+        future = asyncio.get_event_loop().create_future()
+        # Nobody may be waiting on it; mark failures as retrieved so they aren't logged
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._resolving[message_id] = future
+        return future
+
+    def _end_flight(self, message_id: int, future: asyncio.Future):
+        if self._resolving.get(message_id) is future:
+            del self._resolving[message_id]
+
+    async def _get_message(self, message_id: int, refresh: bool = False):
+        """
+        Resolve a BIN_CHANNEL message through the message cache.
+        Concurrent lookups of the same id share one request.
+        Returns (message, file_info) or raises FileNotFound.
+        """
+        if not refresh:
+            cached = self.message_cache.get(message_id)
+            if cached is not None:
+                message, file_info = cached
+                if message is MISSING:
+                    raise FileNotFound(f"Message {message_id} not found")
+                return message, file_info
+
+            pending = self._resolving.get(message_id)
+            if pending is not None:
                 try:
-                    os.remove(thumb_path)
-                except:
-                    pass
+                    result = await asyncio.shield(pending)
+                    if result is None:
+                        raise FileNotFound(f"Message {message_id} not found")
+                    return result
+                except FileNotFound:
+                    raise
+                except Exception:
+                    pass  # that lookup failed, try our own
 
-    async def get_file_info(self, message_id: int) -> Dict[str, Any]:
-        """Fetch metadata, rotating through workers to avoid FloodWait."""
+        future = self._start_flight(message_id)
+        try:
+            result = await self._lookup_message(message_id)
+            future.set_result(result)
+            return result
+        except FileNotFound:
+            future.set_result(None)
+            raise
+        except BaseException as e:
+            future.set_exception(e if isinstance(e, Exception) else RuntimeError(f"Lookup of {message_id} was cancelled"))
+            raise
+        finally:
+            self._end_flight(message_id, future)
+
+    async def _lookup_message(self, message_id: int):
+        """One message lookup against Telegram, falling through the pool."""
         last_error = None
-        
-        # Determine start index for round-robin validation
-        # We start with a random worker to distribute check load
-        import random
-        start_idx = random.randint(0, len(self.clients) - 1)
-        
-        for i in range(len(self.clients)):
-            idx = (start_idx + i) % len(self.clients)
-            client = self.clients[idx]
-            
+        found_missing = False
+
+        # Healthiest, least loaded worker first; the rest are fallbacks
+        for idx in self.workers.order():
             try:
-                # Try fetching message
-                message = await client.get_messages(self.bin_channel, ids=message_id)
-                
-                # If not found, maybe channel cache is stale for this worker?
-                if not message:
-                    try:
-                        await client.get_input_entity(self.bin_channel)
-                        message = await client.get_messages(self.bin_channel, ids=message_id)
-                    except:
-                        pass
+                async with self.workers.track(idx) as client:
+                    # Try fetching message
+                    message = await client.get_messages(self.bin_channel, ids=message_id)
+                    
+                    # If not found, maybe channel cache is stale for this worker?
+                    if not message:
+                        try:
+                            await client.get_input_entity(self.bin_channel)
+                            message = await client.get_messages(self.bin_channel, ids=message_id)
+                        except:
+                            pass
 
                 if message and message.media:
-                    return {
-                        "file_name": message.file.name or f"file_{message_id}.mp3",
-                        "mime_type": message.file.mime_type or mimetypes.guess_type(message.file.name or "")[0] or "audio/mpeg",
-                        "file_size": message.file.size
-                    }
+                    file_info = self._file_info(message, message_id)
+                    self.message_cache.put(message_id, message, file_info)
+                    return message, file_info
+                found_missing = True
             except Exception as e:
                 # Log usage only if it's not a common "message not found" logic error
                 # print(f"[TG] Worker {idx} check failed: {e}")
                 last_error = e
         
+        # Only remember the miss if Telegram actually answered "no such message"
+        if found_missing:
+            self.message_cache.put_missing(message_id)
+
         # If we get here, all workers failed
-        print(f"[TG] Error get_file_info(id={message_id}) failed on ALL workers. Last error: {last_error}")
+        print(f"[TG] Error get_messages(id={message_id}) failed on ALL workers. Last error: {last_error}")
         raise FileNotFound(f"Message {message_id} not found")
 
+    async def _resolve_batch(self, message_ids: list, futures: Dict[int, asyncio.Future]):
+        """One get_messages(ids=[...]) call; settles the futures of its ids."""
+        try:
+            messages = None
+            last_error = None
+            for idx in self.workers.order():
+                try:
+                    async with self.workers.track(idx) as client:
+                        messages = await client.get_messages(self.bin_channel, ids=message_ids)
+                    break
+                except Exception as e:
+                    last_error = e
+            if messages is None:
+                raise last_error or RuntimeError("No worker could fetch messages")
+
+            for message_id, message in zip(message_ids, messages):
+                if message and message.media:
+                    file_info = self._file_info(message, message_id)
+                    self.message_cache.put(message_id, message, file_info)
+                    futures[message_id].set_result((message, file_info))
+                else:
+                    self.message_cache.put_missing(message_id)
+                    futures[message_id].set_result(None)
+        except Exception as e:
+            print(f"[TG] Batch get_messages of {len(message_ids)} ids failed: {e}")
+            for future in futures.values():
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            for message_id, future in futures.items():
+                if not future.done():
+                    future.set_exception(RuntimeError("Batch lookup did not answer"))
+                self._end_flight(message_id, future)
+
+    async def resolve_messages(self, message_ids) -> Dict[int, Optional[Dict[str, Any]]]:
+        """
+        Resolve many BIN_CHANNEL messages with as few RPCs as possible:
+        cached ids cost nothing, ids already being looked up are joined, the
+        rest go out in get_messages calls of up to MESSAGE_BATCH_SIZE ids.
 
-    async def stream_file(self, message_id: int, offset: int = 0, limit: int = 0) -> AsyncGenerator[bytes, None]:
+        Returns {message_id: file_info, or None if the message is gone}.
+        Ids whose lookup failed (network, FloodWait) are left out.
+        """
+        results: Dict[int, Optional[Dict[str, Any]]] = {}
+        waiting: Dict[int, asyncio.Future] = {}
+        to_fetch = []
+        for message_id in dict.fromkeys(int(m) for m in message_ids):
+            cached = self.message_cache.get(message_id)
+            if cached is not None:
+                message, file_info = cached
+                results[message_id] = None if message is MISSING else file_info
+            elif message_id in self._resolving:
+                waiting[message_id] = self._resolving[message_id]
+            else:
+                waiting[message_id] = self._start_flight(message_id)
+                to_fetch.append(message_id)
+
+        for i in range(0, len(to_fetch), MESSAGE_BATCH_SIZE):
+            batch = to_fetch[i:i + MESSAGE_BATCH_SIZE]
+            # Own task: a caller going away mustn't strand other waiters
+            asyncio.ensure_future(self._resolve_batch(batch, {mid: waiting[mid] for mid in batch}))
+
+        if waiting:
+            settled = await asyncio.gather(*(asyncio.shield(f) for f in waiting.values()), return_exceptions=True)
+            for message_id, result in zip(waiting, settled):
+                if isinstance(result, BaseException):
+                    continue
+                results[message_id] = result[1] if result else None
+        if to_fetch:
+            print(f"[TG] Resolved {len(to_fetch)} messages in {(len(to_fetch) + MESSAGE_BATCH_SIZE - 1) // MESSAGE_BATCH_SIZE} batch(es)")
+        return results
+
+    async def get_file_info(self, message_id: int) -> Dict[str, Any]:
+        """Fetch metadata, rotating through workers to avoid FloodWait."""
+        file_info = probe_store.file_info(message_id)
+        if file_info:
+            return file_info
+        _, file_info = await self._get_message(message_id)
+        return file_info
+
+    def forget_message(self, message_id: int):
+        """Drop everything cached for a message (song deleted or re-uploaded)."""
+        self.message_cache.invalidate(message_id)
+        self._readahead_cancel(message_id)
+        self._readahead.pop(message_id, None)
+        chunk_cache.invalidate(message_id)
+        probe_store.remove(message_id)
+
+    def cache_stats(self) -> Dict[str, Any]:
+        return {
+            "messages": self.message_cache.stats(),
+            "chunks": chunk_cache.stats(),
+            "probes": probe_store.stats(),
+            "buffers": buffer_pool.stats(),
+            "scheduler": self.scheduler.stats(),
+            "fetches": {
+                "in_flight": len(self._chunk_flights),
+                "striped": self._stripe_blocks,
+                "coalesced": self.coalesced_fetches,
+            },
+            "workers": self.workers.stats(),
+            "pool": {
+                "active": len(self.workers.active()),
+                "max": self.pool_size,
+                "streams": self._active_streams,
+            },
+            "readahead": {
+                "streams": len(self._readahead),
+                "in_flight": sum(len(st.tasks) for st in self._readahead.values()),
+                "buffered": len(self._prefetched),
+            },
+        }
+
+
+    async def _download_chunk(self, client: TelegramClient, media, index: int) -> bytes:
+        """Download one aligned CHUNK_SIZE block of a media file."""
+        data = b""
+        async for part in client.iter_download(
+            media,
+            offset=index * CHUNK_SIZE,
+            limit=1,
+            chunk_size=CHUNK_SIZE,
+            request_size=CHUNK_SIZE,
+        ):
+            data = part
+            break
+        return data
+
+    async def _download_from_pool(self, message_id: int, index: int, worker: Optional[int]) -> bytes:
+        """
+        Download one block on `worker` (or the best available one). A worker
+        that is flooded, dropped or failing is skipped and the block retried
+        on another, so one bad connection doesn't stall the stream.
+        """
+        tried = []
+        if worker is None or not self.workers.usable(worker):
+            worker = self.workers.pick()
+        while True:
+            message, _ = await self._get_message(message_id)
+            try:
+                async with self.workers.track(worker) as client:
+                    try:
+                        return await self._download_chunk(client, message.media, index)
+                    except errors.FileReferenceExpiredError:
+                        # Cached media handle went stale, refresh it once
+                        message, _ = await self._get_message(message_id, refresh=True)
+                        return await self._download_chunk(client, message.media, index)
+            except (errors.FloodWaitError,) + CONNECTION_ERRORS as e:
+                tried.append(worker)
+                if len(tried) >= len(self.clients):
+                    raise
+                print(f"[STREAM] Worker {worker} failed block {message_id}/{index} ({type(e).__name__}), retrying elsewhere")
+                worker = self.workers.pick(exclude=tried)
+
+    async def _fetch_chunk(self, message_id: int, index: int, worker: Optional[int] = None,
+                           lane: tuple = ("internal", PRIORITY_PREFETCH)) -> bytes:
+        """Return one block, from the probe store, the disk cache or Telegram."""
+        chunk = await probe_store.get(message_id, index)
+        if chunk is not None:
+            return chunk
+
+        chunk = await chunk_cache.get(message_id, index)
+        if chunk is not None:
+            return chunk
+
+        key = (message_id, index)
+        flight = self._chunk_flights.get(key)
+        if flight is None:
+            flight = self._chunk_flights[key] = _ChunkFlight(lane[1])
+            flight.task = asyncio.ensure_future(self._fetch_remote(message_id, index, worker, lane, flight))
+            flight.task.add_done_callback(lambda _, key=key, flight=flight: self._end_chunk_flight(key, flight))
+        else:
+            self.coalesced_fetches += 1
+            if lane[1] < flight.priority:
+                # e.g. audio catching up with its own read-ahead: don't leave it in the prefetch lane
+                flight.priority = lane[1]
+                if flight.waiter is not None:
+                    self.scheduler.promote(flight.waiter, lane[1])
+
+        # Readers hold a reference; the download is only abandoned when all are gone
+        flight.readers += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.readers -= 1
+            if flight.readers == 0 and not flight.task.done():
+                flight.task.cancel()
+
+    def _end_chunk_flight(self, key: tuple, flight: _ChunkFlight):
+        if self._chunk_flights.get(key) is flight:
+            del self._chunk_flights[key]
+        if not flight.task.cancelled():
+            flight.task.exception()  # retrieved by the readers; don't log it twice
+
+    async def _fetch_remote(self, message_id: int, index: int, worker: Optional[int], lane: tuple,
+                            flight: _ChunkFlight) -> bytes:
+        # lane = (client_id, priority) of the first reader: only real Telegram traffic is scheduled.
+        # Readers joining later may raise flight.priority, also while we're queued.
+        def queued(waiter):
+            flight.waiter = waiter
+
+        async with self.scheduler.slot(lane[0], flight.priority, on_queued=queued):
+            flight.waiter = None
+            chunk = await self._download_from_pool(message_id, index, worker)
+
+        if chunk:
+            chunk_cache.put(message_id, index, chunk)
+        return chunk
+
+    async def _load_chunk(self, message_id: int, index: int, worker: Optional[int], lane: tuple) -> bytes:
+        """Return one block, preferring read-ahead results over a fresh fetch."""
+        chunk = self._prefetched.pop((message_id, index), None)
+        if chunk is not None:
+            return chunk
+
+        # A read-ahead still running for this block shares its flight with us
+        # (_fetch_chunk coalesces by block), which promotes it to our priority
+        chunk = await self._fetch_chunk(message_id, index, worker, lane)
+        self._prefetched.pop((message_id, index), None)
+        return chunk
+
+    def _readahead_observe(self, message_id: int, index: int, request_last: int, file_last: int, client_id: str):
+        """Record that `index` is being served and prefetch past the request if access is sequential."""
+        if READAHEAD_CHUNKS <= 0:
+            return
+
+        now = time.monotonic()
+        state = self._readahead_state(message_id)
+        state.streak = state.streak + 1 if index == state.last_index + 1 else 0
+        state.last_index = index
+        state.touched = now
+        if state.streak < READAHEAD_TRIGGER - 1:
+            return
+
+        # Blocks up to request_last are already being fetched by the stream itself
+        start = max(index, request_last) + 1
+        stop = min(index + READAHEAD_CHUNKS, file_last)
+        for i in range(start, stop + 1):
+            if (i in state.tasks or (message_id, i) in self._prefetched
+                    or chunk_cache.contains(message_id, i) or probe_store.has(message_id, i)):
+                continue
+            if len(state.tasks) >= READAHEAD_CHUNKS:
+                break
+            in_flight = sum(len(st.tasks) for st in self._readahead.values())
+            if in_flight + len(self._prefetched) >= READAHEAD_MAX_CHUNKS:
+                break
+            state.tasks[i] = asyncio.ensure_future(self._prefetch(message_id, i, state, client_id))
+
+    async def _prefetch(self, message_id: int, index: int, state: _ReadAheadState, client_id: str) -> bytes:
+        try:
+            chunk = await self._fetch_chunk(message_id, index, None, (client_id, PRIORITY_PREFETCH))
+            if chunk:
+                # Prefetched blocks can wait a while: don't let them pin pool slabs
+                self._prefetched[(message_id, index)] = buffer_pool.hold(chunk)
+                while len(self._prefetched) > READAHEAD_MAX_CHUNKS:
+                    self._prefetched.popitem(last=False)
+            return chunk
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[READAHEAD] Prefetch {message_id}/{index} failed: {e}")
+            return b""
+        finally:
+            state.tasks.pop(index, None)
+
+    def _readahead_state(self, message_id: int) -> _ReadAheadState:
+        state = self._readahead.get(message_id)
+        if state is None:
+            # Forget streams nobody has touched for a while
+            now = time.monotonic()
+            for mid, st in list(self._readahead.items()):
+                if not st.tasks and not st.readers and now - st.touched > READAHEAD_IDLE_SECONDS:
+                    del self._readahead[mid]
+            state = self._readahead[message_id] = _ReadAheadState()
+        return state
+
+    def _readahead_enter(self, message_id: int):
+        self._readahead_state(message_id).readers += 1
+
+    def _readahead_leave(self, message_id: int, completed: bool):
+        """
+        A stream of the message ended. Read-ahead is only dropped when the
+        last reader went away mid-stream: other clients playing the same
+        song still need it, and a finished Range request is usually followed
+        by the next one.
+        """
+        state = self._readahead.get(message_id)
+        if not state:
+            return
+        state.readers = max(0, state.readers - 1)
+        if not state.readers and not completed:
+            self._readahead_cancel(message_id)
+
+    def _readahead_cancel(self, message_id: int):
+        """Stop prefetching for a message nobody is reading any more."""
+        state = self._readahead.get(message_id)
+        if not state:
+            return
+        for task in state.tasks.values():
+            task.cancel()
+        state.tasks.clear()
+        for key in [k for k in self._prefetched if k[0] == message_id]:
+            del self._prefetched[key]
+
+    async def _iter_chunks(self, message_id: int, first: int, last: int, worker_idx: int,
+                           lane: tuple) -> AsyncGenerator[bytes, None]:
+        """
+        Yield blocks first..last in order.
+
+        In striped mode up to `stripe_window` blocks are fetched at once,
+        each on whichever worker the manager picks. The deque of pending fetches is
+        the reorder buffer: blocks are yielded strictly in order, so memory
+        never exceeds stripe_window * CHUNK_SIZE per stream. Every block after
+        the head one takes a slot of the STRIPE_MAX_BLOCKS budget shared by all
+        streams; without one the stream just fetches fewer blocks at a time.
+        """
+        window = min(self.stripe_window, last - first + 1)
+        if not self.striped or window <= 1 or self.pool_size == 1:
+            for index in range(first, last + 1):
+                yield await self._load_chunk(message_id, index, worker_idx, lane)
+            return
+
+        pending = deque()  # (task, holds a budget slot)
+        next_index = first
+        try:
+            while next_index <= last or pending:
+                while next_index <= last and len(pending) < window:
+                    budgeted = bool(pending)
+                    if budgeted:
+                        if self._stripe_blocks >= STRIPE_MAX_BLOCKS:
+                            break
+                        self._stripe_blocks += 1
+                    pending.append((asyncio.ensure_future(self._load_chunk(message_id, next_index, None, lane)), budgeted))
+                    next_index += 1
+                task, budgeted = pending.popleft()
+                try:
+                    chunk = await task
+                finally:
+                    if budgeted:
+                        self._stripe_blocks -= 1
+                yield chunk
+        finally:
+            # Client went away or a fetch failed: don't leave orphan downloads
+            for task, budgeted in pending:
+                task.cancel()
+                if budgeted:
+                    self._stripe_blocks -= 1
+
+    async def stream_file(self, message_id: int, offset: int = 0, limit: int = 0,
+                          client_id: str = "internal", priority: int = PRIORITY_AUDIO) -> AsyncGenerator[bytes, None]:
         """
         Load-Balanced Streamer.
         
         Optimized for Client-Side Parallelism (e.g. Mobile Proxy).
         Requests are distributed across the Worker Pool.
+        `client_id`/`priority` feed the scheduler (fairness, audio-first, rate limits).
         """
+        self._active_streams += 1
+        self._maybe_scale_up()
         try:
-            # 1. Round-Robin / Random Worker Selection
+            # 1. Least-loaded healthy worker (power of two choices)
             # This balances the load when the client makes parallel requests.
-            import random
-            worker_idx = random.randint(0, self.pool_size - 1)
-            client = self.clients[worker_idx]
+            worker_idx = self.workers.pick()
             
             # print(f"[STREAM] Request: Offset={offset}, Limit={limit} | Worker {worker_idx}")
 
-            # 2. Fetch Media (Worker Specific)
-            try:
-                message = await client.get_messages(self.bin_channel, ids=message_id)
-            except Exception as e:
-                print(f"[STREAM] Worker {worker_idx} failed metadata: {e}. trying others...")
-                # Try finding ANY worker that can see the message
-                message = None
-                for i in range(len(self.clients)):
-                    if i == worker_idx: continue
-                    try:
-                        msg_check = await self.clients[i].get_messages(self.bin_channel, ids=message_id)
-                        if msg_check and msg_check.media:
-                            client = self.clients[i]
-                            message = msg_check
-                            print(f"[STREAM] Failover success: Switched to Worker {i}")
-                            break
-                    except:
-                        continue
-
-            if not message or not message.media:
-                raise FileNotFound(f"Message {message_id} not found")
+            # 2. Resolve size (probe/message cache); the media handle is only
+            # looked up if a block actually has to come from Telegram
+            file_info = await self.get_file_info(message_id)
 
-            # 3. Stream
-            chunk_size = 1024 * 1024  # 1MB
-            file_size = message.file.size
+            # 3. Stream aligned blocks, serving repeats from the disk cache
+            file_size = file_info["file_size"]
             if limit <= 0:
                 limit = file_size - offset
 
-            remaining = limit
-            current_pos = offset
-            
-            async for chunk in client.iter_download(
-                message.media,
-                offset=current_pos,
-                limit=remaining,
-                chunk_size=chunk_size,
-                request_size=512 * 1024,
-            ):
-                if not chunk: break
-                yield chunk
-                remaining -= len(chunk)
-                current_pos += len(chunk)
-                if remaining <= 0: break
+            end = min(offset + limit, file_size)  # exclusive
+            if end <= offset:
+                return
+
+            first_chunk = offset // CHUNK_SIZE
+            last_chunk = (end - 1) // CHUNK_SIZE
+            file_last_chunk = (file_size - 1) // CHUNK_SIZE
+
+            index = first_chunk
+            completed = False
+            self._readahead_enter(message_id)
+            chunks = self._iter_chunks(message_id, first_chunk, last_chunk, worker_idx, (client_id, priority))
+            try:
+                async for chunk in chunks:
+                    if not chunk:
+                        break
+
+                    self._readahead_observe(message_id, index, last_chunk, file_last_chunk, client_id)
+
+                    chunk_start = index * CHUNK_SIZE
+                    lo = offset - chunk_start if index == first_chunk else 0
+                    hi = end - chunk_start if index == last_chunk else len(chunk)
+                    await self.scheduler.throttle(client_id, priority, hi - lo)
+                    # A view, not a slice: pooled cache buffers and Telegram bytes
+                    # reach the ASGI send without being copied
+                    yield memoryview(chunk)[lo:hi]
+                    index += 1
+                completed = True
+            finally:
+                # Cancel in-flight stripe fetches right away instead of at GC time
+                await chunks.aclose()
+                # If this was the last client and it disconnected mid-stream,
+                # read-ahead is wasted work now
+                self._readahead_leave(message_id, completed)
 
         except Exception as e:
             print(f"[STREAM ERROR] {e}")
             raise
+        finally:
+            self._active_streams -= 1
 
 tg_client = TelegramClientWrapper()
\ No newline at end of file
@@ -0,0 +1,219 @@
+"""
+Worker Manager Module
+Health tracking and load-aware selection for the Telegram client pool.
+
+- Each worker keeps its in-flight request count, an EWMA of recent
+  latency and when its current FloodWait ends.
+- Selection is power-of-two-choices over the workers that are usable right
+  now: two random candidates, the one with the lower expected wait wins.
+- Workers that fail to start, drop their connection or keep failing are
+  quarantined and reconnected in the background with exponential backoff.
+- Workers the autoscaler stopped are "parked" and left alone.
+"""
+
+import os
+import time
+import random
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence
+
+from telethon import errors
+
+# Consecutive connection-level failures before a worker is quarantined
+WORKER_MAX_FAILURES = int(os.getenv("WORKER_MAX_FAILURES", "3"))
+WORKER_QUARANTINE_SECONDS = int(os.getenv("WORKER_QUARANTINE_SECONDS", "30"))
+WORKER_RECONNECT_MAX_SECONDS = 120
+LATENCY_ALPHA = 0.2
+DEFAULT_LATENCY = 0.5  # seconds, until a worker has served something
+
+# Errors that say something about the connection rather than the request
+CONNECTION_ERRORS = (ConnectionError, OSError, asyncio.TimeoutError, errors.ServerError)
+
+
+class WorkerState:
+    __slots__ = ("index", "up", "parked", "inflight", "latency", "flood_until", "quarantined_until",
+                 "failures", "served", "errors", "reconnecting", "last_used")
+
+    def __init__(self, index: int):
+        self.index = index
+        self.up = False  # set once the client has started
+        self.parked = True  # not started yet, or stopped by the autoscaler
+        self.inflight = 0
+        self.latency = DEFAULT_LATENCY
+        self.flood_until = 0.0
+        self.quarantined_until = 0.0
+        self.failures = 0
+        self.served = 0
+        self.errors = 0
+        self.reconnecting = False
+        self.last_used = time.monotonic()
+
+    def blocked_until(self) -> float:
+        return max(self.flood_until, self.quarantined_until)
+
+    def score(self) -> float:
+        """Expected wait if one more request lands here."""
+        return (self.inflight + 1) * self.latency
+
+
+class WorkerManager:
+    def __init__(self, clients: Sequence, reconnect: Callable[[int], Awaitable[None]]):
+        self.clients = clients
+        self._reconnect = reconnect
+        self.workers: List[WorkerState] = [WorkerState(i) for i in range(len(clients))]
+
+    def _usable(self, worker: WorkerState, now: float) -> bool:
+        if not worker.up or worker.blocked_until() > now:
+            return False
+        if not self.clients[worker.index].is_connected():
+            self.mark_down(worker.index, "disconnected")
+            return False
+        return True
+
+    def available(self) -> List[int]:
+        now = time.monotonic()
+        return [w.index for w in self.workers if self._usable(w, now)]
+
+    def pick(self, exclude: Sequence[int] = ()) -> int:
+        """Power-of-two-choices among usable workers."""
+        candidates = [i for i in self.available() if i not in exclude]
+        if not candidates:
+            # Nothing healthy: the worker that frees up first is the best bet
+            pool = [w for w in self.workers if w.index not in exclude] or self.workers
+            return min(pool, key=lambda w: (not w.up, w.blocked_until(), w.inflight)).index
+        if len(candidates) == 1:
+            return candidates[0]
+        a, b = random.sample(candidates, 2)
+        return a if self.workers[a].score() <= self.workers[b].score() else b
+
+    def order(self) -> List[int]:
+        """Every worker, best first, for requests that fall through on failure."""
+        now = time.monotonic()
+        usable = sorted(self.available(), key=lambda i: self.workers[i].score())
+        rest = sorted(
+            (w for w in self.workers if w.index not in usable),
+            key=lambda w: (not w.up, max(w.blocked_until() - now, 0))
+        )
+        return usable + [w.index for w in rest]
+
+    def usable(self, index: int) -> bool:
+        return self._usable(self.workers[index], time.monotonic())
+
+    def flood_remaining(self, index: int) -> float:
+        return max(self.workers[index].flood_until - time.monotonic(), 0.0)
+
+    def flooded(self, index: int, seconds: int):
+        worker = self.workers[index]
+        worker.flood_until = max(worker.flood_until, time.monotonic() + seconds + 1)
+
+    def active(self) -> List[int]:
+        """Workers the pool is running (healthy or being reconnected)."""
+        return [w.index for w in self.workers if not w.parked]
+
+    def load(self) -> int:
+        return sum(w.inflight for w in self.workers)
+
+    def idle(self, seconds: float) -> List[int]:
+        """Running workers with nothing in flight for `seconds`."""
+        now = time.monotonic()
+        return [w.index for w in self.workers
+                if w.up and not w.parked and w.inflight == 0 and now - w.last_used > seconds]
+
+    def claim(self, index: int):
+        """The pool is bringing this worker up; failures from here on get reconnects."""
+        self.workers[index].parked = False
+
+    def park(self, index: int):
+        """Take a worker out of rotation on purpose (no reconnect)."""
+        worker = self.workers[index]
+        worker.up = False
+        worker.parked = True
+
+    def mark_up(self, index: int):
+        worker = self.workers[index]
+        worker.up = True
+        worker.parked = False
+        worker.last_used = time.monotonic()
+        worker.failures = 0
+        worker.quarantined_until = 0.0
+
+    def mark_down(self, index: int, reason: str):
+        """Quarantine a worker and reconnect it in the background."""
+        worker = self.workers[index]
+        worker.quarantined_until = time.monotonic() + WORKER_QUARANTINE_SECONDS
+        if worker.reconnecting or worker.parked:
+            return
+        print(f"[POOL] Worker {index} quarantined ({reason})")
+        worker.reconnecting = True
+        asyncio.ensure_future(self._reconnect_loop(worker))
+
+    async def _reconnect_loop(self, worker: WorkerState):
+        delay = 2
+        try:
+            while True:
+                await asyncio.sleep(delay)
+                try:
+                    await self._reconnect(worker.index)
+                    self.mark_up(worker.index)
+                    print(f"[POOL] Worker {worker.index} reconnected")
+                    return
+                except errors.FloodWaitError as e:
+                    delay = e.seconds + 1
+                except Exception as e:
+                    print(f"[POOL] Worker {worker.index} reconnect failed: {e}")
+                    delay = min(delay * 2, WORKER_RECONNECT_MAX_SECONDS)
+                worker.quarantined_until = time.monotonic() + delay
+        finally:
+            worker.reconnecting = False
+
+    @asynccontextmanager
+    async def track(self, index: int):
+        """Account one Telegram request on a worker and learn from how it went."""
+        worker = self.workers[index]
+        worker.inflight += 1
+        started = time.monotonic()
+        try:
+            yield self.clients[index]
+        except errors.FloodWaitError as e:
+            worker.errors += 1
+            self.flooded(index, e.seconds)
+            raise
+        except CONNECTION_ERRORS:
+            worker.errors += 1
+            worker.failures += 1
+            if worker.failures >= WORKER_MAX_FAILURES:
+                self.mark_down(index, f"{worker.failures} consecutive failures")
+            raise
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # The worker answered, the request itself was bad
+            worker.failures = 0
+            raise
+        else:
+            worker.failures = 0
+            worker.served += 1
+            elapsed = time.monotonic() - started
+            worker.latency += LATENCY_ALPHA * (elapsed - worker.latency)
+        finally:
+            worker.inflight -= 1
+            worker.last_used = time.monotonic()
+
+    def stats(self) -> List[Dict]:
+        now = time.monotonic()
+        return [
+            {
+                "worker": w.index,
+                "up": w.up,
+                "parked": w.parked,
+                "connected": self.clients[w.index].is_connected(),
+                "inflight": w.inflight,
+                "latency_ms": round(w.latency * 1000, 1),
+                "flood_wait": round(max(w.flood_until - now, 0), 1),
+                "quarantined": round(max(w.quarantined_until - now, 0), 1),
+                "served": w.served,
+                "errors": w.errors,
+            }
+            for w in self.workers
+        ]